@@ -1,15 +1,12 @@
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import text
 
-from core.config import DB_NAME
+from core.database.models import get_engine
 
 def check_db_connection():
     try:
-        engine = create_engine(f"sqlite:///{DB_NAME}")
-        Session = sessionmaker(bind=engine)
-        session = Session()
-        session.execute(text("SELECT 1"))
-        session.close()
+        # Общий engine: соединение берется из пула, а не создается заново
+        with get_engine().connect() as connection:
+            connection.execute(text("SELECT 1"))
         return "ok"
     except Exception:
         return "error"
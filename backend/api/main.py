@@ -1,17 +1,31 @@
 import uvicorn
 from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import PlainTextResponse
 from fastapi.staticfiles import StaticFiles
+from datetime import datetime
 from typing import Optional
 
-from core.config import API_PORT
+from core.config import API_PORT, SEARCH_RANK_WINDOW
 from api.health_check import check_db_connection
 from core.database.repo import (
-    get_blocked_emails,
+    get_blocked_emails_page,
+    search_blocked_emails,
     get_blocked_email_by_id,
     get_blocked_emails_count,
     delete_blocked_email,
     clear_all_blocked_emails
 )
+from core.classifier import get_pipeline_stats
+from core.database.writer import blocked_email_writer
+from core.logger import log
+from core.metrics import render_metrics
+from core.tracing import slow_traces
+from core.ollama.batcher import batch_classifier
+from core.ollama.cache import verdict_cache
+from core.ollama.client import model_latency, warmup_report
+from core.ollama.similarity import near_duplicates
+from core.smtp.relay import relay_pool
+from core.smtp.spool import message_spool
 
 app = FastAPI()
 
@@ -22,22 +36,70 @@ app.mount("/interface", StaticFiles(directory="web/interface", html=True), name=
 def health():
     return {"database": check_db_connection()}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Метрики в текстовом формате Prometheus."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # --- API для работы с заблокированными письмами ---
 
 @app.get("/api/blocked-emails")
 def get_blocked_emails_api(
     limit: int = Query(50, ge=1, le=200),
-    page: int = Query(1, ge=1)
+    page: int = Query(1, ge=1),
+    cursor: Optional[str] = None
 ):
-    offset = (page - 1) * limit
-    emails = get_blocked_emails(limit=limit, offset=offset)
+    """
+    Список заблокированных писем от новых к старым.
+    Для перехода дальше передается cursor из next_cursor предыдущего ответа;
+    page оставлен для совместимости и на глубоких страницах медленнее.
+    """
+    try:
+        emails, next_cursor = get_blocked_emails_page(
+            limit=limit, cursor=cursor, offset=0 if cursor else (page - 1) * limit
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     total_count = get_blocked_emails_count()
     return {
         "emails": emails,
         "total": total_count,
         "page": page,
         "limit": limit,
-        "total_pages": (total_count + limit - 1) // limit if total_count > 0 else 1
+        "total_pages": (total_count + limit - 1) // limit if total_count > 0 else 1,
+        "next_cursor": next_cursor
+    }
+
+# Объявлен до /api/blocked-emails/{email_id}, иначе "search" разбирался бы как id
+@app.get("/api/blocked-emails/search")
+def search_blocked_emails_api(
+    q: str = Query(..., min_length=1, max_length=500),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    sender: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None
+):
+    """
+    Полнотекстовый поиск по заблокированным письмам, лучшие совпадения первыми.
+    Слова запроса объединяются по И, "слово*" ищет по префиксу.
+    """
+    try:
+        emails, next_cursor, truncated = search_blocked_emails(
+            q, limit=limit, cursor=cursor, sender=sender, since=since, until=until
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {
+        "emails": emails,
+        "query": q,
+        "limit": limit,
+        "next_cursor": next_cursor,
+        # Ранжируются только последние rank_window совпадений; truncated — были более старые
+        "rank_window": SEARCH_RANK_WINDOW,
+        "truncated": truncated
     }
 
 @app.get("/api/blocked-emails/{email_id}")
@@ -59,9 +121,49 @@ def clear_all_blocked_emails_api():
     clear_all_blocked_emails()
     return {"message": "Все заблокированные письма были удалены"}
 
+@app.get("/api/spool/dead")
+def get_dead_letters_api(limit: int = Query(50, ge=1, le=500)):
+    """Письма, которые не удалось доставить после всех попыток."""
+    return {"messages": message_spool.dead_letters(limit), "total": message_spool.stats()["dead"]}
+
+@app.post("/api/spool/dead/requeue")
+def requeue_dead_letters_api():
+    """Возвращает все недоставляемые письма в очередь пересылки."""
+    return {"requeued": message_spool.requeue()}
+
+@app.post("/api/spool/dead/{message_id}/requeue")
+def requeue_dead_letter_api(message_id: int):
+    if not message_spool.requeue(message_id):
+        raise HTTPException(status_code=404, detail="Недоставляемое письмо не найдено")
+    return {"requeued": 1}
+
+@app.get("/api/traces/slow")
+def get_slow_traces_api(limit: int = Query(20, ge=1, le=200)):
+    """Самые медленные недавние письма с разбивкой по стадиям."""
+    return {"stats": slow_traces.stats(), "traces": slow_traces.slowest(limit)}
+
+@app.get("/api/traces/{trace_id}")
+def get_trace_api(trace_id: str):
+    trace = slow_traces.get(trace_id)
+    if not trace:
+        raise HTTPException(status_code=404, detail="Трасса не найдена среди медленных")
+    return trace
+
 @app.get("/api/stats")
 def get_stats_api():
     return {
         "blocked_emails_count": get_blocked_emails_count(),
         "database_status": check_db_connection(),
+        "pipeline": get_pipeline_stats(),
+        "verdict_cache": verdict_cache.stats(),
+        "near_duplicates": near_duplicates.stats(),
+        "batching": batch_classifier.stats(),
+        "model_latency": model_latency.stats(),
+        "warmup": warmup_report,
+        "relay": relay_pool.stats(),
+        "spool": message_spool.stats(),
+        "spool_dead_letters": message_spool.dead_letters(10),
+        "blocked_log": blocked_email_writer.stats(),
+        "traces": slow_traces.stats(),
+        "logging": log.stats(),
     }
\ No newline at end of file
@@ -12,14 +12,18 @@ import time
 
 # Импорты из новой структуры
 from utils.mailhog_manager import MailHogManager
-from core.ollama.client import test_ollama_connection
+from utils.smtp_sink import SMTPSink
+from core.ollama.client import test_ollama_connection, warm_up_models
 from core.smtp.server import run_smtp_server
-from core.config import SMTP_PORT, API_PORT, MAILHOG_WEB_PORT, MAILHOG_HOST
+from core.config import SMTP_PORT, API_PORT, MAILHOG_WEB_PORT, MAILHOG_HOST, OLLAMA_WARMUP
 from api.main import app
 
 class SMTPFilterLauncher:
-    def __init__(self):
+    def __init__(self, use_sink: bool = False):
         self.mailhog_manager = MailHogManager()
+        # Куда фильтр пересылает безопасные письма: MailHog или встроенный приемник
+        self.use_sink = use_sink
+        self.downstream = SMTPSink() if use_sink else self.mailhog_manager
 
     def check_dependencies(self) -> bool:
         """Проверяет все зависимости системы."""
@@ -29,12 +33,29 @@ class SMTPFilterLauncher:
             return False
         print("Ollama доступна")
 
+        if self.use_sink:
+            print("Используется встроенный SMTP-приемник вместо MailHog")
+            return True
         if not Path(self.mailhog_manager.mailhog_path).exists():
             print(f"MailHog не найден: {self.mailhog_manager.mailhog_path}")
             return False
         print("MailHog найден")
         return True
 
+    def warm_up_models(self):
+        """Прогревает модели Ollama и печатает отчет холодного и теплого запуска."""
+        print("\nПрогрев моделей Ollama...")
+        report = warm_up_models()
+        print(f"{'Модель':<28} {'Загрузка, мс':>13} {'1-й запрос, мс':>15} {'Повтор, мс':>11} {'Токенов промта':>15}")
+        print("-" * 86)
+        for model, result in report.items():
+            if "error" in result:
+                print(f"{model:<28} ошибка: {result['error']}")
+                continue
+            print(f"{model:<28} {result['cold']['wall_ms']:>13.0f} {result['first']['wall_ms']:>15.0f} "
+                  f"{result['warm']['wall_ms']:>11.0f} "
+                  f"{result['first']['prompt_eval_count']:>7} → {result['warm']['prompt_eval_count']:<6}")
+
     def start_api_server(self):
         """Запускает API сервер uvicorn."""
         print(f"API-сервер запускается на http://0.0.0.0:{API_PORT}")
@@ -49,8 +70,11 @@ class SMTPFilterLauncher:
             print("Проверка зависимостей не прошла. Выход.")
             return
 
-        if not self.mailhog_manager.start():
-            print("Не удалось запустить MailHog. Выход.")
+        if OLLAMA_WARMUP:
+            self.warm_up_models()
+
+        if not self.downstream.start():
+            print("Не удалось запустить почтовый приемник. Выход.")
             return
 
         print("\nЗапуск основных сервисов...")
@@ -73,8 +97,8 @@ class SMTPFilterLauncher:
         except KeyboardInterrupt:
             print("\nПолучен сигнал Ctrl+C. Идет остановка сервисов...")
         finally:
-            print("Остановка MailHog...")
-            self.mailhog_manager.stop()
+            print("Остановка почтового приемника...")
+            self.downstream.stop()
             print("Все сервисы корректно остановлены.")
 
     def show_status(self):
@@ -85,19 +109,20 @@ class SMTPFilterLauncher:
             print("Ollama: Работает")
         else:
             print("Ollama: Недоступна")
-        self.mailhog_manager.status()
+        self.downstream.status()
         print(f"\nПорты:")
         print(f"  SMTP фильтр: {SMTP_PORT}")
         print(f"  API сервер: {API_PORT}")
 
 def main():
     """Главная функция launcher."""
-    launcher = SMTPFilterLauncher()
+    launcher = SMTPFilterLauncher(use_sink="--sink" in sys.argv)
     
     if len(sys.argv) < 2:
         print("SMTP Filter System - Управление")
         print("-" * 40)
         print("  python app.py start     - Запустить всю систему")
+        print("  python app.py start --sink - Запустить со встроенным SMTP-приемником вместо MailHog")
         print("  python app.py status    - Показать статус")
         print("  python app.py stop      - Остановить MailHog")
         print("  python app.py test      - Запустить интеграционные тесты")
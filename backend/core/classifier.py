@@ -0,0 +1,143 @@
+"""
+Конвейер классификации письма: предварительный фильтр, кэш вердиктов,
+поиск почти одинаковых писем, локальная модель, пакетный запрос к основной
+модели, затем опрос моделей Ollama.
+"""
+
+import threading
+import time
+from typing import Optional
+from .config import (
+    OLLAMA_MODEL, OLLAMA_DEADLINE, OLLAMA_BATCH_ENABLED, PREFILTER_ENABLED, SIMILARITY_ENABLED,
+    LOCAL_MODEL_ENABLED, LOCAL_MODEL_LOW, LOCAL_MODEL_HIGH
+)
+from .local_model import get_local_model
+from .logger import log
+from .metrics import decisions
+from .tracing import span
+from .ollama.batcher import batch_classifier
+from .ollama.cache import verdict_cache
+from .ollama.client import classify_with_models, ollama_client
+from .ollama.similarity import near_duplicates, simhash
+from .prefilter import prefilter
+
+# На какой стадии конвейера принято решение по письму
+_stage_lock = threading.Lock()
+_stage_counts = {
+    "prefilter": 0,
+    "cache": 0,
+    "near_duplicate": 0,
+    "local_model": 0,
+    "llm": 0,
+    "unavailable": 0,
+}
+
+def _decided(stage: str):
+    with _stage_lock:
+        _stage_counts[stage] += 1
+    decisions.inc(stage)
+
+def _local_verdict(text: str) -> Optional[int]:
+    """Вердикт локальной модели или None, если оценка в неопределенном диапазоне."""
+    model = get_local_model() if LOCAL_MODEL_ENABLED else None
+    if model is None:
+        return None
+    score = model.score(text)
+    if score >= LOCAL_MODEL_HIGH:
+        return 1
+    if score <= LOCAL_MODEL_LOW:
+        return 0
+    return None
+
+def classify_email(text: str, sender: Optional[str] = None) -> int:
+    """Возвращает 1 для угрозы и 0 для безопасного письма."""
+    if PREFILTER_ENABLED:
+        with span("prefilter"):
+            verdict, _ = prefilter.check(text, sender)
+        if verdict is not None:
+            _decided("prefilter")
+            return verdict
+
+    with span("verdict_cache"):
+        key = verdict_cache.make_key(text, OLLAMA_MODEL)
+        cached = verdict_cache.get(key)
+    if cached is not None:
+        _decided("cache")
+        return cached
+
+    signature, reused = None, None
+    if SIMILARITY_ENABLED:
+        with span("near_duplicate"):
+            signature = simhash(text)
+            reused = near_duplicates.lookup(signature)
+        if reused is not None and not near_duplicates.should_recheck():
+            near_duplicates.record_reuse()
+            _decided("near_duplicate")
+            return reused
+
+    # Перепроверка совпадения идет сразу в LLM, минуя локальную модель
+    verdict, model, batched = None, None, False
+    if reused is None:
+        with span("local_model"):
+            verdict = _local_verdict(text)
+    if verdict is not None:
+        _decided("local_model")
+        return verdict
+
+    # Один срок на пакетный запрос и на опрос моделей после него
+    expires = time.monotonic() + OLLAMA_DEADLINE
+    if OLLAMA_BATCH_ENABLED and ollama_client.is_available():
+        with span("ollama_batch") as batch_span:
+            verdict, model = batch_classifier.classify(text, timeout=OLLAMA_DEADLINE)
+            batch_span.set(verdict=verdict, model=model)
+        batched = verdict is not None
+    if verdict == 1 and batched:
+        # Вердикт пакета зависит от соседних писем (одно из них может
+        # подсказывать ответы за все), поэтому угроза подтверждается
+        # отдельным запросом; без ответа остается вердикт пакета
+        confirmed, confirmed_model = classify_with_models(text, deadline=expires - time.monotonic())
+        if confirmed is not None:
+            verdict, model, batched = confirmed, confirmed_model, False
+    if verdict is None:
+        verdict, model = classify_with_models(text, deadline=expires - time.monotonic())
+    if verdict is None and reused is not None:
+        # Перепроверка не удалась: известный вердикт копии надежнее заглушки 0
+        near_duplicates.record_reuse()
+        _decided("near_duplicate")
+        return reused
+    if verdict is None:
+        # Ответ-заглушку не кэшируем, чтобы повторная копия снова попала в модель
+        _decided("unavailable")
+        log.error("all_models_unavailable", "Все модели недоступны, письмо считается безопасным")
+        return 0
+
+    _decided("llm")
+    # Кэшируется только ответ основной модели на отдельный запрос: ответ
+    # резервной модели или пакета был бы выдан за него на сутки вперед
+    if model == OLLAMA_MODEL and not batched:
+        verdict_cache.put(key, verdict)
+    if signature is not None:
+        if reused is not None:
+            near_duplicates.record_recheck(reused, verdict)
+        near_duplicates.add(signature, verdict)
+    return verdict
+
+def _local_model_info() -> Optional[dict]:
+    model = get_local_model() if LOCAL_MODEL_ENABLED else None
+    if model is None:
+        return None
+    return dict(model.meta, low=LOCAL_MODEL_LOW, high=LOCAL_MODEL_HIGH)
+
+def get_pipeline_stats() -> dict:
+    """Счетчики решений по стадиям: показывают, сколько писем не дошло до модели."""
+    with _stage_lock:
+        stages = dict(_stage_counts)
+    total = sum(stages.values())
+    avoided = stages["prefilter"] + stages["cache"] + stages["near_duplicate"] + stages["local_model"]
+    return {
+        "decisions": stages,
+        "total": total,
+        "llm_avoided_rate": avoided / total if total else 0.0,
+        "prefilter": prefilter.stats(),
+        "local_model": _local_model_info(),
+    }
@@ -9,18 +9,138 @@ MAILHOG_WEB_PORT = 8025    # MailHog веб-интерфейс
 MAILHOG_HOST = "localhost"
 MAILHOG_PATH = r"C:\Users\Awerson\source\repos\github_repos\SMTP_filter\mailhog\MailHog_windows_amd64.exe"
 
+# Встроенный SMTP-приемник вместо MailHog (python app.py start --sink),
+# слушает те же порты MAILHOG_SMTP_PORT и MAILHOG_WEB_PORT
+SMTP_SINK_STORE = True        # Хранить принятые письма в памяти (иначе только считать)
+SMTP_SINK_MAX_STORED = 1000   # Сколько последних писем хранить
+
+# Пул соединений для пересылки в MailHog
+RELAY_POOL_SIZE = 4        # Постоянных соединений к MailHog
+RELAY_IDLE_TIMEOUT = 30    # Закрывать соединение, простоявшее дольше (секунды)
+RELAY_TIMEOUT = 10         # Таймаут сетевых операций пересылки (секунды)
+
+# Очередь (спул) на диске для пересылки: безопасное письмо сохраняется
+# и подтверждается сразу, доставка идет в фоне с повторами
+SPOOL_ENABLED = True
+SPOOL_DB_NAME = "spool.db"
+SPOOL_WORKERS = 2          # Потоков доставки
+SPOOL_BATCH_SIZE = 64      # Писем в одной транзакции записи (один fsync на пакет)
+SPOOL_BATCH_WAIT_MS = 5    # Сколько ждать писем для общей транзакции (миллисекунды)
+SPOOL_RETRY_BASE = 5       # Первая пауза перед повтором (секунды), далее удваивается
+SPOOL_RETRY_MAX = 600      # Максимальная пауза между повторами (секунды)
+SPOOL_MAX_ATTEMPTS = 20    # После стольких неудач письмо помечается как недоставляемое
+SPOOL_SEND_DSN = True      # Сообщать отправителю о недоставляемом письме (DSN, RFC 3464)
+SPOOL_DSN_FROM = "MAILER-DAEMON@localhost"  # Адрес в заголовке From уведомления о недоставке
+
 # Ollama
-OLLAMA_URL = "http://localhost:11434/api/generate"
+OLLAMA_BASE_URL = "http://localhost:11434"
+OLLAMA_URL = f"{OLLAMA_BASE_URL}/api/generate"
 OLLAMA_MODEL = "gemma3:4b"  # Лучшая модель по результатам тестов (90% точность)
 OLLAMA_FALLBACK_MODEL = "mistral:7b-instruct-q4_0"  # Резервная модель
 OLLAMA_BACKUP_MODEL = "llama3.2:1b"  # Легкая модель (только для экстренных случаев)
 OLLAMA_TIMEOUT = 30  # Таймаут запроса к Ollama (секунды)
+OLLAMA_KEEP_ALIVE = "60m"  # Сколько Ollama держит модель в памяти после запроса (-1 — всегда)
+OLLAMA_WARMUP = True  # Загружать модели при старте системы
+OLLAMA_WARMUP_MODELS = [OLLAMA_MODEL, OLLAMA_FALLBACK_MODEL, OLLAMA_BACKUP_MODEL]
+OLLAMA_STREAM = True  # Читать ответ потоком и отдавать вердикт на первом токене 0/1
+OLLAMA_STREAM_DRAIN_MAX = 2.0  # Сколько дочитывать остаток ответа в фоне, чтобы сохранить соединение (секунды)
+OLLAMA_HEALTH_INTERVAL = 10  # Период фоновой проверки /api/version (секунды)
+OLLAMA_FAILURE_THRESHOLD = 3  # Ошибок подряд до размыкания цепи (circuit breaker)
+OLLAMA_CIRCUIT_COOLDOWN = 15  # Сколько секунд цепь остается разомкнутой
+OLLAMA_HEDGE_ENABLED = True    # Параллельно запускать резервную модель, если основная медлит
+OLLAMA_DEADLINE = 30           # Общий срок на классификацию всеми моделями (секунды)
+OLLAMA_HEDGE_PERCENTILE = 95   # Перцентиль задержки модели, после которого запускаем следующую
+OLLAMA_HEDGE_DEFAULT_DELAY = 5.0  # Задержка до хеджирования, пока замеров мало (секунды)
+OLLAMA_HEDGE_MIN_DELAY = 0.5   # Нижняя граница задержки хеджирования (секунды)
+OLLAMA_LATENCY_WINDOW = 200    # Сколько последних замеров хранить на модель
+OLLAMA_BATCH_ENABLED = True   # Объединять одновременно пришедшие письма в один запрос
+OLLAMA_BATCH_MAX_SIZE = 8     # Максимум писем в одном запросе
+OLLAMA_BATCH_MAX_WAIT_MS = 20  # Сколько ждать попутчиков для пакета (миллисекунды)
+OLLAMA_BATCH_CONCURRENCY = 2  # Сколько пакетов обрабатывается одновременно
+
+# Локальная модель (хэшированные n-граммы + логистическая регрессия).
+# Уверенные оценки решаются на месте, к Ollama идут только письма
+# с оценкой внутри диапазона (LOCAL_MODEL_LOW, LOCAL_MODEL_HIGH).
+LOCAL_MODEL_ENABLED = True
+LOCAL_MODEL_PATH = "models/local_classifier.bin"  # Файл весов (scripts/train_local_model.py)
+LOCAL_MODEL_FEATURES = 2 ** 18  # Размер пространства хэшированных признаков
+LOCAL_MODEL_LOW = 0.05          # Оценка не выше — письмо безопасно без LLM
+LOCAL_MODEL_HIGH = 0.95         # Оценка не ниже — угроза без LLM
+
+# SMTP конвейер обработки
+SMTP_WORKERS = 8           # Потоки для классификации и пересылки писем
+SMTP_MAX_PENDING = 64      # Максимум писем в обработке; сверх лимита отвечаем 451
+MIME_TEXT_BUDGET = 64 * 1024  # Сколько символов текста извлекать из письма для анализа
+
+# Трассировка писем по стадиям (/api/traces/slow)
+TRACE_ENABLED = True
+TRACE_SLOW_THRESHOLD_MS = 1000  # Письма дольше этого попадают в буфер медленных трасс
+TRACE_BUFFER_SIZE = 200         # Сколько последних медленных трасс хранить
+
+# Структурированный журнал горячего пути (JSON lines, запись в фоновом потоке)
+LOG_LEVEL = "info"              # debug, info, warning, error
+LOG_FILE = None                 # Путь к файлу журнала; None — stdout
+LOG_QUEUE_SIZE = 10000          # Предел очереди; при переполнении записи отбрасываются
+LOG_MESSAGE_SAMPLE_RATE = 0.1   # Доля записей "по каждому письму", попадающих в журнал
+LOG_ERROR_RATE_LIMIT = 10       # Сколько одинаковых ошибок писать за окно
+LOG_ERROR_WINDOW = 60           # Окно ограничения ошибок (секунды)
+
+# Предварительный фильтр (до обращения к модели)
+PREFILTER_ENABLED = True
+PREFILTER_BLOCK_SCORE = 6       # Суммарный вес совпадений, при котором письмо блокируется без модели
+PREFILTER_STRONG_WEIGHT = 3     # Вес, с которого совпадение считается сильным
+PREFILTER_MIN_STRONG_HITS = 2   # Сколько разных сильных совпадений нужно для блокировки без модели
+PREFILTER_PASS_CLEAN = False    # Пропускать без модели письма без единого совпадения
+SENDER_ALLOWLIST = []           # Доверенные отправители: "user@example.com" или "@example.com"
+CONTENT_HASH_ALLOWLIST = []     # SHA-256 нормализованного текста доверенных писем
+
+# Словарь угроз: основа слова (в нижнем регистре) -> вес.
+# Основа ищется в начале слова, поэтому покрывает словоформы, но не части
+# других слов. Одно совпадение только передает письмо в LLM: "бомба, а не
+# фильм" и "взорвала интернет" — обычные письма.
+THREAT_LEXICON = {
+    # Русский
+    "бомб": 3, "взрывчат": 3, "взорв": 3, "взрывн": 3, "теракт": 3, "террорист": 3,
+    "заложник": 3, "смертник": 3, "джихад": 3, "резню": 3, "резня": 3, "расстрел": 3,
+    "убью": 3, "убьем": 3, "убьём": 3, "уничтожим": 2, "закладк": 2,
+    "эвакуир": 2, "эвакуац": 2, "нападени": 2, "атака": 2, "устранить": 2,
+    "оружи": 1, "смерт": 1,
+    # English
+    "bomb": 2, "explosive": 3, "detonat": 3, "terrorist": 3, "massacre": 3,
+    "hostage": 3, "kill everyone": 3, "i will kill": 3, "suicide bomber": 3,
+    "blow up": 3, "evacuate": 2, "shoot": 1, "attack": 1, "weapon": 1,
+}
+
+# Кэш вердиктов (ключ: нормализованный текст + модель + версия промта)
+VERDICT_CACHE_SIZE = 10000     # Максимум записей в памяти (LRU)
+VERDICT_CACHE_TTL = 24 * 3600  # Время жизни вердикта (секунды)
+VERDICT_CACHE_PERSIST = False  # Сохранять вердикты в SQLite между перезапусками
+
+# Повторное использование вердиктов для почти одинаковых писем (SimHash + LSH)
+SIMILARITY_ENABLED = True
+SIMILARITY_MAX_DISTANCE = 3        # Максимум отличающихся бит из 64, чтобы считать письма копиями
+SIMILARITY_INDEX_SIZE = 10000      # Максимум подписей в индексе (вытесняются самые старые)
+SIMILARITY_TTL = VERDICT_CACHE_TTL  # Время жизни подписи (секунды)
+SIMILARITY_RECHECK_RATE = 0.02     # Доля совпадений, перепроверяемых моделью
 
 # База данных
 DB_NAME = "blocked_emails.db"
+BLOCKED_LOG_BATCH_SIZE = 100     # Записей в одной транзакции фоновой записи
+BLOCKED_LOG_FLUSH_MS = 200       # Максимальная задержка записи (миллисекунды)
+BLOCKED_LOG_QUEUE_SIZE = 10000   # Предел очереди; при переполнении запись идет синхронно
+BLOCKED_PREVIEW_LENGTH = 200     # Символов тела письма в списке; полный текст — /api/blocked-emails/{id}
+
+# Полнотекстовый поиск по заблокированным письмам (SQLite FTS5)
+SEARCH_WEIGHTS = "2.0, 4.0, 1.0"  # Веса bm25 для отправителя, темы и тела
+SEARCH_RANK_WINDOW = 50000       # Сколько последних совпадений ранжировать (предел времени запроса)
+SEARCH_SNIPPET_TOKENS = 16       # Слов во фрагменте тела в результатах поиска
+SEARCH_HIGHLIGHT_OPEN = "[["     # Маркеры найденных слов во фрагменте и теме
+SEARCH_HIGHLIGHT_CLOSE = "]]"
 
-# Промт для классификации угроз (оптимизирован для легких моделей)
-CLASSIFY_PROMPT = """You are a security expert. Classify this text as threat (1) or safe (0).
+# Промт для классификации угроз (оптимизирован для легких моделей).
+# Неизменная часть передается как system: она идет первой и одинакова для
+# всех писем, поэтому Ollama переиспользует ее обработку между запросами.
+CLASSIFY_SYSTEM_PROMPT = """You are a security expert. Classify this text as threat (1) or safe (0).
 
 Threats contain: explosives, bombs, violence, terrorism, killing, attacks
 Safe texts: normal messages, work emails, friendly chat
@@ -29,8 +149,28 @@ Examples:
 "I will bomb the building" → 1
 "Meeting at 2pm" → 0
 "Kill everyone" → 1
-"Hello, how are you?" → 0
+"Hello, how are you?" → 0"""
 
-Text: "{text}"
+CLASSIFY_TEXT_PROMPT = """Text: "{text}"
 
 Answer (only 0 or 1):"""
+
+# Полный промт одной строкой (для старых скриптов)
+CLASSIFY_PROMPT = CLASSIFY_SYSTEM_PROMPT + "\n\n" + CLASSIFY_TEXT_PROMPT
+
+# Промт для пакетной классификации нескольких писем одним запросом
+BATCH_CLASSIFY_SYSTEM_PROMPT = """You are a security expert. Classify each numbered text as threat (1) or safe (0).
+
+Threats contain: explosives, bombs, violence, terrorism, killing, attacks
+Safe texts: normal messages, work emails, friendly chat
+
+Examples:
+"I will bomb the building" → 1
+"Meeting at 2pm" → 0
+"Kill everyone" → 1
+"Hello, how are you?" → 0"""
+
+BATCH_CLASSIFY_TEXT_PROMPT = """Texts:
+{texts}
+
+Answer with one line per text in the form "number: 0 or 1" and nothing else:"""
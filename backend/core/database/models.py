@@ -1,4 +1,7 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime
+import sqlite3
+import threading
+from sqlalchemy import create_engine, event, Column, Index, Integer, String, Text, DateTime, Float, LargeBinary
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
 from ..config import DB_NAME
@@ -17,7 +20,143 @@ class BlockedEmail(Base):
     threat_probability = Column(Integer, nullable=False)  # 0 или 1
     timestamp = Column(DateTime, server_default=func.now())
 
+    # Страницы списка читаются по (timestamp, id) от новых к старым
+    __table_args__ = (Index("ix_blocked_emails_timestamp_id", "timestamp", "id"),)
+
+class TableCounter(Base):
+    """Число строк таблицы, поддерживаемое триггерами (вместо COUNT(*) на каждый запрос)."""
+    __tablename__ = "table_counters"
+
+    name = Column(String(64), primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
+
+class VerdictCacheEntry(Base):
+    """Сохраненный вердикт классификатора (кэш между перезапусками)."""
+    __tablename__ = "verdict_cache"
+
+    key = Column(String(64), primary_key=True)
+    verdict = Column(Integer, nullable=False)  # 0 или 1
+    created_at = Column(Float, nullable=False)  # Unix time
+
+# Отдельная база для очереди пересылки (файл SPOOL_DB_NAME)
+SpoolBase = declarative_base()
+
+class SpooledMessage(SpoolBase):
+    """Письмо, ожидающее доставки в MailHog."""
+    __tablename__ = "spool"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    sender = Column(String(255), nullable=False)
+    recipients = Column(Text, nullable=False)  # JSON-список адресов
+    data = Column(LargeBinary, nullable=False)
+    status = Column(String(16), nullable=False, default="queued", index=True)  # queued, sending, dead
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(Float, nullable=False, index=True)  # Unix time
+    last_error = Column(Text)
+    created_at = Column(Float, nullable=False)
+
+_engine = None
+_schema_ready = False
+_init_lock = threading.Lock()
+
+def _configure_connection(dbapi_connection, _):
+    """Настройки SQLite для каждого нового соединения пула."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
+
+def get_engine() -> Engine:
+    """Возвращает общий для процесса engine (создается один раз)."""
+    global _engine
+    if _engine is None:
+        with _init_lock:
+            if _engine is None:
+                engine = create_engine(
+                    f"sqlite:///{DB_NAME}",
+                    connect_args={"check_same_thread": False}
+                )
+                event.listen(engine, "connect", _configure_connection)
+                _engine = engine
+    return _engine
+
+# Дополнения схемы для уже существующих баз: create_all не трогает созданные
+# таблицы. Выполняется одной транзакцией, чтобы начальное значение счетчика
+# и триггеры не разошлись со вставками из другого процесса.
+_SCHEMA_UPGRADE = """
+BEGIN IMMEDIATE;
+CREATE INDEX IF NOT EXISTS ix_blocked_emails_timestamp_id ON blocked_emails (timestamp, id);
+INSERT OR IGNORE INTO table_counters (name, value)
+    SELECT 'blocked_emails', COUNT(*) FROM blocked_emails;
+CREATE TRIGGER IF NOT EXISTS blocked_emails_count_insert AFTER INSERT ON blocked_emails
+BEGIN
+    UPDATE table_counters SET value = value + 1 WHERE name = 'blocked_emails';
+END;
+CREATE TRIGGER IF NOT EXISTS blocked_emails_count_delete AFTER DELETE ON blocked_emails
+BEGIN
+    UPDATE table_counters SET value = value - 1 WHERE name = 'blocked_emails';
+END;
+COMMIT;
+"""
+
+# Полнотекстовый индекс писем (FTS5, внешнее содержимое — таблица blocked_emails).
+# Триггеры держат его в синхронизации; для базы, где письма уже есть,
+# индекс один раз строится командой rebuild.
+_FTS_SCHEMA = """
+BEGIN IMMEDIATE;
+CREATE VIRTUAL TABLE IF NOT EXISTS blocked_emails_fts USING fts5(
+    sender, subject, body,
+    content='blocked_emails', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+);
+INSERT INTO blocked_emails_fts (blocked_emails_fts) SELECT 'rebuild'
+    WHERE NOT EXISTS (SELECT 1 FROM blocked_emails_fts_docsize) AND EXISTS (SELECT 1 FROM blocked_emails);
+CREATE TRIGGER IF NOT EXISTS blocked_emails_fts_insert AFTER INSERT ON blocked_emails
+BEGIN
+    INSERT INTO blocked_emails_fts (rowid, sender, subject, body)
+        VALUES (new.id, new.sender, new.subject, new.body);
+END;
+CREATE TRIGGER IF NOT EXISTS blocked_emails_fts_delete AFTER DELETE ON blocked_emails
+BEGIN
+    INSERT INTO blocked_emails_fts (blocked_emails_fts, rowid, sender, subject, body)
+        VALUES ('delete', old.id, old.sender, old.subject, old.body);
+END;
+CREATE TRIGGER IF NOT EXISTS blocked_emails_fts_update AFTER UPDATE ON blocked_emails
+BEGIN
+    INSERT INTO blocked_emails_fts (blocked_emails_fts, rowid, sender, subject, body)
+        VALUES ('delete', old.id, old.sender, old.subject, old.body);
+    INSERT INTO blocked_emails_fts (rowid, sender, subject, body)
+        VALUES (new.id, new.sender, new.subject, new.body);
+END;
+COMMIT;
+"""
+
+# False, если SQLite собран без FTS5: поиск тогда недоступен, остальное работает
+fts_available = False
+
+def _upgrade_schema(engine: Engine):
+    global fts_available
+    connection = engine.raw_connection()
+    try:
+        connection.driver_connection.executescript(_SCHEMA_UPGRADE)
+        try:
+            connection.driver_connection.executescript(_FTS_SCHEMA)
+            fts_available = True
+        except sqlite3.OperationalError as e:
+            connection.driver_connection.rollback()
+            print(f"Полнотекстовый поиск недоступен (FTS5): {e}")
+    finally:
+        connection.close()
+
 def init_db():
-    """Инициализирует базу данных."""
-    engine = create_engine(f"sqlite:///{DB_NAME}")
-    Base.metadata.create_all(engine)
+    """Инициализирует базу данных (схема создается один раз за процесс)."""
+    global _schema_ready
+    if _schema_ready:
+        return
+    engine = get_engine()
+    with _init_lock:
+        if not _schema_ready:
+            Base.metadata.create_all(engine)
+            _upgrade_schema(engine)
+            _schema_ready = True
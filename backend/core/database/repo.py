@@ -1,16 +1,27 @@
-from sqlalchemy import create_engine, desc
-from sqlalchemy.orm import sessionmaker
-from .models import BlockedEmail, init_db
-from ..config import DB_NAME
-from typing import List, Dict, Optional
+import base64
+import json
+from datetime import datetime, timezone
+from sqlalchemy import String, desc, func, insert, literal, text, tuple_, type_coerce
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import load_only, sessionmaker
+from . import models
+from .models import BlockedEmail, TableCounter, VerdictCacheEntry, get_engine, init_db
+from ..config import (
+    BLOCKED_PREVIEW_LENGTH, SEARCH_SNIPPET_TOKENS, SEARCH_WEIGHTS, SEARCH_RANK_WINDOW,
+    SEARCH_HIGHLIGHT_OPEN, SEARCH_HIGHLIGHT_CLOSE
+)
+from typing import List, Dict, Optional, Tuple, Union
 
-# Инициализация сессии
-engine = create_engine(f"sqlite:///{DB_NAME}")
-Session = sessionmaker(bind=engine)
+# Общий engine процесса; схема создается при первом открытии сессии
+_session_factory = sessionmaker(bind=get_engine())
+
+def Session():
+    """Открывает сессию, при первом вызове создает таблицы."""
+    init_db()
+    return _session_factory()
 
 def log_blocked_email(sender: str, subject: str, body: str, threat_prob: int):
     """Логирует заблокированное письмо в базу данных."""
-    init_db()  # Убедимся, что таблица существует
     session = Session()
     try:
         email = BlockedEmail(
@@ -27,37 +38,287 @@ def log_blocked_email(sender: str, subject: str, body: str, threat_prob: int):
     finally:
         session.close()
 
-def get_blocked_emails(limit: int = 50, offset: int = 0) -> List[Dict]:
-    """Получает список заблокированных писем."""
-    init_db()
+def log_blocked_emails(records: List[Dict]) -> bool:
+    """Записывает пакет заблокированных писем одной транзакцией."""
+    session = Session()
+    try:
+        session.execute(insert(BlockedEmail), records)
+        session.commit()
+        return True
+    except Exception as e:
+        session.rollback()
+        print(f"Ошибка при пакетном логировании писем: {e}")
+        return False
+    finally:
+        session.close()
+
+def encode_cursor(position: Union[str, float], email_id: int) -> str:
+    """
+    Курсор страницы: позиция последнего показанного письма в порядке сортировки
+    (timestamp для списка, оценка релевантности для поиска) и его id.
+    """
+    raw = json.dumps([position, email_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str, position_type: type = str) -> Tuple[Union[str, float], int]:
+    """Разбирает курсор; при неверном формате бросает ValueError."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        position, email_id = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Некорректный курсор: {cursor}") from e
+    if position_type is float and isinstance(position, int) and not isinstance(position, bool):
+        position = float(position)
+    if not isinstance(position, position_type) or isinstance(email_id, bool) or not isinstance(email_id, int):
+        raise ValueError(f"Некорректный курсор: {cursor}")
+    return position, email_id
+
+def get_blocked_emails_page(limit: int = 50, cursor: Optional[str] = None,
+                            offset: int = 0) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Страница заблокированных писем от новых к старым и курсор следующей страницы
+    (None, если страница последняя). Неверный курсор — ValueError.
+    Вместо тела возвращается preview из BLOCKED_PREVIEW_LENGTH символов:
+    столбец body в ORM не загружается, обрезка делается в SQLite.
+    С курсором чтение идет по индексу (timestamp, id) с места остановки,
+    время не зависит от глубины. Без курсора используется offset: он
+    отсчитывается только по индексу, строки читаются для найденных id.
+    """
+    position = decode_cursor(cursor) if cursor is not None else None
     session = Session()
     try:
-        emails = session.query(BlockedEmail)\
-                       .order_by(desc(BlockedEmail.timestamp))\
-                       .limit(limit)\
-                       .offset(offset)\
-                       .all()
-        
+        # Значение timestamp как оно хранится в SQLite: курсор сравнивается
+        # с ним как со строкой, без потери точности при преобразовании
+        timestamp_raw = type_coerce(BlockedEmail.timestamp, String).label("timestamp_raw")
+        # Лишний символ показывает, что тело длиннее превью
+        preview = func.substr(BlockedEmail.body, 1, BLOCKED_PREVIEW_LENGTH + 1).label("preview")
+        order = (desc(BlockedEmail.timestamp), desc(BlockedEmail.id))
+        query = session.query(BlockedEmail, timestamp_raw, preview)\
+                       .options(load_only(BlockedEmail.id, BlockedEmail.sender, BlockedEmail.subject,
+                                          BlockedEmail.threat_probability, BlockedEmail.timestamp))
+        if position is not None:
+            timestamp, email_id = position
+            query = query.filter(
+                tuple_(BlockedEmail.timestamp, BlockedEmail.id) < tuple_(literal(timestamp, String), literal(email_id))
+            )
+        elif offset:
+            page_ids = session.query(BlockedEmail.id)\
+                              .order_by(*order)\
+                              .limit(limit + 1)\
+                              .offset(offset)\
+                              .subquery()
+            query = query.join(page_ids, BlockedEmail.id == page_ids.c.id)
+        rows = query.order_by(*order).limit(limit + 1).all()
+
         result = []
-        for email in emails:
+        for email, _, body_preview in rows[:limit]:
+            body_preview = body_preview or ""
             result.append({
                 'id': email.id,
                 'sender': email.sender,
                 'subject': email.subject,
-                'body': email.body,
+                'preview': body_preview[:BLOCKED_PREVIEW_LENGTH],
+                'truncated': len(body_preview) > BLOCKED_PREVIEW_LENGTH,
                 'threat_probability': email.threat_probability,
                 'timestamp': email.timestamp.isoformat() if email.timestamp else None
             })
-        return result
+        next_cursor = None
+        if len(rows) > limit:
+            last, last_timestamp, _ = rows[limit - 1]
+            next_cursor = encode_cursor(last_timestamp, last.id)
+        return result, next_cursor
     except Exception as e:
         print(f"Ошибка при получении писем: {e}")
-        return []
+        return [], None
+    finally:
+        session.close()
+
+def get_blocked_emails(limit: int = 50, offset: int = 0) -> List[Dict]:
+    """Получает список заблокированных писем (с превью вместо тела)."""
+    emails, _ = get_blocked_emails_page(limit=limit, offset=offset)
+    return emails
+
+def _fts_query(query: str) -> str:
+    """
+    Переводит строку поиска в выражение FTS5: каждое слово берется в кавычки
+    (спецсимволы синтаксиса FTS не ломают запрос), слова объединяются по И,
+    "слово*" ищет по префиксу.
+    """
+    terms = []
+    for word in query.split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*").replace('"', '""')
+        if word:
+            terms.append(f'"{word}"' + ("*" if prefix else ""))
+    if not terms:
+        raise ValueError("Пустой поисковый запрос")
+    return " ".join(terms)
+
+def _escape_like(value: str) -> str:
+    """Экранирует спецсимволы LIKE (% и _), чтобы они совпадали буквально."""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def _sqlite_timestamp(value: datetime) -> str:
+    """Время в формате, в котором SQLite хранит CURRENT_TIMESTAMP (UTC)."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.strftime("%Y-%m-%d %H:%M:%S")
+
+def _id_range(session, since: Optional[datetime], until: Optional[datetime]) -> Optional[Tuple[int, int]]:
+    """
+    Диапазон id писем, попадающих в интервал дат (по индексу timestamp, id).
+    Ограничение по rowid FTS5 применяет внутри индекса, поэтому поиск с датами
+    не перебирает совпадения за пределами интервала. None — писем в интервале нет.
+    """
+    bounds = session.query(func.min(BlockedEmail.id), func.max(BlockedEmail.id))
+    if since is not None:
+        bounds = bounds.filter(BlockedEmail.timestamp >= literal(_sqlite_timestamp(since), String))
+    if until is not None:
+        bounds = bounds.filter(BlockedEmail.timestamp < literal(_sqlite_timestamp(until), String))
+    low, high = bounds.one()
+    if low is None:
+        return None
+    return low, high
+
+def search_blocked_emails(query: str, limit: int = 20, cursor: Optional[str] = None,
+                          sender: Optional[str] = None, since: Optional[datetime] = None,
+                          until: Optional[datetime] = None) -> Tuple[List[Dict], Optional[str], bool]:
+    """
+    Полнотекстовый поиск по отправителю, теме и телу (FTS5).
+    Результаты упорядочены по релевантности (bm25, совпадение в теме весит
+    больше, чем в теле), у каждого — фрагмент тела с подсвеченными словами.
+    Ранжируются последние SEARCH_RANK_WINDOW совпадений: для слов, которые
+    встречаются почти в каждом письме, время запроса не растет с размером базы;
+    третий элемент результата — True, если более старые совпадения отброшены.
+    sender — адрес или домен в виде "@example.com". Следующая страница
+    запрашивается по курсору из предыдущего ответа.
+    Неверный запрос или курсор — ValueError, отсутствие FTS5 — RuntimeError.
+    """
+    match = _fts_query(query)
+    if sender and any(char.isalnum() for char in sender):
+        # Отправитель проиндексирован: фильтр по колонке FTS5 сужает совпадения
+        # внутри индекса, точное сравнение ниже проверяет только их
+        phrase = sender.replace('"', '""')
+        match = f'({match}) AND sender : "{phrase}"'
+    position = decode_cursor(cursor, float) if cursor is not None else None
+    session = Session()
+    if not models.fts_available:
+        session.close()
+        raise RuntimeError("Полнотекстовый поиск недоступен: SQLite собран без FTS5")
+    try:
+        filters = []
+        params = {"match": match, "window": SEARCH_RANK_WINDOW - 1, "limit": limit + 1}
+        if sender:
+            if sender.startswith("@"):
+                filters.append("lower(e.sender) LIKE :sender_domain ESCAPE '\\'")
+                params["sender_domain"] = "%" + _escape_like(sender.lower())
+            else:
+                filters.append("lower(e.sender) = :sender")
+                params["sender"] = sender.lower()
+        if since is not None or until is not None:
+            id_range = _id_range(session, since, until)
+            if id_range is None:
+                return [], None, False
+            filters.append("blocked_emails_fts.rowid BETWEEN :min_id AND :max_id")
+            params["min_id"], params["max_id"] = id_range
+            if since is not None:
+                filters.append("e.timestamp >= :since")
+                params["since"] = _sqlite_timestamp(since)
+            if until is not None:
+                filters.append("e.timestamp < :until")
+                params["until"] = _sqlite_timestamp(until)
+        where = "".join(f" AND {condition}" for condition in filters)
+        after = ""
+        if position is not None:
+            after = "WHERE (score, id) > (:score, :after_id)"
+            params["score"], params["after_id"] = position
+
+        # Начало окна ранжирования: rowid совпадения номер SEARCH_RANK_WINDOW
+        # с конца; NULL — совпадений меньше, ничего не отброшено
+        window_start = session.execute(text(f"""
+            SELECT blocked_emails_fts.rowid FROM blocked_emails_fts
+            JOIN blocked_emails AS e ON e.id = blocked_emails_fts.rowid
+            WHERE blocked_emails_fts MATCH :match{where}
+            ORDER BY blocked_emails_fts.rowid DESC LIMIT 1 OFFSET :window
+        """), params).scalar()
+        truncated = window_start is not None
+        params["window_start"] = window_start or 0
+
+        # bm25 отрицателен: чем меньше, тем релевантнее
+        sql = text(f"""
+            SELECT * FROM (
+                SELECT e.id AS id, e.sender AS sender, e.subject AS subject,
+                       e.threat_probability AS threat_probability, e.timestamp AS timestamp,
+                       bm25(blocked_emails_fts, {SEARCH_WEIGHTS}) AS score
+                FROM blocked_emails_fts
+                JOIN blocked_emails AS e ON e.id = blocked_emails_fts.rowid
+                WHERE blocked_emails_fts MATCH :match{where}
+                  AND blocked_emails_fts.rowid >= :window_start
+            ) {after}
+            ORDER BY score, id
+            LIMIT :limit
+        """)
+        rows = session.execute(sql, params).all()
+        page = rows[:limit]
+
+        # Фрагменты строятся только для писем страницы, а не для всех совпадений.
+        # FTS5 ограничивается диапазоном id (BETWEEN), а список id проверяется
+        # как обычный фильтр (+rowid): иначе запрос с префиксом "слово*"
+        # выполнялся бы заново для каждого id.
+        highlights = {}
+        if page:
+            page_ids = [int(row.id) for row in page]
+            highlight_sql = text(f"""
+                SELECT rowid AS id,
+                       highlight(blocked_emails_fts, 1, :open, :close) AS subject_highlight,
+                       snippet(blocked_emails_fts, 2, :open, :close, '…', :tokens) AS snippet
+                FROM blocked_emails_fts
+                WHERE blocked_emails_fts MATCH :match
+                  AND rowid BETWEEN :first_id AND :last_id
+                  AND +rowid IN ({", ".join(map(str, page_ids))})
+            """)
+            for row in session.execute(highlight_sql, {
+                "match": match,
+                "first_id": min(page_ids),
+                "last_id": max(page_ids),
+                "open": SEARCH_HIGHLIGHT_OPEN,
+                "close": SEARCH_HIGHLIGHT_CLOSE,
+                "tokens": SEARCH_SNIPPET_TOKENS,
+            }):
+                highlights[row.id] = row
+
+        result = []
+        for row in page:
+            highlight = highlights.get(row.id)
+            result.append({
+                'id': row.id,
+                'sender': row.sender,
+                'subject': row.subject,
+                'subject_highlight': highlight.subject_highlight if highlight else row.subject,
+                'snippet': highlight.snippet if highlight else "",
+                'score': row.score,
+                'threat_probability': row.threat_probability,
+                'timestamp': row.timestamp.replace(" ", "T") if row.timestamp else None
+            })
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_cursor = encode_cursor(last.score, last.id)
+        return result, next_cursor, truncated
+    except OperationalError as e:
+        # Ошибки разбора MATCH SQLite возвращает как OperationalError с "fts5" в тексте
+        if "fts5" in str(e.orig):
+            raise ValueError(f"Некорректный поисковый запрос: {e.orig}") from e
+        print(f"Ошибка при поиске писем: {e}")
+        return [], None, False
+    except Exception as e:
+        print(f"Ошибка при поиске писем: {e}")
+        return [], None, False
     finally:
         session.close()
 
 def get_blocked_email_by_id(email_id: int) -> Optional[Dict]:
     """Получает заблокированное письмо по ID."""
-    init_db()
     session = Session()
     try:
         email = session.query(BlockedEmail).filter(BlockedEmail.id == email_id).first()
@@ -79,11 +340,11 @@ def get_blocked_email_by_id(email_id: int) -> Optional[Dict]:
 
 def get_blocked_emails_count() -> int:
     """Возвращает общее количество заблокированных писем."""
-    init_db()
     session = Session()
     try:
-        count = session.query(BlockedEmail).count()
-        return count
+        # Счетчик поддерживается триггерами (models._SCHEMA_UPGRADE)
+        count = session.query(TableCounter.value).filter(TableCounter.name == "blocked_emails").scalar()
+        return count or 0
     except Exception as e:
         print(f"Ошибка при подсчете писем: {e}")
         return 0
@@ -92,7 +353,6 @@ def get_blocked_emails_count() -> int:
 
 def delete_blocked_email(email_id: int) -> bool:
     """Удаляет заблокированное письмо по ID."""
-    init_db()
     session = Session()
     try:
         email = session.query(BlockedEmail).filter(BlockedEmail.id == email_id).first()
@@ -110,7 +370,6 @@ def delete_blocked_email(email_id: int) -> bool:
 
 def clear_all_blocked_emails() -> bool:
     """Очищает все заблокированные письма."""
-    init_db()
     session = Session()
     try:
         session.query(BlockedEmail).delete()
@@ -122,3 +381,47 @@ def clear_all_blocked_emails() -> bool:
         return False
     finally:
         session.close()
+
+def save_cached_verdict(key: str, verdict: int, created_at: float):
+    """Сохраняет вердикт кэша (перезаписывает существующий)."""
+    session = Session()
+    try:
+        session.merge(VerdictCacheEntry(key=key, verdict=verdict, created_at=created_at))
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        print(f"Ошибка при сохранении вердикта: {e}")
+    finally:
+        session.close()
+
+def load_cached_verdicts(since: float, limit: int) -> List[Tuple[str, int, float]]:
+    """Возвращает свежие вердикты (от старых к новым), созданные после since."""
+    session = Session()
+    try:
+        rows = session.query(VerdictCacheEntry.key, VerdictCacheEntry.verdict, VerdictCacheEntry.created_at)\
+                      .filter(VerdictCacheEntry.created_at >= since)\
+                      .order_by(desc(VerdictCacheEntry.created_at))\
+                      .limit(limit)\
+                      .all()
+        return [(row.key, row.verdict, row.created_at) for row in reversed(rows)]
+    except Exception as e:
+        print(f"Ошибка при загрузке вердиктов: {e}")
+        return []
+    finally:
+        session.close()
+
+def purge_cached_verdicts(before: float) -> int:
+    """Удаляет устаревшие вердикты, возвращает количество удаленных."""
+    session = Session()
+    try:
+        deleted = session.query(VerdictCacheEntry)\
+                         .filter(VerdictCacheEntry.created_at < before)\
+                         .delete()
+        session.commit()
+        return deleted
+    except Exception as e:
+        session.rollback()
+        print(f"Ошибка при очистке вердиктов: {e}")
+        return 0
+    finally:
+        session.close()
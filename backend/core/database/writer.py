@@ -0,0 +1,119 @@
+import atexit
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from typing import List, Optional
+from .repo import log_blocked_emails
+from ..metrics import stage_seconds, queue_depth
+from ..config import BLOCKED_LOG_BATCH_SIZE, BLOCKED_LOG_FLUSH_MS, BLOCKED_LOG_QUEUE_SIZE
+
+class BlockedEmailWriter:
+    """
+    Фоновая запись заблокированных писем. SMTP-обработчик только кладет запись
+    в очередь; отдельный поток вставляет накопленное одной транзакцией каждые
+    batch_size записей или flush_ms миллисекунд.
+    """
+
+    def __init__(self, batch_size: int = BLOCKED_LOG_BATCH_SIZE,
+                 flush_ms: float = BLOCKED_LOG_FLUSH_MS,
+                 max_queue: int = BLOCKED_LOG_QUEUE_SIZE):
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000
+        self._queue: "queue.Queue[dict]" = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+        self.overflows = 0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="blocked-email-writer", daemon=True)
+                self._thread.start()
+                # Записи из очереди не должны теряться при выходе из процесса
+                atexit.register(self.stop)
+
+    def submit(self, sender: str, subject: str, body: str, threat_prob: int):
+        """Ставит письмо в очередь на запись, не дожидаясь базы."""
+        self.start()
+        record = {
+            "sender": sender,
+            "subject": subject,
+            "body": body,
+            "threat_probability": threat_prob,
+            # Время блокировки, а не время фактической вставки
+            "timestamp": datetime.now(timezone.utc).replace(tzinfo=None),
+        }
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.overflows += 1
+            self._write([record])
+
+    def _collect(self) -> List[dict]:
+        try:
+            batch = [self._queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch: List[dict]):
+        with stage_seconds.time("db_log"):
+            ok = log_blocked_emails(batch)
+        with self._lock:
+            if ok:
+                self.written += len(batch)
+                self.batches += 1
+            else:
+                self.failed += len(batch)
+
+    def _run(self):
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch = self._collect()
+            if batch:
+                self._write(batch)
+                for _ in batch:
+                    self._queue.task_done()
+
+    def flush(self):
+        """Блокирует, пока очередь не будет записана."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def stop(self, timeout: float = 10):
+        """Дописывает очередь и останавливает поток."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "written": self.written,
+                "batches": self.batches,
+                "failed": self.failed,
+                "overflows": self.overflows,
+            }
+
+blocked_email_writer = BlockedEmailWriter()
+queue_depth.set_function(blocked_email_writer._queue.qsize, "blocked_log")
@@ -0,0 +1,136 @@
+"""
+Локальный классификатор: хэшированные n-граммы и логистическая регрессия.
+
+Модель обучается скриптом scripts/train_local_model.py на spam_filter_dataset2.csv
+и хранится компактным бинарным файлом: заголовок JSON и массив float32 весов.
+Оценка письма занимает доли миллисекунды, поэтому LLM вызывается только
+для писем, чья оценка попала в неопределенный диапазон.
+"""
+
+import json
+import math
+import re
+import struct
+import threading
+import zlib
+from array import array
+from pathlib import Path
+from typing import Iterable, List, Optional, Sequence
+from .config import LOCAL_MODEL_PATH, LOCAL_MODEL_FEATURES
+from .ollama.cache import normalize_text
+
+try:
+    import numpy
+except ImportError:  # numpy не обязателен: без него пакет оценивается циклом
+    numpy = None
+
+MAGIC = b"SMTPLM1\0"
+_TOKEN_RE = re.compile(r"\w+")
+
+def extract_features(text: str, dim: int = LOCAL_MODEL_FEATURES) -> List[int]:
+    """
+    Индексы признаков текста: слова, пары соседних слов и символьные
+    3- и 4-граммы внутри слов (устойчивы к окончаниям и опечаткам).
+    """
+    tokens = _TOKEN_RE.findall(normalize_text(text))
+    grams = set()
+    previous = None
+    for token in tokens:
+        grams.add("w:" + token)
+        if previous is not None:
+            grams.add("b:" + previous + " " + token)
+        previous = token
+        padded = f" {token} "
+        for n in (3, 4):
+            for i in range(len(padded) - n + 1):
+                grams.add("c:" + padded[i:i + n])
+    # crc32 стабилен между процессами, в отличие от встроенного hash()
+    return sorted({zlib.crc32(gram.encode("utf-8")) % dim for gram in grams})
+
+def _sigmoid(value: float) -> float:
+    if value < -30:
+        return 0.0
+    if value > 30:
+        return 1.0
+    return 1.0 / (1.0 + math.exp(-value))
+
+class LocalModel:
+    """Линейная модель над хэшированными признаками."""
+
+    def __init__(self, weights: array, bias: float, meta: Optional[dict] = None):
+        self.weights = weights
+        self.bias = bias
+        self.dim = len(weights)
+        self.meta = meta or {}
+        self._np_weights = numpy.frombuffer(weights, dtype=numpy.float32) if numpy is not None else None
+
+    @staticmethod
+    def scale(count: int) -> float:
+        """Нормировка: вклад признаков не растет с длиной письма."""
+        return 1.0 / math.sqrt(count) if count else 0.0
+
+    def score_features(self, features: Sequence[int]) -> float:
+        weights = self.weights
+        total = sum(weights[i] for i in features)
+        return _sigmoid(self.bias + total * self.scale(len(features)))
+
+    def score(self, text: str) -> float:
+        """Вероятность угрозы от 0 до 1."""
+        return self.score_features(extract_features(text, self.dim))
+
+    def score_batch(self, texts: Iterable[str]) -> List[float]:
+        """Оценивает пачку писем; с numpy — одной векторной операцией над всеми признаками."""
+        batch = [extract_features(text, self.dim) for text in texts]
+        if self._np_weights is None or not batch:
+            return [self.score_features(features) for features in batch]
+
+        lengths = numpy.fromiter((len(f) for f in batch), dtype=numpy.int64, count=len(batch))
+        indices = numpy.fromiter((i for f in batch for i in f), dtype=numpy.int64, count=int(lengths.sum()))
+        gathered = self._np_weights[indices]
+        # Сумма весов по письмам; у письма без признаков (пустое тело) — 0
+        rows = numpy.repeat(numpy.arange(len(batch)), lengths)
+        sums = numpy.bincount(rows, weights=gathered, minlength=len(batch))
+        scales = numpy.where(lengths > 0, 1.0 / numpy.sqrt(numpy.maximum(lengths, 1)), 0.0)
+        logits = numpy.clip(self.bias + sums * scales, -30, 30)
+        return (1.0 / (1.0 + numpy.exp(-logits))).tolist()
+
+    def save(self, path: str):
+        header = json.dumps(dict(self.meta, dim=self.dim, bias=self.bias)).encode("utf-8")
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack("<I", len(header)))
+            f.write(header)
+            self.weights.tofile(f)
+
+    @classmethod
+    def load(cls, path: str) -> "LocalModel":
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} не является файлом локальной модели")
+            (header_len,) = struct.unpack("<I", f.read(4))
+            meta = json.loads(f.read(header_len).decode("utf-8"))
+            weights = array("f")
+            weights.fromfile(f, meta["dim"])
+        return cls(weights, meta.pop("bias"), meta)
+
+_model: Optional[LocalModel] = None
+_model_loaded = False
+_model_lock = threading.Lock()
+
+def get_local_model() -> Optional[LocalModel]:
+    """Загружает модель один раз; None, если файл еще не обучен."""
+    global _model, _model_loaded
+    if _model_loaded:
+        return _model
+    with _model_lock:
+        if not _model_loaded:
+            try:
+                _model = LocalModel.load(LOCAL_MODEL_PATH)
+                print(f"Локальная модель загружена: {LOCAL_MODEL_PATH}")
+            except FileNotFoundError:
+                print(f"Локальная модель не найдена ({LOCAL_MODEL_PATH}), запустите scripts/train_local_model.py")
+            except (ValueError, KeyError, EOFError) as e:
+                print(f"Ошибка загрузки локальной модели: {e}")
+            _model_loaded = True
+    return _model
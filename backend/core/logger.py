@@ -0,0 +1,194 @@
+"""
+Структурированный журнал (JSON lines) для горячего пути SMTP.
+
+Вызов log.info(...) только кладет запись в очередь; запись в stdout или файл
+идет в отдельном потоке, поэтому медленный терминал или перенаправленный
+канал не тормозят обработку писем. При переполнении очереди записи
+отбрасываются и считаются. Сообщения по каждому письму выборочно сэмплируются,
+повторяющиеся ошибки ограничиваются по частоте.
+"""
+
+import atexit
+import json
+import queue
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional, TextIO
+from .config import (
+    LOG_LEVEL, LOG_FILE, LOG_QUEUE_SIZE, LOG_MESSAGE_SAMPLE_RATE,
+    LOG_ERROR_RATE_LIMIT, LOG_ERROR_WINDOW
+)
+from .metrics import queue_depth, registry
+from .tracing import current_trace
+
+LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+
+log_dropped = registry.counter("log_records_dropped_total", "Записи журнала, отброшенные при переполнении очереди")
+
+class StructuredLogger:
+    def __init__(self, level: str = LOG_LEVEL, path: Optional[str] = LOG_FILE,
+                 max_queue: int = LOG_QUEUE_SIZE, sample_rate: float = LOG_MESSAGE_SAMPLE_RATE,
+                 error_limit: int = LOG_ERROR_RATE_LIMIT, error_window: float = LOG_ERROR_WINDOW):
+        self.level = LEVELS[level]
+        self.path = path
+        self.sample_rate = sample_rate
+        self.error_limit = error_limit
+        self.error_window = error_window
+        self._queue: "queue.Queue[Optional[dict]]" = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        # Ограничение ошибок: событие -> [начало окна, записано в окне, подавлено]
+        self._error_windows: Dict[str, list] = {}
+        self.written = 0
+        self.dropped = 0
+        self.sampled_out = 0
+        self.suppressed = 0
+
+    def _ensure_thread(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="structured-log", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _rate_limited(self, event: str, record: dict) -> bool:
+        """True, если ошибка подавлена; иначе в запись добавляется число подавленных."""
+        now = time.monotonic()
+        with self._lock:
+            window = self._error_windows.get(event)
+            if window is None or now - window[0] >= self.error_window:
+                suppressed = window[2] if window else 0
+                self._error_windows[event] = [now, 1, 0]
+                if suppressed:
+                    record["suppressed"] = suppressed
+                return False
+            if window[1] < self.error_limit:
+                window[1] += 1
+                return False
+            window[2] += 1
+            self.suppressed += 1
+            return True
+
+    def log(self, level: str, event: str, message: str = "", sample: bool = False,
+            rate_limited: bool = True, **fields):
+        """
+        event — короткое имя события для фильтрации, message — текст для человека.
+        sample=True помечает сообщения, которые пишутся для каждого письма:
+        из них сохраняется только доля LOG_MESSAGE_SAMPLE_RATE.
+        rate_limited=False — ошибку нельзя подавлять (например, потеря письма).
+        """
+        if LEVELS[level] < self.level:
+            return
+        if sample and self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            with self._lock:
+                self.sampled_out += 1
+            return
+
+        record = {"ts": time.time(), "level": level, "event": event}
+        if message:
+            record["msg"] = message
+        trace = current_trace()
+        if trace is not None:
+            record["trace_id"] = trace.trace_id
+        record.update(fields)
+        if level == "error" and rate_limited and self._rate_limited(event, record):
+            return
+
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            log_dropped.inc()
+
+    def debug(self, event: str, message: str = "", **fields):
+        self.log("debug", event, message, **fields)
+
+    def info(self, event: str, message: str = "", **fields):
+        self.log("info", event, message, **fields)
+
+    def warning(self, event: str, message: str = "", **fields):
+        self.log("warning", event, message, **fields)
+
+    def error(self, event: str, message: str = "", **fields):
+        self.log("error", event, message, **fields)
+
+    def _open(self) -> TextIO:
+        if self.path:
+            return open(self.path, "a", encoding="utf-8")
+        return sys.stdout
+
+    def _run(self):
+        stream = self._open()
+        try:
+            while True:
+                record = self._queue.get()
+                if record is None:
+                    self._queue.task_done()
+                    break
+                # Забираем все накопившееся и пишем одним вызовом
+                batch = [record]
+                stop = False
+                while True:
+                    try:
+                        extra = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if extra is None:
+                        # Каждому get() — свой task_done(), иначе flush() (join) зависнет
+                        self._queue.task_done()
+                        stop = True
+                        break
+                    batch.append(extra)
+                lines = []
+                for item in batch:
+                    item["ts"] = datetime.fromtimestamp(item["ts"], timezone.utc).isoformat(timespec="milliseconds")
+                    lines.append(json.dumps(item, ensure_ascii=False, default=str))
+                try:
+                    stream.write("\n".join(lines) + "\n")
+                    stream.flush()
+                except (OSError, ValueError):
+                    pass
+                with self._lock:
+                    self.written += len(batch)
+                for _ in batch:
+                    self._queue.task_done()
+                if stop:
+                    break
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+
+    def flush(self):
+        """Блокирует, пока очередь не будет записана (для тестов и остановки)."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self, timeout: float = 5):
+        if self._thread is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+        self._thread = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "written": self.written,
+                "dropped": self.dropped,
+                "sampled_out": self.sampled_out,
+                "suppressed_errors": self.suppressed,
+            }
+
+log = StructuredLogger()
+queue_depth.set_function(lambda: log.stats()["queue_depth"], "log")
@@ -0,0 +1,235 @@
+"""
+Метрики процесса в формате Prometheus (текстовый формат 0.0.4).
+
+Счетчики и гистограммы обновляются под короткой блокировкой без аллокаций
+на горячем пути; глубины очередей считаются функциями только при чтении /metrics.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Границы корзин гистограмм задержки (секунды): от разбора письма до ответа LLM
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Tuple[str, ...]) -> Tuple[str, ...]:
+        if len(labels) != len(self.label_names):
+            raise ValueError(f"{self.name}: ожидаются метки {self.label_names}")
+        return tuple(str(label) for label in labels)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}" for key, value in items
+        ]
+
+class Gauge(_Metric):
+    """Текущее значение; либо задается set/inc/dec, либо вычисляется функцией при чтении."""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._functions: Dict[Tuple[str, ...], Callable[[], float]] = {}
+
+    def set(self, value: float, *labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, *labels: str, amount: float = 1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, *labels: str, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def set_function(self, function: Callable[[], float], *labels: str):
+        with self._lock:
+            self._functions[self._key(labels)] = function
+
+    def value(self, *labels: str) -> float:
+        key = self._key(labels)
+        with self._lock:
+            function = self._functions.get(key)
+            if function is None:
+                return self._values.get(key, 0)
+        return function()
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = dict(self._values)
+            functions = dict(self._functions)
+        for key, function in functions.items():
+            try:
+                items[key] = float(function())
+            except Exception:
+                continue  # Недоступный источник не должен ломать /metrics
+        return self.header() + [
+            f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+            for key, value in sorted(items.items())
+        ]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Для каждой комбинации меток: счетчики корзин (последняя — +Inf), сумма, количество
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, *labels: str) -> "_Timer":
+        """Контекстный менеджер: with histogram.time("parse"): ..."""
+        return _Timer(self, labels)
+
+    def count(self, *labels: str) -> int:
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            return series[2] if series else 0
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, ([*series[0]], series[1], series[2])) for key, series in self._series.items())
+        lines = self.header()
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"' if bound != float("inf") else 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {repr(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: Histogram, labels: Tuple[str, ...]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+        return False
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Tuple[str, ...] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                  buckets: Optional[Tuple[float, ...]] = None) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets or LATENCY_BUCKETS))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+# --- SMTP ---
+smtp_sessions = registry.counter("smtp_sessions_total", "SMTP-соединения, принятые фильтром")
+smtp_sessions_active = registry.gauge("smtp_sessions_active", "Открытые SMTP-соединения")
+smtp_messages = registry.counter("smtp_messages_total", "Письма по коду ответа на DATA", ("code",))
+smtp_message_seconds = registry.histogram("smtp_message_seconds", "Время обработки письма от DATA до ответа")
+smtp_pending = registry.gauge("smtp_pending_messages", "Письма в обработке в пуле потоков")
+
+# --- Стадии обработки письма ---
+stage_seconds = registry.histogram(
+    "smtp_stage_seconds", "Время стадии обработки письма (parse, classify, relay, spool, db_log)", ("stage",)
+)
+verdicts = registry.counter("classifier_verdicts_total", "Вердикты классификации", ("verdict",))
+decisions = registry.counter("classifier_decisions_total", "На какой стадии конвейера принято решение", ("stage",))
+
+# --- Ollama ---
+ollama_request_seconds = registry.histogram(
+    "ollama_request_seconds", "Длительность запроса к модели Ollama", ("model", "mode")
+)
+ollama_errors = registry.counter("ollama_errors_total", "Ошибки запросов к Ollama", ("model", "kind"))
+
+# --- Очереди (вычисляются при чтении) ---
+queue_depth = registry.gauge("queue_depth", "Глубина внутренних очередей", ("queue",))
+
+def render_metrics() -> str:
+    return registry.render()
@@ -0,0 +1,212 @@
+import json
+import queue
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import List, Optional, Tuple
+import requests
+from .client import MODEL_CHAIN, model_latency, ollama_client
+from ..metrics import ollama_request_seconds, ollama_errors, queue_depth
+from ..logger import log
+from ..config import (
+    OLLAMA_TIMEOUT, OLLAMA_DEADLINE, OLLAMA_KEEP_ALIVE,
+    BATCH_CLASSIFY_SYSTEM_PROMPT, BATCH_CLASSIFY_TEXT_PROMPT,
+    OLLAMA_BATCH_MAX_SIZE, OLLAMA_BATCH_MAX_WAIT_MS, OLLAMA_BATCH_CONCURRENCY
+)
+
+# Строка ответа вида "3: 1"
+_ANSWER_RE = re.compile(r"(\d+)\s*[:.)=\-]\s*([01])")
+
+def _make_batch_request(texts: List[str], model: str, timeout: float = OLLAMA_TIMEOUT) -> List[Optional[int]]:
+    """Классифицирует несколько текстов одним запросом. None для текстов без ответа."""
+    # Каждый текст — строка JSON: кавычки и переводы строк внутри письма
+    # экранированы и не могут подделать границы соседних текстов
+    numbered = "\n".join(
+        f"{i}. {json.dumps(text, ensure_ascii=False)}" for i, text in enumerate(texts, 1)
+    )
+    payload = {
+        "model": model,
+        "system": BATCH_CLASSIFY_SYSTEM_PROMPT,
+        "prompt": BATCH_CLASSIFY_TEXT_PROMPT.format(texts=numbered),
+        "stream": False,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+        "options": {
+            "temperature": 0.0,
+            "num_predict": 8 * len(texts),
+            "top_p": 0.1,
+        }
+    }
+
+    verdicts: List[Optional[int]] = [None] * len(texts)
+    started = time.perf_counter()
+    try:
+        result = ollama_client.generate(payload, timeout=timeout)
+        model_latency.record(model, time.perf_counter() - started, "batch")
+    except (requests.exceptions.RequestException, json.JSONDecodeError, ValueError) as e:
+        kind = "timeout" if isinstance(e, requests.exceptions.Timeout) else "error"
+        ollama_errors.inc(model, kind)
+        log.error("ollama_batch_failed", "Ошибка пакетного запроса к модели", model=model, kind=kind, error=str(e))
+        return verdicts
+    finally:
+        ollama_request_seconds.observe(time.perf_counter() - started, model, "batch")
+
+    for number, verdict in _ANSWER_RE.findall(result.get("response", "")):
+        index = int(number) - 1
+        if 0 <= index < len(texts) and verdicts[index] is None:
+            verdicts[index] = int(verdict)
+    return verdicts
+
+class BatchClassifier:
+    """
+    Собирает письма, пришедшие почти одновременно, и классифицирует их одним
+    запросом. Пакет отправляется, когда набрано max_size писем или истекло
+    max_wait_ms с момента прихода первого. Одновременно обрабатывается не
+    больше concurrency пакетов; если основная модель медлит, пакет
+    хеджируется следующей моделью цепочки, как и одиночный запрос.
+    """
+
+    def __init__(self, max_size: int = OLLAMA_BATCH_MAX_SIZE,
+                 max_wait_ms: float = OLLAMA_BATCH_MAX_WAIT_MS,
+                 concurrency: int = OLLAMA_BATCH_CONCURRENCY):
+        self.max_size = max_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue: "queue.Queue[tuple[str, Future, float]]" = queue.Queue()
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="ollama-batch")
+        self._requests = ThreadPoolExecutor(max_workers=concurrency * len(MODEL_CHAIN),
+                                            thread_name_prefix="ollama-batch-request")
+        self._worker: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.batched_items = 0
+        self.hedged = 0
+
+    def classify(self, text: str, timeout: float = OLLAMA_DEADLINE) -> Tuple[Optional[int], Optional[str]]:
+        """
+        Блокирует вызывающий поток до получения вердикта, но не дольше timeout.
+        Возвращает вердикт и модель, которая его дала. Вердикт None означает,
+        что письмо нужно классифицировать отдельным запросом (пакет из одного
+        письма, модель не ответила по нему или срок истек).
+        """
+        self._ensure_worker()
+        future: Future = Future()
+        self._queue.put((text, future, time.monotonic() + timeout))
+        try:
+            return future.result(timeout=timeout)
+        except Exception:
+            return None, None
+
+    def _ensure_worker(self):
+        if self._worker is not None:
+            return
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="ollama-batcher", daemon=True)
+                self._worker.start()
+
+    def _collect(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        # Пока все слоты заняты, очередь копит следующий пакет:
+        # чем выше нагрузка, тем крупнее пакеты
+        while True:
+            self._slots.acquire()
+            batch = self._collect()
+            if len(batch) == 1:
+                batch[0][1].set_result((None, None))
+                self._slots.release()
+                continue
+            self._executor.submit(self._process, batch)
+
+    def _process(self, batch: list):
+        try:
+            # Срок пакета — самый ранний срок его писем
+            expires = min(item_expires for _, _, item_expires in batch)
+            verdicts = self._classify_hedged([text for text, _, _ in batch], expires)
+        except Exception as e:
+            log.error("batch_classify_failed", "Ошибка пакетной классификации", error=str(e))
+            verdicts = [(None, None)] * len(batch)
+        finally:
+            self._slots.release()
+
+        with self._lock:
+            self.batches += 1
+            self.batched_items += len(batch)
+        for (_, future, _), verdict in zip(batch, verdicts):
+            future.set_result(verdict)
+
+    def _classify_hedged(self, texts: List[str], expires: float) -> List[Tuple[Optional[int], Optional[str]]]:
+        """
+        Пакетный запрос с хеджированием: если модель не ответила за свой
+        перцентиль задержки пакета, тот же пакет отправляется следующей модели.
+        Вердикт письма берется из первого ответа, где он есть, вместе с моделью.
+        """
+        verdicts: List[Optional[int]] = [None] * len(texts)
+        sources: List[Optional[str]] = [None] * len(texts)
+        pending = set()
+        models = {}
+        launched = 0
+        hedge_at = 0.0
+
+        def launch():
+            nonlocal launched, hedge_at
+            model = MODEL_CHAIN[launched]
+            if launched:
+                log.info("ollama_batch_hedge", "Хеджирование пакета: параллельный запрос", model=model)
+                with self._lock:
+                    self.hedged += 1
+            launched += 1
+            now = time.monotonic()
+            future = self._requests.submit(_make_batch_request, texts, model,
+                                           min(OLLAMA_TIMEOUT, expires - now))
+            models[future] = model
+            pending.add(future)
+            hedge_at = now + model_latency.hedge_delay(model, "batch")
+
+        launch()
+        while pending and None in verdicts:
+            now = time.monotonic()
+            if now >= expires:
+                break
+            timeout = expires - now
+            if launched < len(MODEL_CHAIN):
+                timeout = min(timeout, max(0.0, hedge_at - now))
+
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                for index, verdict in enumerate(future.result()):
+                    if verdicts[index] is None and verdict is not None:
+                        verdicts[index] = verdict
+                        sources[index] = models[future]
+
+            if (None in verdicts and launched < len(MODEL_CHAIN)
+                    and (not pending or time.monotonic() >= hedge_at)):
+                launch()
+
+        # Опоздавшие запросы завершатся сами: их таймаут ограничен сроком пакета
+        return list(zip(verdicts, sources))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "batched_items": self.batched_items,
+                "hedged_batches": self.hedged,
+                "avg_batch_size": self.batched_items / self.batches if self.batches else 0.0,
+                "queue_depth": self._queue.qsize(),
+            }
+
+batch_classifier = BatchClassifier()
+queue_depth.set_function(batch_classifier._queue.qsize, "ollama_batch")
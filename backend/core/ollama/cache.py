@@ -0,0 +1,105 @@
+import hashlib
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+from ..config import (
+    CLASSIFY_SYSTEM_PROMPT, CLASSIFY_TEXT_PROMPT, VERDICT_CACHE_SIZE, VERDICT_CACHE_TTL, VERDICT_CACHE_PERSIST
+)
+from ..database.repo import save_cached_verdict, load_cached_verdicts, purge_cached_verdicts
+
+# Версия промта входит в ключ: после правки промта или формата запроса
+# старые вердикты не используются. Формат — как промт разложен по полям
+# запроса: тот же текст одной строкой в prompt дает другие ответы
+REQUEST_LAYOUT = "system+prompt"
+PROMPT_VERSION = hashlib.sha256(
+    "\0".join((REQUEST_LAYOUT, CLASSIFY_SYSTEM_PROMPT, CLASSIFY_TEXT_PROMPT)).encode("utf-8")
+).hexdigest()[:12]
+
+def normalize_text(text: str) -> str:
+    """Приводит текст к каноническому виду: NFKC, нижний регистр, схлопнутые пробелы."""
+    return " ".join(unicodedata.normalize("NFKC", text).casefold().split())
+
+def content_hash(text: str) -> str:
+    """SHA-256 от нормализованного текста."""
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+class VerdictCache:
+    """Потокобезопасный LRU-кэш вердиктов с ограничением по времени жизни."""
+
+    def __init__(self, capacity: int = VERDICT_CACHE_SIZE, ttl: float = VERDICT_CACHE_TTL,
+                 persist: bool = VERDICT_CACHE_PERSIST):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.persist = persist
+        self._items: "OrderedDict[str, tuple[int, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(text: str, model: str) -> str:
+        """Ключ кэша: хэш нормализованного текста, модели и версии промта."""
+        raw = f"{model}\0{PROMPT_VERSION}\0{normalize_text(text)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[int]:
+        now = time.time()
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            verdict, created_at = item
+            if now - created_at > self.ttl:
+                del self._items[key]
+                self.evictions += 1
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return verdict
+
+    def put(self, key: str, verdict: int, created_at: Optional[float] = None, store: bool = True):
+        if created_at is None:
+            created_at = time.time()
+        with self._lock:
+            self._items[key] = (verdict, created_at)
+            self._items.move_to_end(key)
+            while len(self._items) > self.capacity:
+                self._items.popitem(last=False)
+                self.evictions += 1
+        if self.persist and store:
+            save_cached_verdict(key, verdict, created_at)
+
+    def load_persisted(self) -> int:
+        """Загружает непросроченные вердикты из SQLite, возвращает их количество."""
+        if not self.persist:
+            return 0
+        since = time.time() - self.ttl
+        purge_cached_verdicts(since)
+        rows = load_cached_verdicts(since, self.capacity)
+        for key, verdict, created_at in rows:
+            self.put(key, verdict, created_at, store=False)
+        return len(rows)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._items),
+                "capacity": self.capacity,
+                "persist": self.persist,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+verdict_cache = VerdictCache()
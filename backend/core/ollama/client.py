@@ -1,23 +1,300 @@
 import requests
 import json
-from typing import Optional
-from ..config import OLLAMA_URL, OLLAMA_MODEL, OLLAMA_FALLBACK_MODEL, OLLAMA_BACKUP_MODEL, CLASSIFY_PROMPT, OLLAMA_TIMEOUT
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Iterator, Optional, Tuple
+from requests.adapters import HTTPAdapter
+from ..metrics import ollama_request_seconds, ollama_errors, registry
+from ..logger import log
+from ..tracing import bind, span
+from ..config import (
+    OLLAMA_BASE_URL, OLLAMA_MODEL, OLLAMA_FALLBACK_MODEL, OLLAMA_BACKUP_MODEL,
+    CLASSIFY_SYSTEM_PROMPT, CLASSIFY_TEXT_PROMPT, OLLAMA_TIMEOUT, OLLAMA_HEALTH_INTERVAL, OLLAMA_FAILURE_THRESHOLD,
+    OLLAMA_CIRCUIT_COOLDOWN, SMTP_WORKERS, OLLAMA_HEDGE_ENABLED, OLLAMA_DEADLINE,
+    OLLAMA_HEDGE_PERCENTILE, OLLAMA_HEDGE_DEFAULT_DELAY, OLLAMA_HEDGE_MIN_DELAY,
+    OLLAMA_LATENCY_WINDOW, OLLAMA_STREAM, OLLAMA_STREAM_DRAIN_MAX, OLLAMA_KEEP_ALIVE, OLLAMA_WARMUP_MODELS
+)
+
+MODEL_CHAIN = [OLLAMA_MODEL, OLLAMA_FALLBACK_MODEL, OLLAMA_BACKUP_MODEL]
+
+class ModelLatencyStats:
+    """
+    Скользящее окно задержек по каждой модели. Хранятся две метрики:
+    verdict — время до получения вердикта (для потоковых запросов — до первого
+    токена 0/1), total — время до завершения запроса, batch — время пакетного
+    запроса.
+    """
+
+    MIN_SAMPLES = 20
+    KINDS = ("verdict", "total", "batch")
+
+    def __init__(self, window: int = OLLAMA_LATENCY_WINDOW):
+        self.window = window
+        self._samples: dict = {}
+        self._lock = threading.Lock()
+        self.early_stops: dict = {}
+
+    def record(self, model: str, seconds: float, kind: str = "verdict"):
+        with self._lock:
+            samples = self._samples.get((model, kind))
+            if samples is None:
+                samples = self._samples[(model, kind)] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def record_early_stop(self, model: str):
+        with self._lock:
+            self.early_stops[model] = self.early_stops.get(model, 0) + 1
+
+    def percentile(self, model: str, percent: float, kind: str = "verdict",
+                   min_samples: int = MIN_SAMPLES) -> Optional[float]:
+        """Перцентиль задержки или None, если замеров меньше min_samples."""
+        with self._lock:
+            samples = sorted(self._samples.get((model, kind), ()))
+        if not samples or len(samples) < min_samples:
+            return None
+        index = min(len(samples) - 1, math.ceil(percent / 100 * len(samples)) - 1)
+        return samples[index]
+
+    def hedge_delay(self, model: str, kind: str = "verdict") -> float:
+        """Через сколько секунд без вердикта модели запускать следующую."""
+        measured = self.percentile(model, OLLAMA_HEDGE_PERCENTILE, kind)
+        if measured is None:
+            return OLLAMA_HEDGE_DEFAULT_DELAY
+        return min(max(measured, OLLAMA_HEDGE_MIN_DELAY), OLLAMA_DEADLINE)
+
+    def stats(self) -> dict:
+        with self._lock:
+            keys = list(self._samples)
+            counts = {key: len(samples) for key, samples in self._samples.items()}
+            early_stops = dict(self.early_stops)
+        result = {}
+        for model, kind in keys:
+            entry = result.setdefault(model, {
+                "hedge_delay": self.hedge_delay(model),
+                "early_stops": early_stops.get(model, 0),
+            })
+            entry[kind] = {
+                "samples": counts[(model, kind)],
+                "p50": self.percentile(model, 50, kind, min_samples=1),
+                "p95": self.percentile(model, 95, kind, min_samples=1),
+                "p99": self.percentile(model, 99, kind, min_samples=1),
+            }
+        return result
+
+class OllamaClient:
+    """
+    Долгоживущий клиент Ollama: пул keep-alive соединений и кэшированное
+    состояние доступности (circuit breaker), которое обновляется в фоне.
+    """
+
+    def __init__(self, base_url: str = OLLAMA_BASE_URL, pool_size: int = SMTP_WORKERS):
+        self.base_url = base_url
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._lock = threading.Lock()
+        self._checked = False
+        self._circuit_open = False
+        self._opened_at = 0.0
+        self._trial_at = 0.0
+        self._trial_thread: Optional[int] = None
+        self._failures = 0
+        self._monitor: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._drain_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="ollama-drain")
+
+    def check_health(self) -> bool:
+        """Проверяет /api/version и обновляет состояние цепи."""
+        try:
+            response = self.session.get(f"{self.base_url}/api/version", timeout=5)
+            healthy = response.status_code == 200
+        except requests.exceptions.RequestException:
+            healthy = False
+
+        with self._lock:
+            self._checked = True
+            if healthy:
+                self._circuit_open = False
+                self._failures = 0
+                self._trial_at = 0.0
+            else:
+                # Каждая неудачная проверка продлевает паузу: пока монитор видит
+                # Ollama недоступной, пробные запросы не пропускаются
+                self._circuit_open = True
+                self._opened_at = time.monotonic()
+        return healthy
+
+    def is_available(self) -> bool:
+        """
+        Возвращает кэшированное состояние без сетевого запроса.
+        После паузы OLLAMA_CIRCUIT_COOLDOWN пропускает один пробный запрос
+        (half-open); его успех замыкает цепь, неудача снова размыкает. Поток,
+        получивший пробу, пропускается и при повторной проверке (пакетный путь,
+        затем цепочка моделей). Если результата пробы нет за OLLAMA_TIMEOUT,
+        пропускается следующая.
+        """
+        self.start_health_monitor()
+        if not self._checked:
+            return self.check_health()
+        with self._lock:
+            if not self._circuit_open:
+                return True
+            now = time.monotonic()
+            if now - self._trial_at < OLLAMA_TIMEOUT:
+                return self._trial_thread == threading.get_ident()
+            if now - self._opened_at < OLLAMA_CIRCUIT_COOLDOWN:
+                return False
+            self._trial_at = now
+            self._trial_thread = threading.get_ident()
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._circuit_open = False
+            self._trial_at = 0.0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_at = 0.0
+            # При разомкнутой цепи неудача (в том числе пробного запроса) продлевает паузу
+            if self._circuit_open or self._failures >= OLLAMA_FAILURE_THRESHOLD:
+                self._circuit_open = True
+                self._opened_at = time.monotonic()
+
+    def generate(self, payload: dict, timeout: float = OLLAMA_TIMEOUT) -> dict:
+        """Выполняет /api/generate через общий пул соединений."""
+        try:
+            response = self.session.post(f"{self.base_url}/api/generate", json=payload, timeout=timeout)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            # Ошибки HTTP (например, 404 для неизвестной модели) не размыкают цепь
+            self.record_failure()
+            raise
+        self.record_success()
+        response.raise_for_status()
+        return response.json()
+
+    def stream_generate(self, payload: dict, timeout: float = OLLAMA_TIMEOUT) -> Iterator[dict]:
+        """
+        Выполняет потоковый /api/generate и отдает фрагменты NDJSON.
+        Если вызывающий прекращает чтение раньше конца ответа, остаток
+        дочитывается в фоне (не дольше OLLAMA_STREAM_DRAIN_MAX): закрытие
+        недочитанного ответа разрывает соединение, и следующий запрос
+        открывал бы новое вместо соединения из пула.
+        """
+        payload = dict(payload, stream=True)
+        try:
+            response = self.session.post(f"{self.base_url}/api/generate", json=payload,
+                                         timeout=timeout, stream=True)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            self.record_failure()
+            raise
+        self.record_success()
+        draining = False
+        try:
+            response.raise_for_status()
+            lines = response.iter_lines()
+            for line in lines:
+                if line:
+                    yield json.loads(line)
+        except GeneratorExit:
+            # Вызывающий получил вердикт; ответ ограничен num_predict, остаток короткий.
+            # Дочитывается тот же итератор: брошенный итератор urllib3 закрывает соединение
+            self._drain_executor.submit(self._drain, response, lines)
+            draining = True
+            raise
+        finally:
+            if not draining:
+                response.close()
+
+    @staticmethod
+    def _drain(response: requests.Response, lines: Iterator[bytes]):
+        """Дочитывает ответ, чтобы соединение вернулось в пул; по истечении срока закрывает его."""
+        deadline = time.monotonic() + OLLAMA_STREAM_DRAIN_MAX
+        try:
+            for _ in lines:
+                if time.monotonic() > deadline:
+                    response.raw.close()
+                    break
+        except (requests.exceptions.RequestException, OSError):
+            pass
+        finally:
+            response.close()
+
+    def start_health_monitor(self):
+        """Запускает фоновую проверку доступности (один раз)."""
+        if self._monitor is not None:
+            return
+        with self._lock:
+            if self._monitor is not None:
+                return
+            self._monitor = threading.Thread(target=self._monitor_loop, name="ollama-health", daemon=True)
+            self._monitor.start()
+
+    def _monitor_loop(self):
+        while not self._stop.wait(OLLAMA_HEALTH_INTERVAL):
+            self.check_health()
+
+    def close(self):
+        self._stop.set()
+        self.session.close()
+
+# Общий клиент для всего процесса
+ollama_client = OllamaClient()
+model_latency = ModelLatencyStats()
+registry.gauge("ollama_circuit_open", "Цепь к Ollama разомкнута (1) или замкнута (0)")\
+    .set_function(lambda: 1 if ollama_client._circuit_open else 0)
+
+# Потоки для параллельных (хеджированных) запросов к моделям
+_hedge_executor = ThreadPoolExecutor(max_workers=SMTP_WORKERS * len(MODEL_CHAIN),
+                                     thread_name_prefix="ollama-hedge")
 
 def test_ollama_connection() -> bool:
     """Проверяет подключение к Ollama."""
+    return ollama_client.check_health()
+
+def _first_verdict(answer: str) -> Optional[int]:
+    for char in answer:
+        if char in ["0", "1"]:
+            return int(char)
+    return None
+
+def _stream_verdict(payload: dict, model: str, timeout: float) -> Optional[int]:
+    """Читает поток токенов и возвращает первый вердикт, не дожидаясь конца генерации."""
+    started = time.monotonic()
+    answer = ""
+    verdict = None
+    stream = ollama_client.stream_generate(payload, timeout=timeout)
     try:
-        response = requests.get("http://localhost:11434/api/version", timeout=5)
-        return response.status_code == 200
-    except requests.exceptions.RequestException:
-        return False
+        for chunk in stream:
+            answer += chunk.get("response", "")
+            verdict = _first_verdict(answer)
+            if verdict is not None:
+                model_latency.record(model, time.monotonic() - started, "verdict")
+                if not chunk.get("done"):
+                    model_latency.record_early_stop(model)
+                break
+            if chunk.get("done") or time.monotonic() - started > timeout:
+                break
+    finally:
+        stream.close()
+        model_latency.record(model, time.monotonic() - started, "total")
+    return verdict
 
-def _make_ollama_request(text: str, model: str) -> Optional[int]:
+def _make_ollama_request(text: str, model: str, timeout: float = OLLAMA_TIMEOUT) -> Optional[int]:
     """Выполняет запрос к Ollama с указанной моделью."""
-    prompt = CLASSIFY_PROMPT.format(text=text)
     payload = {
         "model": model,
-        "prompt": prompt,
-        "stream": False,
+        "system": CLASSIFY_SYSTEM_PROMPT,
+        "prompt": CLASSIFY_TEXT_PROMPT.format(text=text),
+        "stream": OLLAMA_STREAM,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
         "options": {
             "temperature": 0.0,
             "num_predict": 3,
@@ -25,45 +302,153 @@ def _make_ollama_request(text: str, model: str) -> Optional[int]:
         }
     }
 
-    try:
-        response = requests.post(
-            OLLAMA_URL,
-            json=payload,
-            timeout=OLLAMA_TIMEOUT
-        )
-        response.raise_for_status()
-        
-        result = response.json()
-        answer = result.get("response", "").strip()
-        
-        for char in answer:
-            if char in ["0", "1"]:
-                return int(char)
-        
-        return None
-    except (requests.exceptions.RequestException, json.JSONDecodeError, ValueError) as e:
-        print(f"Ошибка запроса к модели {model}: {e}")
-        return None
+    request_started = time.perf_counter()
+    with span("ollama_request", model=model) as request_span:
+        try:
+            if OLLAMA_STREAM:
+                verdict = _stream_verdict(payload, model, timeout)
+            else:
+                started = time.monotonic()
+                result = ollama_client.generate(payload, timeout=timeout)
+                elapsed = time.monotonic() - started
+                model_latency.record(model, elapsed, "verdict")
+                model_latency.record(model, elapsed, "total")
+                verdict = _first_verdict(result.get("response", "").strip())
+            request_span.set(verdict=verdict)
+            return verdict
+        except (requests.exceptions.RequestException, json.JSONDecodeError, ValueError) as e:
+            kind = "timeout" if isinstance(e, requests.exceptions.Timeout) else "error"
+            ollama_errors.inc(model, kind)
+            request_span.set(error=kind)
+            log.error("ollama_request_failed", "Ошибка запроса к модели", model=model, kind=kind, error=str(e))
+            return None
+        finally:
+            ollama_request_seconds.observe(time.perf_counter() - request_started, model, "single")
+
+# Отчет последнего прогрева моделей (для /api/stats)
+warmup_report: dict = {}
+
+def _timed_generate(payload: dict) -> dict:
+    started = time.monotonic()
+    result = ollama_client.generate(payload, timeout=max(OLLAMA_TIMEOUT, 120))
+    return {
+        "wall_ms": round((time.monotonic() - started) * 1000, 1),
+        "load_ms": round(result.get("load_duration", 0) / 1e6, 1),
+        "prompt_eval_count": result.get("prompt_eval_count", 0),
+    }
+
+def warm_up_models(models: Optional[list] = None) -> dict:
+    """
+    Загружает модели в память и закрепляет их через keep_alive.
+    Для каждой модели измеряет холодный старт (загрузка), первый запрос
+    классификации (обработка system-промта) и повторный запрос, в котором
+    общий префикс уже обработан.
+    """
+    report = {}
+    for model in models or OLLAMA_WARMUP_MODELS:
+        try:
+            load = _timed_generate({"model": model, "prompt": "", "keep_alive": OLLAMA_KEEP_ALIVE})
+            sample = {
+                "model": model,
+                "system": CLASSIFY_SYSTEM_PROMPT,
+                "prompt": CLASSIFY_TEXT_PROMPT.format(text="Meeting at 2pm"),
+                "stream": False,
+                "keep_alive": OLLAMA_KEEP_ALIVE,
+                "options": {"temperature": 0.0, "num_predict": 3, "top_p": 0.1},
+            }
+            first = _timed_generate(sample)
+            repeat = _timed_generate(sample)
+            report[model] = {"cold": load, "first": first, "warm": repeat}
+        except (requests.exceptions.RequestException, json.JSONDecodeError, ValueError) as e:
+            report[model] = {"error": str(e)}
+    warmup_report.clear()
+    warmup_report.update(report)
+    return report
+
+def classify_hedged(text: str, deadline: float = OLLAMA_DEADLINE) -> Tuple[Optional[int], Optional[str]]:
+    """
+    Хеджированная классификация: если модель не ответила за свой перцентиль
+    задержки, параллельно запускается следующая модель цепочки. Побеждает
+    первый корректный ответ 0/1, все попытки укладываются в общий срок.
+    Возвращает вердикт и модель, которая его дала.
+    """
+    expires = time.monotonic() + deadline
+    pending = set()
+    models = {}
+    launched = 0
+    hedge_at = 0.0
+
+    def launch():
+        nonlocal launched, hedge_at
+        model = MODEL_CHAIN[launched]
+        if launched:
+            log.info("ollama_hedge", "Хеджирование: параллельный запрос", model=model)
+        launched += 1
+        now = time.monotonic()
+        future = _hedge_executor.submit(bind(_make_ollama_request), text, model, expires - now)
+        models[future] = model
+        pending.add(future)
+        hedge_at = now + model_latency.hedge_delay(model)
+
+    launch()
+    while pending:
+        now = time.monotonic()
+        if now >= expires:
+            break
+        timeout = expires - now
+        if launched < len(MODEL_CHAIN):
+            timeout = min(timeout, max(0.0, hedge_at - now))
+
+        done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            result = future.result()
+            if result is not None:
+                return result, models[future]
+
+        # Следующая модель: основная не уложилась в бюджет или все запущенные ответили без вердикта
+        if launched < len(MODEL_CHAIN) and (not pending or time.monotonic() >= hedge_at):
+            launch()
+
+    # Опоздавшие запросы завершатся сами: их таймаут ограничен общим сроком
+    return None, None
+
+def classify_with_models(text: str, deadline: float = OLLAMA_DEADLINE) -> Tuple[Optional[int], Optional[str]]:
+    """
+    Классифицирует текст основной, резервной и бэкап моделями, укладываясь
+    в deadline секунд. Возвращает вердикт и модель, которая его дала, или
+    (None, None), если ни одна модель не дала ответа.
+    """
+    if deadline <= 0:
+        log.warning("ollama_deadline_exceeded", "Срок классификации истек до опроса моделей")
+        return None, None
+
+    with span("ollama_available") as available_span:
+        available = ollama_client.is_available()
+        available_span.set(available=available)
+    if not available:
+        log.error("ollama_unavailable", "Ollama недоступна")
+        return None, None
+
+    if OLLAMA_HEDGE_ENABLED:
+        return classify_hedged(text, deadline)
+
+    expires = time.monotonic() + deadline
+    for index, model in enumerate(MODEL_CHAIN):
+        remaining = expires - time.monotonic()
+        if remaining <= 0:
+            break
+        if index:
+            log.warning("ollama_fallback", "Переключение на следующую модель", model=model)
+        result = _make_ollama_request(text, model, min(OLLAMA_TIMEOUT, remaining))
+        if result is not None:
+            return result, model
+
+    return None, None
 
 def classify_with_ollama(text: str) -> int:
     """Классифицирует текст с помощью Ollama."""
-    if not test_ollama_connection():
-        print("Ollama недоступна")
+    result, _ = classify_with_models(text)
+    if result is None:
+        log.error("all_models_unavailable", "Все модели недоступны, письмо считается безопасным")
         return 0
-    
-    result = _make_ollama_request(text, OLLAMA_MODEL)
-    if result is not None:
-        return result
-    
-    print(f"Переключение на резервную модель {OLLAMA_FALLBACK_MODEL}")
-    result = _make_ollama_request(text, OLLAMA_FALLBACK_MODEL)
-    if result is not None:
-        return result
-    
-    print(f"Переключение на бэкап модель {OLLAMA_BACKUP_MODEL}")
-    result = _make_ollama_request(text, OLLAMA_BACKUP_MODEL)
-    if result is not None:
-        return result
-    
-    print("Все модели недоступны, письмо считается безопасным")
-    return 0
\ No newline at end of file
+    return result
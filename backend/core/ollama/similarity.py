@@ -0,0 +1,148 @@
+import hashlib
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+from .cache import normalize_text
+from ..config import (
+    SIMILARITY_MAX_DISTANCE, SIMILARITY_INDEX_SIZE, SIMILARITY_TTL, SIMILARITY_RECHECK_RATE
+)
+
+SIGNATURE_BITS = 64
+SHINGLE_SIZE = 5  # Символьные шинглы: устойчивы к добавленным словам и перестановке фраз
+
+def simhash(text: str) -> int:
+    """64-битный SimHash нормализованного текста по символьным шинглам."""
+    text = normalize_text(text)
+    if len(text) <= SHINGLE_SIZE:
+        shingles = {text}
+    else:
+        shingles = {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+    # Хэши шинглов как строки бит: голосование по каждому биту сводится к
+    # подсчету "1" в столбце, что быстрее побитового цикла на Python
+    rows = [
+        format(int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little"), "064b")
+        for s in shingles
+    ]
+    half = len(rows) / 2
+    bits = "".join("1" if column.count("1") > half else "0" for column in map("".join, zip(*rows)))
+    return int(bits, 2)
+
+class NearDuplicateIndex:
+    """
+    Индекс SimHash-подписей недавно классифицированных писем. Письмо,
+    подпись которого отличается не более чем на max_distance бит, получает
+    вердикт найденного соседа без обращения к модели.
+
+    Подпись делится на max_distance + 1 полос (LSH): по принципу Дирихле у
+    подписей на таком расстоянии совпадает хотя бы одна полоса, поэтому
+    кандидатов достаточно искать в корзинах полос.
+    """
+
+    def __init__(self, max_distance: int = SIMILARITY_MAX_DISTANCE, capacity: int = SIMILARITY_INDEX_SIZE,
+                 ttl: float = SIMILARITY_TTL, recheck_rate: float = SIMILARITY_RECHECK_RATE):
+        self.max_distance = max_distance
+        self.capacity = capacity
+        self.ttl = ttl
+        self.recheck_rate = recheck_rate
+        bands = max_distance + 1
+        self._band_width = SIGNATURE_BITS // bands
+        self._bands = bands
+        self._entries: "OrderedDict[int, Tuple[int, float]]" = OrderedDict()
+        self._buckets: List[Dict[int, Set[int]]] = [{} for _ in range(bands)]
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.evictions = 0
+        self.rechecks = 0
+        self.disagreements = 0
+
+    def _band_keys(self, signature: int) -> List[int]:
+        mask = (1 << self._band_width) - 1
+        return [signature >> (band * self._band_width) & mask for band in range(self._bands)]
+
+    def _remove(self, signature: int):
+        self._entries.pop(signature, None)
+        for band, key in enumerate(self._band_keys(signature)):
+            bucket = self._buckets[band].get(key)
+            if bucket is not None:
+                bucket.discard(signature)
+                if not bucket:
+                    del self._buckets[band][key]
+
+    def lookup(self, signature: int) -> Optional[int]:
+        """
+        Вердикт ближайшего соседа в пределах max_distance или None.
+        Попадание засчитывается отдельно (record_reuse), когда вердикт
+        действительно использован, а не отправлен на перепроверку.
+        """
+        now = time.time()
+        with self._lock:
+            self.lookups += 1
+            candidates = set()
+            for band, key in enumerate(self._band_keys(signature)):
+                candidates |= self._buckets[band].get(key, set())
+
+            best, best_distance = None, self.max_distance + 1
+            for candidate in candidates:
+                verdict, created_at = self._entries[candidate]
+                if now - created_at > self.ttl:
+                    continue
+                distance = bin(candidate ^ signature).count("1")
+                if distance < best_distance:
+                    best, best_distance = candidate, distance
+            if best is None:
+                return None
+            self._entries.move_to_end(best)
+            return self._entries[best][0]
+
+    def record_reuse(self):
+        with self._lock:
+            self.hits += 1
+
+    def add(self, signature: int, verdict: int):
+        with self._lock:
+            if signature in self._entries:
+                self._remove(signature)
+            self._entries[signature] = (verdict, time.time())
+            for band, key in enumerate(self._band_keys(signature)):
+                self._buckets[band].setdefault(key, set()).add(signature)
+            while len(self._entries) > self.capacity:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def should_recheck(self) -> bool:
+        """Выборочная перепроверка: найденный вердикт все равно сверяется с моделью."""
+        return random.random() < self.recheck_rate
+
+    def record_recheck(self, reused: int, verdict: int):
+        with self._lock:
+            self.rechecks += 1
+            if reused != verdict:
+                self.disagreements += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            for bucket in self._buckets:
+                bucket.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "capacity": self.capacity,
+                "max_distance": self.max_distance,
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "reuse_rate": self.hits / self.lookups if self.lookups else 0.0,
+                "evictions": self.evictions,
+                "rechecks": self.rechecks,
+                "disagreements": self.disagreements,
+                "disagreement_rate": self.disagreements / self.rechecks if self.rechecks else 0.0,
+            }
+
+near_duplicates = NearDuplicateIndex()
@@ -0,0 +1,156 @@
+"""
+Дешевый детерминированный фильтр перед LLM: списки доверенных отправителей
+и текстов, а также словарь угроз, который проверяется автоматом Ахо-Корасик
+за один проход по тексту. Без модели блокируются только письма с несколькими
+разными сильными совпадениями; остальные совпадения решает LLM.
+"""
+
+import threading
+from collections import deque
+from typing import Dict, Iterable, Optional
+from .config import (
+    THREAT_LEXICON, PREFILTER_BLOCK_SCORE, PREFILTER_STRONG_WEIGHT, PREFILTER_MIN_STRONG_HITS,
+    PREFILTER_PASS_CLEAN, SENDER_ALLOWLIST, CONTENT_HASH_ALLOWLIST
+)
+from .ollama.cache import normalize_text, content_hash
+
+class AhoCorasick:
+    """Автомат для поиска всех вхождений набора подстрок за один проход."""
+
+    def __init__(self, patterns: Iterable[str]):
+        self._goto: list = [{}]
+        self._fail: list = [0]
+        self._out: list = [[]]
+        for pattern in patterns:
+            self._add(pattern)
+        self._build()
+
+    def _add(self, pattern: str):
+        node = 0
+        for char in pattern:
+            nxt = self._goto[node].get(char)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][char] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append(pattern)
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, nxt in self._goto[node].items():
+                queue.append(nxt)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(char, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def find_all(self, text: str, word_start: bool = False) -> set:
+        """
+        Возвращает множество найденных шаблонов.
+        word_start=True — только вхождения, которые начинаются с начала слова.
+        """
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set()
+        node = 0
+        for index, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if out[node]:
+                for pattern in out[node]:
+                    start = index - len(pattern) + 1
+                    if not word_start or start == 0 or not text[start - 1].isalnum():
+                        found.add(pattern)
+        return found
+
+class PreFilter:
+    """
+    Принимает решение без модели в очевидных случаях.
+    Возвращает (вердикт, стадия); вердикт None означает передачу письма в LLM.
+    """
+
+    def __init__(self, lexicon: Dict[str, int] = THREAT_LEXICON,
+                 block_score: int = PREFILTER_BLOCK_SCORE,
+                 strong_weight: int = PREFILTER_STRONG_WEIGHT,
+                 min_strong_hits: int = PREFILTER_MIN_STRONG_HITS,
+                 pass_clean: bool = PREFILTER_PASS_CLEAN,
+                 sender_allowlist: Iterable[str] = SENDER_ALLOWLIST,
+                 hash_allowlist: Iterable[str] = CONTENT_HASH_ALLOWLIST):
+        self.lexicon = {normalize_text(term): weight for term, weight in lexicon.items()}
+        self.matcher = AhoCorasick(self.lexicon)
+        self.block_score = block_score
+        self.strong_weight = strong_weight
+        self.min_strong_hits = min_strong_hits
+        self.pass_clean = pass_clean
+        allowed = {s.strip().lower() for s in sender_allowlist}
+        self.senders = {s for s in allowed if not s.startswith("@")}
+        self.domains = {s for s in allowed if s.startswith("@")}
+        self.hashes = {h.lower() for h in hash_allowlist}
+        self._lock = threading.Lock()
+        self.counters = {
+            "allowlist_sender": 0,
+            "allowlist_hash": 0,
+            "lexicon_block": 0,
+            "lexicon_pass": 0,
+            "escalated": 0,
+        }
+
+    def _count(self, stage: str):
+        with self._lock:
+            self.counters[stage] += 1
+
+    def is_sender_allowed(self, sender: Optional[str]) -> bool:
+        if not sender:
+            return False
+        sender = sender.strip().lower()
+        if sender in self.senders:
+            return True
+        at = sender.rfind("@")
+        return at != -1 and sender[at:] in self.domains
+
+    def matches(self, text: str) -> set:
+        """Различные термины словаря, с которых начинаются слова текста."""
+        return self.matcher.find_all(normalize_text(text), word_start=True)
+
+    def score(self, text: str) -> int:
+        """Суммарный вес различных найденных терминов."""
+        return sum(self.lexicon[term] for term in self.matches(text))
+
+    def check(self, text: str, sender: Optional[str] = None) -> tuple:
+        if self.is_sender_allowed(sender):
+            self._count("allowlist_sender")
+            return 0, "allowlist_sender"
+        if self.hashes and content_hash(text) in self.hashes:
+            self._count("allowlist_hash")
+            return 0, "allowlist_hash"
+
+        terms = self.matches(text)
+        score = sum(self.lexicon[term] for term in terms)
+        strong = sum(1 for term in terms if self.lexicon[term] >= self.strong_weight)
+        if score >= self.block_score and strong >= self.min_strong_hits:
+            self._count("lexicon_block")
+            return 1, "lexicon_block"
+        if score == 0 and self.pass_clean:
+            self._count("lexicon_pass")
+            return 0, "lexicon_pass"
+
+        self._count("escalated")
+        return None, "escalated"
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+        total = sum(counters.values())
+        decided = total - counters["escalated"]
+        counters["total"] = total
+        counters["llm_avoided_rate"] = decided / total if total else 0.0
+        return counters
+
+# Автомат строится один раз при импорте
+prefilter = PreFilter()
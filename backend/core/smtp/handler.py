@@ -1,66 +1,77 @@
-import smtplib
-from email.parser import Parser
-from typing import Optional
-from ..ollama.client import classify_with_ollama
-from ..database.repo import log_blocked_email
-from ..config import MAILHOG_HOST, MAILHOG_SMTP_PORT
+from typing import Optional, Union
+from ..classifier import classify_email
+from ..database.writer import blocked_email_writer
+from ..logger import log
+from ..metrics import stage_seconds, verdicts
+from ..tracing import span
+from .mime import extract_text
+from .relay import relay_pool
+from .spool import message_spool
+from ..config import SPOOL_ENABLED
 
 class EmailHandler:
     @staticmethod
-    def forward_to_mailhog(sender: str, recipients: list, email_data: str) -> bool:
+    def forward_to_mailhog(sender: str, recipients: list, email_data: Union[bytes, str]) -> bool:
         """
         Пересылает письмо в MailHog.
         Возвращает True в случае успеха, False при ошибке.
         """
         try:
-            # Подключаемся к MailHog SMTP серверу
-            with smtplib.SMTP(MAILHOG_HOST, MAILHOG_SMTP_PORT) as server:
-                # MailHog не требует аутентификации
-                server.sendmail(sender, recipients, email_data)
-            print(f"📬 Письмо от {sender} переслано в MailHog")
+            # Соединение берется из пула; MailHog не требует аутентификации
+            relay_pool.send(sender, recipients, email_data)
+            log.info("relay_ok", "Письмо переслано в MailHog", sample=True, sender=sender)
             return True
         except Exception as e:
-            print(f"❌ Ошибка пересылки в MailHog: {e}")
+            log.error("relay_failed", "Ошибка пересылки в MailHog", sender=sender, error=str(e))
             return False
     @staticmethod
-    def extract_email_text(email_data: str) -> tuple[str, str]:
+    def extract_email_text(email_data: Union[bytes, str]) -> tuple[str, str]:
         """
         Извлекает тему и тело письма.
-        Возвращает (subject, body).
+        Возвращает (subject, body); вложения не декодируются,
+        текст ограничен MIME_TEXT_BUDGET символами.
         """
-        email = Parser().parsestr(email_data)
-        subject = email.get("Subject", "")
-
-        body = ""
-        if email.is_multipart():
-            for part in email.walk():
-                if part.get_content_type() == "text/plain":
-                    body += part.get_payload(decode=True).decode(errors="ignore")
-        else:
-            body = email.get_payload(decode=True).decode(errors="ignore")
-
-        return subject, body
+        if isinstance(email_data, str):
+            email_data = email_data.encode("utf-8", errors="ignore")
+        return extract_text(email_data)
 
     @staticmethod
-    def process_email(sender: str, recipients: list, email_data: str) -> Optional[str]:
+    def process_email(sender: str, recipients: list, email_data: Union[bytes, str]) -> Optional[str]:
         """
         Обрабатывает письмо: извлекает текст, классифицирует и обрабатывает.
         Возвращает:
         - "550 Message blocked" если угроза,
-        - "250 OK" если письмо безопасно и переслано.
+        - "250 OK" если письмо безопасно и сохранено в очередь пересылки
+          (или переслано напрямую при SPOOL_ENABLED = False).
         """
-        subject, body = EmailHandler.extract_email_text(email_data)
-        threat_prob = classify_with_ollama(subject + "\n" + body)
+        with stage_seconds.time("parse"), span("parse"):
+            subject, body = EmailHandler.extract_email_text(email_data)
+        with stage_seconds.time("classify"), span("classify") as classify_span:
+            threat_prob = classify_email(subject + "\n" + body, sender)
+            classify_span.set(verdict=threat_prob)
+        verdicts.inc("threat" if threat_prob == 1 else "safe")
 
         if threat_prob == 1:
-            print(f"🚨 Блокировка письма от {sender}. Угроза: {threat_prob}")
-            log_blocked_email(sender, subject, body, threat_prob)
+            log.warning("blocked", "Письмо заблокировано", sender=sender, verdict=threat_prob)
+            # Запись в базу идет в фоне, ответ 550 не ждет commit
+            with span("db_log"):
+                blocked_email_writer.submit(sender, subject, body, threat_prob)
             return "550 Message blocked due to threat detection"
         else:
-            print(f"✅ Письмо от {sender} безопасно. Пересылаю в MailHog...")
-            
+            log.info("accepted", "Письмо безопасно", sample=True, sender=sender)
+
+            if SPOOL_ENABLED:
+                # Доставка идет в фоне, ответ не зависит от доступности MailHog
+                with stage_seconds.time("spool"), span("spool"):
+                    queued = message_spool.enqueue(sender, recipients, email_data)
+                if queued:
+                    return "250 OK"
+                return "451 Temporary failure - could not queue message"
+
             # Пересылаем безопасное письмо в MailHog
-            if EmailHandler.forward_to_mailhog(sender, recipients, email_data):
+            with span("relay"):
+                forwarded = EmailHandler.forward_to_mailhog(sender, recipients, email_data)
+            if forwarded:
                 return "250 OK"
             else:
                 return "450 Temporary failure - could not forward message"
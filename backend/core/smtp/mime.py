@@ -0,0 +1,127 @@
+"""
+Извлечение темы и текста письма прямо из байтов SMTP-конверта.
+
+Письмо не разбирается целиком: заголовки читаются только у частей, границы
+multipart ищутся по смещениям в исходном буфере, вложения пропускаются без
+декодирования, а текст собирается списком до исчерпания бюджета символов.
+"""
+
+import binascii
+import quopri
+from email.header import decode_header, make_header
+from email.parser import BytesHeaderParser
+from typing import List, Tuple
+from ..config import MIME_TEXT_BUDGET
+
+_header_parser = BytesHeaderParser()
+
+# Максимальная вложенность multipart, глубже части не рассматриваются
+MAX_DEPTH = 10
+# Заголовки длиннее этого считаются частью тела: конец заголовков не ищется по всему письму
+MAX_HEADER_BYTES = 64 * 1024
+
+def _split_headers(buf: bytes, start: int, end: int) -> Tuple[bytes, int]:
+    """Возвращает (байты заголовков, смещение начала тела) в диапазоне [start, end)."""
+    if buf.startswith(b"\r\n", start):
+        return b"", start + 2
+    if buf.startswith(b"\n", start):
+        return b"", start + 1
+    limit = min(end, start + MAX_HEADER_BYTES)
+    crlf = buf.find(b"\r\n\r\n", start, limit)
+    lf = buf.find(b"\n\n", start, limit)
+    if crlf != -1 and (lf == -1 or crlf < lf):
+        return buf[start:crlf + 2], crlf + 4
+    if lf != -1:
+        return buf[start:lf + 1], lf + 2
+    return buf[start:limit], limit
+
+def _decode_text(headers, buf: bytes, start: int, end: int, budget: int) -> str:
+    """Декодирует не больше, чем нужно для budget символов."""
+    encoding = str(headers.get("Content-Transfer-Encoding", "")).strip().lower()
+    charset = headers.get_content_charset() or "utf-8"
+
+    if encoding == "base64":
+        # 4 символа base64 дают 3 байта, символ UTF-8 занимает до 4 байт
+        raw = buf[start:min(end, start + budget * 6 + 4)]
+        raw = b"".join(raw.split())
+        raw = raw[:len(raw) - len(raw) % 4]
+        try:
+            payload = binascii.a2b_base64(raw)
+        except binascii.Error:
+            payload = b""
+    elif encoding == "quoted-printable":
+        payload = quopri.decodestring(buf[start:min(end, start + budget * 12)])
+    else:
+        payload = buf[start:min(end, start + budget * 4)]
+
+    try:
+        text = payload.decode(charset, errors="ignore")
+    except LookupError:
+        text = payload.decode("utf-8", errors="ignore")
+    return text[:budget]
+
+class _Extractor:
+    def __init__(self, buf: bytes, budget: int):
+        self.buf = buf
+        self.remaining = budget
+        self.parts: List[str] = []
+
+    def walk(self, headers, start: int, end: int, depth: int = 0):
+        if self.remaining <= 0 or depth > MAX_DEPTH:
+            return
+        ctype = headers.get_content_type()
+        if headers.get_content_maintype() == "multipart":
+            boundary = headers.get_param("boundary")
+            if boundary:
+                self._walk_multipart(str(boundary), start, end, depth)
+            return
+
+        # Корневая не-multipart часть декодируется, если это текст (как и раньше);
+        # внутри multipart берется только text/plain, вложения пропускаются
+        if depth == 0:
+            wanted = headers.get_content_maintype() == "text"
+        else:
+            wanted = ctype == "text/plain" and headers.get_content_disposition() != "attachment"
+        if wanted:
+            text = _decode_text(headers, self.buf, start, end, self.remaining)
+            self.parts.append(text)
+            self.remaining -= len(text)
+
+    def _walk_multipart(self, boundary: str, start: int, end: int, depth: int):
+        buf = self.buf
+        delimiter = b"--" + boundary.encode("ascii", errors="ignore")
+        pos = buf.find(delimiter, start, end)
+        while pos != -1 and self.remaining > 0:
+            after = pos + len(delimiter)
+            if buf.startswith(b"--", after):
+                return  # Закрывающая граница
+            line_end = buf.find(b"\n", after, end)
+            if line_end == -1:
+                return
+            part_start = line_end + 1
+            next_pos = buf.find(b"\n" + delimiter, part_start, end)
+            part_end = end if next_pos == -1 else next_pos
+            if part_end > part_start and buf[part_end - 1:part_end] == b"\r":
+                part_end -= 1
+
+            header_bytes, body_start = _split_headers(buf, part_start, part_end)
+            part_headers = _header_parser.parsebytes(header_bytes)
+            self.walk(part_headers, body_start, part_end, depth + 1)
+
+            pos = -1 if next_pos == -1 else next_pos + 1
+
+def extract_text(raw: bytes, budget: int = MIME_TEXT_BUDGET) -> Tuple[str, str]:
+    """
+    Возвращает (subject, body), где body содержит не более budget символов
+    текста из частей text/plain.
+    """
+    header_bytes, body_start = _split_headers(raw, 0, len(raw))
+    headers = _header_parser.parsebytes(header_bytes)
+    try:
+        subject = str(make_header(decode_header(headers.get("Subject", ""))))
+    except Exception:
+        subject = str(headers.get("Subject", ""))
+
+    extractor = _Extractor(raw, budget)
+    extractor.walk(headers, body_start, len(raw))
+    return subject, "".join(extractor.parts)
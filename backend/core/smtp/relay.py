@@ -0,0 +1,118 @@
+import smtplib
+import threading
+import time
+from typing import List, Union
+from ..metrics import stage_seconds, queue_depth
+from ..config import MAILHOG_HOST, MAILHOG_SMTP_PORT, RELAY_POOL_SIZE, RELAY_IDLE_TIMEOUT, RELAY_TIMEOUT
+
+class RelayPool:
+    """
+    Пул постоянных SMTP-соединений к нижестоящему серверу (MailHog).
+    Потокобезопасен, поэтому вызывается из рабочих потоков SMTP-конвейера.
+    Перед повторным использованием соединение получает RSET; при 421 или
+    разорванном сокете соединение пересоздается и отправка повторяется один раз.
+    """
+
+    def __init__(self, host: str = MAILHOG_HOST, port: int = MAILHOG_SMTP_PORT,
+                 size: int = RELAY_POOL_SIZE, idle_timeout: float = RELAY_IDLE_TIMEOUT,
+                 timeout: float = RELAY_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle: List[tuple] = []  # (соединение, время освобождения)
+        self._lock = threading.Lock()
+        self.connects = 0
+        self.reuses = 0
+
+    def _connect(self) -> smtplib.SMTP:
+        conn = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        conn.ehlo_or_helo_if_needed()
+        with self._lock:
+            self.connects += 1
+        return conn
+
+    @staticmethod
+    def _discard(conn: smtplib.SMTP):
+        try:
+            conn.quit()
+        except Exception:
+            conn.close()
+
+    def _acquire(self) -> smtplib.SMTP:
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn, released_at = self._idle.pop()
+            if time.monotonic() - released_at > self.idle_timeout:
+                self._discard(conn)
+                continue
+            try:
+                code, _ = conn.rset()
+            except (smtplib.SMTPException, OSError):
+                conn.close()
+                continue
+            if code != 250:
+                self._discard(conn)
+                continue
+            with self._lock:
+                self.reuses += 1
+            return conn
+        return self._connect()
+
+    def _release(self, conn: smtplib.SMTP):
+        with self._lock:
+            self._idle.append((conn, time.monotonic()))
+
+    def send(self, sender: str, recipients: list, email_data: Union[str, bytes]):
+        """Отправляет письмо. Исключения smtplib пробрасываются вызывающему."""
+        with self._slots, stage_seconds.time("relay"):
+            for attempt in range(2):
+                conn = self._acquire()
+                try:
+                    conn.sendmail(sender, recipients, email_data)
+                except smtplib.SMTPServerDisconnected:
+                    conn.close()
+                    if attempt == 0:
+                        continue
+                    raise
+                except smtplib.SMTPRecipientsRefused:
+                    # Отказ по адресатам — ответ исправного сервера: соединение
+                    # сбрасывается и возвращается в пул, а не закрывается
+                    try:
+                        conn.rset()
+                    except (smtplib.SMTPException, OSError):
+                        conn.close()
+                    else:
+                        self._release(conn)
+                    raise
+                except smtplib.SMTPResponseException as e:
+                    self._discard(conn)
+                    if e.smtp_code == 421 and attempt == 0:
+                        continue
+                    raise
+                except Exception:
+                    conn.close()
+                    raise
+                self._release(conn)
+                return
+
+    def close(self):
+        """Закрывает все простаивающие соединения."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "idle": len(self._idle),
+                "connects": self.connects,
+                "reuses": self.reuses,
+            }
+
+relay_pool = RelayPool()
+queue_depth.set_function(lambda: len(relay_pool._idle), "relay_idle_connections")
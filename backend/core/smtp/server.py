@@ -1,27 +1,113 @@
 import asyncio
 import time
+from concurrent.futures import ThreadPoolExecutor
 from aiosmtpd.controller import Controller
+from aiosmtpd.smtp import SMTP
 from .handler import EmailHandler
+from .relay import relay_pool
+from .spool import message_spool
+from ..metrics import smtp_sessions, smtp_sessions_active, smtp_messages, smtp_message_seconds, smtp_pending
+from ..ollama.cache import verdict_cache
+from ..tracing import TraceContext, new_trace_id
+from ..database.writer import blocked_email_writer
+from ..config import SMTP_WORKERS, SMTP_MAX_PENDING, SPOOL_ENABLED
+
+class InstrumentedSMTP(SMTP):
+    """SMTP-сессия aiosmtpd, учитывающая открытые и принятые соединения в метриках."""
+
+    def connection_made(self, transport):
+        smtp_sessions.inc()
+        smtp_sessions_active.inc()
+        super().connection_made(transport)
+
+    def connection_lost(self, error):
+        smtp_sessions_active.dec()
+        super().connection_lost(error)
+
+class InstrumentedController(Controller):
+    def factory(self):
+        return InstrumentedSMTP(self.handler, **self.SMTP_kwargs)
 
 class CustomSMTPHandler:
+    """
+    Обработчик aiosmtpd. Классификация и пересылка выполняются в пуле потоков,
+    чтобы медленный запрос к Ollama не останавливал цикл событий и прием
+    новых соединений.
+    """
+
+    def __init__(self, workers: int = SMTP_WORKERS, max_pending: int = SMTP_MAX_PENDING):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="smtp-worker")
+        self.max_pending = max_pending
+        # Счетчик меняется только из цикла событий, блокировка не нужна
+        self.pending = 0
+        smtp_pending.set_function(lambda: self.pending)
+
     async def handle_DATA(self, server, session, envelope):
-        email_data = envelope.content.decode("utf-8", errors="ignore")
-        recipients = envelope.rcpt_tos
-        response = EmailHandler.process_email(envelope.mail_from, recipients, email_data)
-        return response if response else "250 OK"
+        if self.pending >= self.max_pending:
+            # Обратное давление: отправитель повторит попытку позже
+            smtp_messages.inc("451")
+            return "451 4.3.2 Server busy, try again later"
+
+        started = time.perf_counter()
+        # Trace ID возвращается отправителю в тексте ответа и ищется в /api/traces
+        trace_id = new_trace_id()
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            response = await loop.run_in_executor(
+                self.executor,
+                self._process,
+                envelope.mail_from,
+                list(envelope.rcpt_tos),
+                envelope.content,
+                trace_id,
+                started,
+            )
+        finally:
+            self.pending -= 1
+        response = response if response else "250 OK"
+        smtp_message_seconds.observe(time.perf_counter() - started)
+        smtp_messages.inc(response[:3])
+        return f"{response} [trace {trace_id}]"
+
+    @staticmethod
+    def _process(sender: str, recipients: list, content: bytes, trace_id: str, received: float):
+        """Выполняется в рабочем потоке. Письмо передается байтами, без декодирования."""
+        with TraceContext(trace_id, received, sender=sender, recipients=len(recipients),
+                          size=len(content)) as trace:
+            if trace is not None:
+                # Сколько письмо ждало свободный рабочий поток
+                trace.add_span("queue_wait", received, time.perf_counter() - received)
+            response = EmailHandler.process_email(sender, recipients, content)
+            if trace is not None:
+                trace.attrs["response"] = (response or "250")[:3]
+            return response
+
+    def shutdown(self):
+        """Дожидается завершения писем в обработке и останавливает пул."""
+        self.executor.shutdown(wait=True)
 
 def run_smtp_server(port: int = 10025):
     """Запускает SMTP-сервер (блокирующий вызов)."""
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
 
-    controller = Controller(
-        CustomSMTPHandler(),
+    loaded = verdict_cache.load_persisted()
+    if loaded:
+        print(f"Загружено вердиктов из кэша: {loaded}")
+
+    if SPOOL_ENABLED:
+        message_spool.start()
+    blocked_email_writer.start()
+
+    handler = CustomSMTPHandler()
+    controller = InstrumentedController(
+        handler,
         hostname="127.0.0.1",
         port=port,
         loop=loop
     )
-    
+
     # Эта команда блокирует, поэтому ее нужно запускать в потоке
     controller.start()
     print(f"SMTP-сервер запущен на 127.0.0.1:{port}...")
@@ -32,4 +118,8 @@ def run_smtp_server(port: int = 10025):
         pass
     finally:
         controller.stop()
+        handler.shutdown()
+        blocked_email_writer.stop()
+        message_spool.stop()
+        relay_pool.close()
         loop.close()
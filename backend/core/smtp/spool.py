@@ -0,0 +1,395 @@
+import json
+import queue
+import smtplib
+import threading
+import time
+from email.message import Message
+from email.mime.base import MIMEBase
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.parser import BytesHeaderParser
+from email.utils import formatdate, make_msgid
+from typing import Dict, List, Optional, Union
+from sqlalchemy import create_engine, event, func, update
+from sqlalchemy.orm import sessionmaker
+from .relay import relay_pool
+from ..database.models import SpoolBase, SpooledMessage
+from ..logger import log
+from ..metrics import queue_depth
+from ..config import (
+    SPOOL_DB_NAME, SPOOL_WORKERS, SPOOL_BATCH_SIZE, SPOOL_BATCH_WAIT_MS,
+    SPOOL_RETRY_BASE, SPOOL_RETRY_MAX, SPOOL_MAX_ATTEMPTS, SPOOL_SEND_DSN, SPOOL_DSN_FROM
+)
+
+class _PendingWrite:
+    """Письмо, ожидающее записи на диск, и событие для ожидающего SMTP-сеанса."""
+
+    __slots__ = ("record", "done", "ok", "state")
+
+    def __init__(self, record: SpooledMessage):
+        self.record = record
+        self.done = threading.Event()
+        self.ok = False
+        # waiting -> writing (взято в транзакцию) или abandoned (сеанс перестал ждать)
+        self.state = "waiting"
+
+def build_dsn(message: SpooledMessage, error: str, permanent: bool) -> bytes:
+    """Уведомление о недоставке (multipart/report, RFC 3464) с заголовками исходного письма."""
+    report = MIMEMultipart("report", report_type="delivery-status")
+    report["From"] = SPOOL_DSN_FROM
+    report["To"] = message.sender
+    report["Subject"] = "Undelivered Mail Returned to Sender"
+    report["Date"] = formatdate()
+    report["Message-ID"] = make_msgid()
+    report["Auto-Submitted"] = "auto-replied"
+
+    recipients = json.loads(message.recipients)
+    report.attach(MIMEText(
+        "Письмо не удалось доставить получателям:\n"
+        + "".join(f"  {recipient}\n" for recipient in recipients)
+        + f"\nПопыток: {message.attempts + 1}\nОшибка: {error}\n",
+        "plain", "utf-8"
+    ))
+
+    # Постоянная ошибка сервера — 5.0.0, исчерпаны повторы — 5.4.7 (истек срок доставки)
+    status_code = "5.0.0" if permanent else "5.4.7"
+    blocks = [Message()]
+    blocks[0]["Reporting-MTA"] = "dns; localhost"
+    blocks[0]["Arrival-Date"] = formatdate(message.created_at)
+    for recipient in recipients:
+        block = Message()
+        block["Final-Recipient"] = f"rfc822; {recipient}"
+        block["Action"] = "failed"
+        block["Status"] = status_code
+        block["Diagnostic-Code"] = f"smtp; {error}"
+        blocks.append(block)
+    status = MIMEBase("message", "delivery-status")
+    status.set_payload(blocks)
+    report.attach(status)
+
+    headers = BytesHeaderParser().parsebytes(message.data)
+    report.attach(MIMEText("".join(f"{name}: {value}\n" for name, value in headers.items()), "rfc822-headers"))
+    return report.as_bytes()
+
+class MessageSpool:
+    """
+    Надежная очередь пересылки в SQLite.
+
+    Запись идет групповыми транзакциями: писатель собирает письма из всех
+    сеансов и фиксирует их одним commit (один fsync на пакет). enqueue()
+    возвращает управление только после фиксации, поэтому ответ 250 дается
+    уже сохраненному письму. Фоновые потоки доставляют письма через пул
+    соединений и повторяют неудачные попытки с экспоненциальной паузой.
+    """
+
+    def __init__(self, path: str = SPOOL_DB_NAME, workers: int = SPOOL_WORKERS):
+        self.engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+        event.listen(self.engine, "connect", self._configure_connection)
+        self.Session = sessionmaker(bind=self.engine, expire_on_commit=False)
+        self.workers = workers
+
+        self._writes: "queue.Queue[_PendingWrite]" = queue.Queue()
+        self._pending_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._claim_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self._stats_lock = threading.Lock()
+        self.delivered = 0
+        self.retries = 0
+        self.failed = 0
+        self.dsn_sent = 0
+
+    @staticmethod
+    def _configure_connection(dbapi_connection, _):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        # FULL: после commit письмо гарантированно на диске
+        cursor.execute("PRAGMA synchronous=FULL")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.close()
+
+    def start(self):
+        """Создает таблицу, возвращает «зависшие» письма в очередь и запускает потоки."""
+        with self._start_lock:
+            if self._threads:
+                return
+            self._stop.clear()
+            SpoolBase.metadata.create_all(self.engine)
+            session = self.Session()
+            try:
+                # Письма, доставка которых прервалась остановкой процесса
+                session.execute(
+                    update(SpooledMessage)
+                    .where(SpooledMessage.status == "sending")
+                    .values(status="queued")
+                )
+                session.commit()
+            finally:
+                session.close()
+
+            self._threads.append(threading.Thread(target=self._writer_loop, name="spool-writer", daemon=True))
+            for i in range(self.workers):
+                self._threads.append(threading.Thread(target=self._delivery_loop, name=f"spool-delivery-{i}", daemon=True))
+            for thread in self._threads:
+                thread.start()
+
+    def stop(self, timeout: float = 10):
+        """Записывает оставшиеся письма и останавливает потоки."""
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def enqueue(self, sender: str, recipients: list, email_data: Union[str, bytes],
+                timeout: float = 10) -> bool:
+        """
+        Сохраняет письмо на диск. True, если запись зафиксирована.
+        False означает, что письмо точно не записано: если писатель уже взял
+        его в транзакцию, ждем ее результата, а не таймаута, иначе отправитель
+        получил бы 451, повторил отправку, и письмо доставилось бы дважды.
+        """
+        self.start()
+        if isinstance(email_data, str):
+            email_data = email_data.encode("utf-8")
+        now = time.time()
+        pending = _PendingWrite(SpooledMessage(
+            sender=sender,
+            recipients=json.dumps(list(recipients)),
+            data=email_data,
+            status="queued",
+            attempts=0,
+            next_attempt_at=now,
+            created_at=now,
+        ))
+        self._writes.put(pending)
+        if pending.done.wait(timeout):
+            return pending.ok
+        with self._pending_lock:
+            if pending.state == "waiting":
+                pending.state = "abandoned"
+                return False
+        pending.done.wait()
+        return pending.ok
+
+    def _collect_writes(self) -> List[_PendingWrite]:
+        try:
+            batch = [self._writes.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + SPOOL_BATCH_WAIT_MS / 1000
+        while len(batch) < SPOOL_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._writes.get(timeout=remaining))
+                else:
+                    # Срок вышел, но уже пришедшие письма попадут в ту же транзакцию
+                    batch.append(self._writes.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _writer_loop(self):
+        while not (self._stop.is_set() and self._writes.empty()):
+            batch = self._collect_writes()
+            # Письма, которые сеанс уже не ждет (ответил 451), не записываем
+            with self._pending_lock:
+                batch = [pending for pending in batch if pending.state == "waiting"]
+                for pending in batch:
+                    pending.state = "writing"
+            if not batch:
+                continue
+            session = self.Session()
+            try:
+                session.add_all([pending.record for pending in batch])
+                session.commit()
+                ok = True
+            except Exception as e:
+                session.rollback()
+                log.error("spool_write_failed", "Ошибка записи в очередь пересылки", error=str(e))
+                ok = False
+            finally:
+                session.close()
+            for pending in batch:
+                pending.ok = ok
+                pending.done.set()
+            if ok:
+                self._wakeup.set()
+
+    def _claim(self) -> Optional[SpooledMessage]:
+        """Берет одно письмо, срок доставки которого наступил."""
+        with self._claim_lock:
+            session = self.Session()
+            try:
+                message = session.query(SpooledMessage)\
+                                 .filter(SpooledMessage.status == "queued",
+                                         SpooledMessage.next_attempt_at <= time.time())\
+                                 .order_by(SpooledMessage.next_attempt_at)\
+                                 .first()
+                if message is None:
+                    return None
+                message.status = "sending"
+                session.commit()
+                return message
+            finally:
+                session.close()
+
+    def _next_due_in(self) -> float:
+        session = self.Session()
+        try:
+            next_at = session.query(SpooledMessage.next_attempt_at)\
+                             .filter(SpooledMessage.status == "queued")\
+                             .order_by(SpooledMessage.next_attempt_at)\
+                             .limit(1)\
+                             .scalar()
+        finally:
+            session.close()
+        if next_at is None:
+            return 5.0
+        return min(max(next_at - time.time(), 0.0), 5.0)
+
+    def _delivery_loop(self):
+        while not self._stop.is_set():
+            try:
+                message = self._claim()
+            except Exception as e:
+                log.error("spool_read_failed", "Ошибка чтения очереди пересылки", error=str(e))
+                message = None
+            if message is None:
+                self._wakeup.clear()
+                self._wakeup.wait(self._next_due_in())
+                continue
+            self._deliver(message)
+
+    def _deliver(self, message: SpooledMessage):
+        permanent = False
+        try:
+            relay_pool.send(message.sender, json.loads(message.recipients), message.data)
+            error = None
+        except smtplib.SMTPResponseException as e:
+            error = f"{e.smtp_code} {e.smtp_error!r}"
+            permanent = e.smtp_code >= 500
+        except smtplib.SMTPRecipientsRefused as e:
+            error = f"recipients refused: {e.recipients!r}"
+            permanent = True
+        except Exception as e:
+            error = str(e)
+
+        session = self.Session()
+        try:
+            if error is None:
+                session.query(SpooledMessage).filter(SpooledMessage.id == message.id).delete()
+                with self._stats_lock:
+                    self.delivered += 1
+                log.info("relay_ok", "Письмо переслано в MailHog", sample=True, sender=message.sender)
+            else:
+                attempts = message.attempts + 1
+                values = {"attempts": attempts, "last_error": error, "status": "queued"}
+                if permanent or attempts >= SPOOL_MAX_ATTEMPTS:
+                    values["status"] = "dead"
+                    with self._stats_lock:
+                        self.failed += 1
+                    # Каждая потеря письма пишется в журнал, без ограничения частоты ошибок
+                    log.error("relay_dead", "Письмо не доставлено", rate_limited=False, message_id=message.id,
+                              sender=message.sender, recipients=message.recipients, attempts=attempts, error=error)
+                else:
+                    values["next_attempt_at"] = time.time() + min(SPOOL_RETRY_BASE * 2 ** (attempts - 1), SPOOL_RETRY_MAX)
+                    with self._stats_lock:
+                        self.retries += 1
+                    log.warning("relay_retry", "Ошибка пересылки в MailHog, повтор", sender=message.sender, attempts=attempts, error=error)
+                session.execute(
+                    update(SpooledMessage).where(SpooledMessage.id == message.id).values(**values)
+                )
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            log.error("spool_update_failed", "Ошибка обновления очереди пересылки", error=str(e))
+            return
+        finally:
+            session.close()
+
+        if error is not None and (permanent or message.attempts + 1 >= SPOOL_MAX_ATTEMPTS):
+            self._send_dsn(message, error, permanent)
+
+    def _send_dsn(self, message: SpooledMessage, error: str, permanent: bool):
+        """Отправляет уведомление о недоставке; на уведомление о недоставке ответа нет."""
+        if not SPOOL_SEND_DSN or message.sender in ("", "<>"):
+            return
+        try:
+            relay_pool.send("", [message.sender], build_dsn(message, error, permanent))
+            with self._stats_lock:
+                self.dsn_sent += 1
+        except Exception as e:
+            log.error("relay_dsn_failed", "Не удалось отправить уведомление о недоставке", rate_limited=False,
+                      message_id=message.id, sender=message.sender, error=str(e))
+
+    def dead_letters(self, limit: int = 50) -> List[Dict]:
+        """Недоставляемые письма, последние первыми (без тела)."""
+        session = self.Session()
+        try:
+            messages = session.query(SpooledMessage)\
+                              .filter(SpooledMessage.status == "dead")\
+                              .order_by(SpooledMessage.id.desc())\
+                              .limit(limit)\
+                              .all()
+            return [{
+                "id": message.id,
+                "sender": message.sender,
+                "recipients": json.loads(message.recipients),
+                "attempts": message.attempts,
+                "last_error": message.last_error,
+                "size": len(message.data),
+                "created_at": message.created_at,
+            } for message in messages]
+        finally:
+            session.close()
+
+    def requeue(self, message_id: Optional[int] = None) -> int:
+        """
+        Возвращает недоставляемые письма в очередь с обнуленным счетчиком
+        попыток: одно по id или все. Возвращает число возвращенных писем.
+        """
+        self.start()
+        query = update(SpooledMessage).where(SpooledMessage.status == "dead")
+        if message_id is not None:
+            query = query.where(SpooledMessage.id == message_id)
+        session = self.Session()
+        try:
+            count = session.execute(
+                query.values(status="queued", attempts=0, next_attempt_at=time.time())
+            ).rowcount
+            session.commit()
+        finally:
+            session.close()
+        if count:
+            log.info("relay_requeued", "Недоставляемые письма возвращены в очередь", count=count)
+            self._wakeup.set()
+        return count
+
+    def stats(self) -> dict:
+        counts = {"queued": 0, "sending": 0, "dead": 0}
+        session = self.Session()
+        try:
+            for status, count in session.query(SpooledMessage.status, func.count())\
+                                        .group_by(SpooledMessage.status).all():
+                counts[status] = count
+        except Exception:
+            pass
+        finally:
+            session.close()
+        with self._stats_lock:
+            counts.update({
+                "write_queue": self._writes.qsize(),
+                "delivered": self.delivered,
+                "retries": self.retries,
+                "failed": self.failed,
+                "dsn_sent": self.dsn_sent,
+            })
+        return counts
+
+message_spool = MessageSpool()
+queue_depth.set_function(message_spool._writes.qsize, "spool_write")
+queue_depth.set_function(lambda: message_spool.stats()["queued"], "spool_delivery")
@@ -0,0 +1,167 @@
+"""
+Трассировка обработки письма по стадиям.
+
+Каждое письмо получает trace ID; стадии (разбор, этапы классификации,
+запросы к моделям, пересылка) записываются как интервалы относительно начала
+письма. Трассы дольше TRACE_SLOW_THRESHOLD_MS сохраняются в кольцевой буфер.
+"""
+
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Callable, List, Optional
+from .config import TRACE_ENABLED, TRACE_SLOW_THRESHOLD_MS, TRACE_BUFFER_SIZE
+
+_local = threading.local()
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+class Trace:
+    __slots__ = ("trace_id", "started_at", "started", "duration", "spans", "attrs")
+
+    def __init__(self, trace_id: Optional[str] = None, started: Optional[float] = None, **attrs):
+        self.trace_id = trace_id or new_trace_id()
+        # started (perf_counter) позволяет начать трассу с момента приема DATA,
+        # а не с момента, когда письмо дошло до рабочего потока
+        now = time.perf_counter()
+        self.started = started if started is not None else now
+        self.started_at = time.time() - (now - self.started)
+        self.duration: Optional[float] = None
+        # (имя, смещение от начала, длительность, атрибуты); list.append атомарен,
+        # поэтому интервалы можно добавлять из потоков хеджирования без блокировки
+        self.spans: List[tuple] = []
+        self.attrs = attrs
+
+    def add_span(self, name: str, started: float, duration: float, attrs: Optional[dict] = None):
+        self.spans.append((name, started - self.started, duration, attrs))
+
+    def finish(self, **attrs):
+        self.duration = time.perf_counter() - self.started
+        self.attrs.update(attrs)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "started_at": self.started_at,
+            "duration_ms": round((self.duration or 0) * 1000, 2),
+            "attrs": self.attrs,
+            "spans": [
+                {
+                    "name": name,
+                    "offset_ms": round(offset * 1000, 2),
+                    "duration_ms": round(duration * 1000, 2),
+                    **({"attrs": attrs} if attrs else {}),
+                }
+                for name, offset, duration, attrs in sorted(self.spans, key=lambda span: span[1])
+            ],
+        }
+
+class _Span:
+    __slots__ = ("trace", "name", "attrs", "started")
+
+    def __init__(self, trace: Optional[Trace], name: str, attrs: dict):
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        """Атрибуты, известные только в конце стадии (вердикт, модель)."""
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.trace is not None:
+            if exc_type is not None:
+                self.attrs["error"] = exc_type.__name__
+            self.trace.add_span(self.name, self.started, time.perf_counter() - self.started, self.attrs or None)
+        return False
+
+def current_trace() -> Optional[Trace]:
+    return getattr(_local, "trace", None)
+
+def span(name: str, **attrs) -> _Span:
+    """with span("parse"): ... — записывает интервал в трассу текущего потока, если она есть."""
+    return _Span(current_trace(), name, attrs)
+
+def bind(function: Callable, trace: Optional[Trace] = None) -> Callable:
+    """Переносит текущую трассу в другой поток (пул хеджирования)."""
+    trace = trace or current_trace()
+    if trace is None:
+        return function
+
+    def wrapper(*args, **kwargs):
+        previous = current_trace()
+        _local.trace = trace
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _local.trace = previous
+    return wrapper
+
+class SlowTraceBuffer:
+    """Кольцевой буфер медленных трасс."""
+
+    def __init__(self, threshold_ms: float = TRACE_SLOW_THRESHOLD_MS, size: int = TRACE_BUFFER_SIZE):
+        self.threshold = threshold_ms / 1000
+        self._traces: "deque[Trace]" = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self.recorded = 0
+        self.slow = 0
+
+    def offer(self, trace: Trace):
+        with self._lock:
+            self.recorded += 1
+            if trace.duration is not None and trace.duration >= self.threshold:
+                self.slow += 1
+                self._traces.append(trace)
+
+    def slowest(self, limit: int = 20) -> List[dict]:
+        with self._lock:
+            traces = list(self._traces)
+        traces.sort(key=lambda trace: trace.duration or 0, reverse=True)
+        return [trace.to_dict() for trace in traces[:limit]]
+
+    def get(self, trace_id: str) -> Optional[dict]:
+        with self._lock:
+            for trace in self._traces:
+                if trace.trace_id == trace_id:
+                    return trace.to_dict()
+        return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "threshold_ms": self.threshold * 1000,
+                "recorded": self.recorded,
+                "slow": self.slow,
+                "buffered": len(self._traces),
+            }
+
+slow_traces = SlowTraceBuffer()
+
+class TraceContext:
+    """
+    Трасса письма на время обработки в рабочем потоке:
+        with TraceContext(trace_id, sender=sender) as trace: ...
+    """
+
+    def __init__(self, trace_id: Optional[str] = None, started: Optional[float] = None, **attrs):
+        self.trace = Trace(trace_id, started, **attrs) if TRACE_ENABLED else None
+        self._previous = None
+
+    def __enter__(self) -> Optional[Trace]:
+        self._previous = current_trace()
+        _local.trace = self.trace
+        return self.trace
+
+    def __exit__(self, exc_type, exc, tb):
+        _local.trace = self._previous
+        if self.trace is not None:
+            self.trace.finish(**({"error": exc_type.__name__} if exc_type else {}))
+            slow_traces.offer(self.trace)
+        return False
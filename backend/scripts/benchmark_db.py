@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Сравнивает скорость работы с базой заблокированных писем:
+- "до": create_engine и create_all на каждый вызов (прежняя схема repo.py),
+- "после": общий engine с WAL и однократным созданием схемы.
+
+Запуск из каталога backend:
+    python scripts/benchmark_db.py --inserts 500 --reads 500
+База создается во временном каталоге, рабочая blocked_emails.db не меняется.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+def legacy_insert(i: int):
+    """Вставка так, как это делалось до общего engine."""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from core.database.models import Base, BlockedEmail
+    from core.config import DB_NAME
+
+    engine = create_engine(f"sqlite:///{DB_NAME}")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    try:
+        session.add(BlockedEmail(sender=f"bench{i}@example.com", subject="Тест",
+                                 body="Тело письма " * 20, threat_probability=1))
+        session.commit()
+    finally:
+        session.close()
+        engine.dispose()
+
+def legacy_read(_: int):
+    """Чтение страницы и счетчика так, как это делалось до общего engine."""
+    from sqlalchemy import create_engine, desc
+    from sqlalchemy.orm import sessionmaker
+    from core.database.models import Base, BlockedEmail
+    from core.config import DB_NAME
+
+    for query in ("page", "count"):
+        engine = create_engine(f"sqlite:///{DB_NAME}")
+        Base.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+        try:
+            if query == "page":
+                session.query(BlockedEmail).order_by(desc(BlockedEmail.timestamp)).limit(50).all()
+            else:
+                session.query(BlockedEmail).count()
+        finally:
+            session.close()
+            engine.dispose()
+
+def current_insert(i: int):
+    from core.database.repo import log_blocked_email
+    log_blocked_email(f"bench{i}@example.com", "Тест", "Тело письма " * 20, 1)
+
+def current_read(_: int):
+    from core.database.repo import get_blocked_emails, get_blocked_emails_count
+    get_blocked_emails(limit=50)
+    get_blocked_emails_count()
+
+def measure(name: str, func, count: int) -> float:
+    started = time.perf_counter()
+    for i in range(count):
+        func(i)
+    elapsed = time.perf_counter() - started
+    rate = count / elapsed if elapsed > 0 else float("inf")
+    print(f"   {name:<22} {count:>6} за {elapsed:7.2f} с  →  {rate:9.1f} оп/с")
+    return rate
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк базы заблокированных писем")
+    parser.add_argument("--inserts", type=int, default=300)
+    parser.add_argument("--reads", type=int, default=300)
+    args = parser.parse_args()
+
+    # DB_NAME относительный, поэтому база создается в текущем (временном) каталоге
+    workdir = tempfile.mkdtemp(prefix="smtp_filter_bench_")
+    os.chdir(workdir)
+    print(f"Временная база: {workdir}")
+
+    print("\nДО (engine и create_all на каждый вызов):")
+    before_insert = measure("вставки", legacy_insert, args.inserts)
+    before_read = measure("чтения (страница+count)", legacy_read, args.reads)
+
+    for name in os.listdir(workdir):
+        os.remove(os.path.join(workdir, name))
+
+    print("\nПОСЛЕ (общий engine, WAL, synchronous=NORMAL):")
+    after_insert = measure("вставки", current_insert, args.inserts)
+    after_read = measure("чтения (страница+count)", current_read, args.reads)
+
+    print("\nУскорение:")
+    print(f"   вставки: x{after_insert / before_insert:.1f}")
+    print(f"   чтения:  x{after_read / before_read:.1f}")
+
+if __name__ == "__main__":
+    main()
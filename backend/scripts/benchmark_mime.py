@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарк извлечения текста из писем: прежний разбор через
+Parser().parsestr() против байтового extract_text() с бюджетом символов.
+
+Запуск из каталога backend:
+    python scripts/benchmark_mime.py --repeat 5
+"""
+
+import argparse
+import os
+import sys
+import time
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.parser import Parser
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from core.smtp.mime import extract_text
+
+TEXT = "Добрый день! Отчёт по проекту готов, проверьте, пожалуйста. "
+
+def build_fixtures() -> dict:
+    """Набор реалистичных писем разного размера."""
+    fixtures = {}
+
+    plain = MIMEText(TEXT * 5, "plain", "utf-8")
+    plain["Subject"] = "Отчет"
+    fixtures["plain 1 KB"] = plain.as_bytes()
+
+    alt = MIMEMultipart("alternative")
+    alt["Subject"] = "Рассылка"
+    alt.attach(MIMEText(TEXT * 200, "plain", "utf-8"))
+    alt.attach(MIMEText("<p>" + TEXT * 200 + "</p>", "html", "utf-8"))
+    fixtures["text+html 50 KB"] = alt.as_bytes()
+
+    for size_mb in (5, 20):
+        mixed = MIMEMultipart("mixed")
+        mixed["Subject"] = f"Документы {size_mb} МБ"
+        mixed.attach(MIMEText(TEXT * 20, "plain", "utf-8"))
+        for i in range(size_mb // 5):
+            attachment = MIMEApplication(os.urandom(5 * 1024 * 1024), Name=f"scan{i}.pdf")
+            attachment["Content-Disposition"] = f'attachment; filename="scan{i}.pdf"'
+            mixed.attach(attachment)
+        fixtures[f"attachments {size_mb} MB"] = mixed.as_bytes()
+
+    huge = MIMEText(TEXT * 30000, "plain", "utf-8")
+    huge["Subject"] = "Длинный текст"
+    fixtures["long text 3 MB"] = huge.as_bytes()
+    return fixtures
+
+def legacy_extract(raw: bytes):
+    """Прежний путь: декодирование конверта в str и полный разбор письма."""
+    email_data = raw.decode("utf-8", errors="ignore")
+    email = Parser().parsestr(email_data)
+    subject = email.get("Subject", "")
+    body = ""
+    if email.is_multipart():
+        for part in email.walk():
+            if part.get_content_type() == "text/plain":
+                body += part.get_payload(decode=True).decode(errors="ignore")
+    else:
+        body = email.get_payload(decode=True).decode(errors="ignore")
+    return subject, body
+
+def timed(func, raw: bytes, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(raw)
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк извлечения текста из MIME")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print("Подготовка писем...")
+    fixtures = build_fixtures()
+
+    print(f"\n{'Письмо':<20} {'Размер':>10} {'Parser, мс':>12} {'bytes, мс':>12} {'Ускорение':>10}")
+    print("-" * 68)
+    for name, raw in fixtures.items():
+        before = timed(legacy_extract, raw, args.repeat)
+        after = timed(extract_text, raw, args.repeat)
+        print(f"{name:<20} {len(raw) / 1024:>8.0f}КБ {before:>12.2f} {after:>12.3f} {before / after:>9.0f}x")
+
+        # Текст должен совпадать с прежним в пределах бюджета
+        _, old_body = legacy_extract(raw)
+        _, new_body = extract_text(raw)
+        if not old_body.startswith(new_body):
+            print(f"   ⚠️ Текст отличается от прежнего разбора")
+
+if __name__ == "__main__":
+    main()
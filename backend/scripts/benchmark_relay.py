@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк пересылки без MailHog: письма отправляются во встроенный
+SMTP-приемник через RelayPool и, для сравнения, через новое соединение
+smtplib на каждое письмо (как было до пула).
+
+Запуск из каталога backend:
+    python scripts/benchmark_relay.py --messages 2000 --threads 8
+"""
+
+import argparse
+import smtplib
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.mime.text import MIMEText
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from core.smtp.relay import RelayPool
+from utils.smtp_sink import SMTPSink
+
+SENDER = "bench@example.com"
+RECIPIENTS = ["recipient@example.com"]
+
+def build_message(size: int) -> str:
+    msg = MIMEText("Отчет по проекту готов. " * max(1, size // 40), "plain", "utf-8")
+    msg["Subject"] = "Бенчмарк пересылки"
+    msg["From"] = SENDER
+    msg["To"] = RECIPIENTS[0]
+    return msg.as_string()
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))] if ordered else 0.0
+
+def run(name: str, send, messages: int, threads: int, sink: SMTPSink) -> dict:
+    sink.handler.reset()
+    latencies = []
+
+    def task(_):
+        started = time.perf_counter()
+        send()
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(task, range(messages)))
+    sink.wait_for(messages, timeout=30)
+    elapsed = time.perf_counter() - started
+    ms = [value * 1000 for value in latencies]
+    result = {
+        "name": name,
+        "msg_s": messages / elapsed,
+        "p50": percentile(ms, 50),
+        "p95": percentile(ms, 95),
+        "p99": percentile(ms, 99),
+        "received": sink.stats()["received"],
+    }
+    print(f"{name:<22} {result['msg_s']:>9.0f} {result['p50']:>9.2f} {result['p95']:>9.2f} "
+          f"{result['p99']:>9.2f} {result['received']:>9}")
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк пересылки во встроенный SMTP-приемник")
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--size", type=int, default=2048, help="Размер письма (байт)")
+    parser.add_argument("--port", type=int, default=11025, help="Порт приемника")
+    args = parser.parse_args()
+
+    sink = SMTPSink("127.0.0.1", args.port, web_port=None, store=False)
+    if not sink.start():
+        return
+    data = build_message(args.size)
+    pool = RelayPool("127.0.0.1", args.port, size=args.threads)
+
+    def send_fresh():
+        with smtplib.SMTP("127.0.0.1", args.port, timeout=10) as server:
+            server.sendmail(SENDER, RECIPIENTS, data)
+
+    print(f"\n{'Способ':<22} {'писем/с':>9} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9} {'принято':>9}")
+    print("-" * 72)
+    try:
+        run("новое соединение", send_fresh, args.messages, args.threads, sink)
+        run("RelayPool", lambda: pool.send(SENDER, RECIPIENTS, data), args.messages, args.threads, sink)
+        print(f"\nСтатистика пула: {pool.stats()}")
+    finally:
+        pool.close()
+        sink.stop()
+
+if __name__ == "__main__":
+    main()
@@ -1,114 +1,340 @@
 #!/usr/bin/env python3
 """
-Отправляет случайные сообщения из датасета для стресс-тестирования системы.
+Нагрузочное тестирование SMTP-фильтра: отправляет письма из датасета,
+mbox или maildir в несколько асинхронных соединений и печатает отчет JSON
+(пропускная способность, перцентили задержки, распределение кодов ответа).
+
+Запуск из каталога backend:
+    python scripts/send_from_dataset.py                              # 30 писем, как раньше
+    python scripts/send_from_dataset.py -n 2000 -c 32 --rate 100     # открытая модель, 100 писем/с
+    python scripts/send_from_dataset.py --mbox archive.mbox -c 8 --reuse 50
+    python scripts/send_from_dataset.py -n 500 --size-mix 1k:70,100k:25,2m:5 -o run.json
 """
 
+import argparse
+import asyncio
 import csv
+import json
+import mailbox
+import os
 import random
-import smtplib
 import time
+from collections import Counter
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
+from typing import List, Optional, Tuple
 
-# --- Настройки ---
+# --- Настройки по умолчанию ---
 DATASET_PATH = 'spam_filter_dataset2.csv'  # Путь к датасету
 SMTP_HOST = 'localhost'
 SMTP_PORT = 10025
 SENDER_EMAIL = 'test@dataset-sender.com'
 RECIPIENT_EMAIL = 'recipient@example.com'
 
-NUM_SAFE = 15      # Количество безопасных сообщений для отправки
-NUM_THREATS = 15   # Количество сообщений с угрозами
+# (метка, тема, тело); метка None для писем из mbox/maildir
+Sample = Tuple[Optional[int], str, str]
 
-# --- Функции ---
+# --- Источники писем ---
 
-def load_messages_from_dataset(path: str):
-    """Загружает сообщения из CSV-файла, разделяя их на безопасные и угрозы."""
-    safe_messages = []
-    threat_messages = []
-    
-    try:
-        with open(path, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                message_text = row['text']
-                label = int(row['label'])
-                
-                # Тема и тело содержат полный текст для максимального контекста
-                subject = message_text[:70] # Ограничим тему для почтовых клиентов
-                body = message_text
-                
-                message = {"subject": subject, "body": body}
-                
-                if label == 0:
-                    safe_messages.append(message)
-                else:
-                    threat_messages.append(message)
-                    
-    except FileNotFoundError:
-        print(f"Ошибка: Файл датасета не найден по пути '{path}'")
-        return None, None
-        
-    print(f"Загружено сообщений из датасета: {len(safe_messages)} безопасных, {len(threat_messages)} с угрозами.")
-    return safe_messages, threat_messages
-
-def send_email(subject: str, body: str, sender: str, recipient: str):
-    """Отправляет одно электронное письмо."""
-    try:
-        msg = MIMEText(body, 'plain', 'utf-8')
-        msg['Subject'] = subject
-        msg['From'] = sender
-        msg['To'] = recipient
+def load_messages_from_dataset(path: str) -> List[Sample]:
+    """Загружает сообщения из CSV-файла с колонками text и label."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return [
+            # Тема ограничена для почтовых клиентов, тело содержит полный текст
+            (int(row['label']), row['text'][:70], row['text'])
+            for row in csv.DictReader(f)
+        ]
 
-        with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=10) as server:
-            server.send_message(msg)
-        return True
-    except Exception as e:
-        print(f"   - Ошибка отправки: {e}")
-        return False
+def load_raw_messages(box) -> List[bytes]:
+    """Письма из mbox или maildir отправляются как есть."""
+    return [message.as_bytes() for message in box]
 
+def select_balanced(samples: List[Sample], count: int) -> List[Sample]:
+    """Поровну безопасных писем и угроз (как прежние 15 + 15)."""
+    safe = [s for s in samples if s[0] == 0]
+    threats = [s for s in samples if s[0] == 1]
+    half = count // 2
+    selected = random.sample(safe, min(half, len(safe))) + random.sample(threats, min(count - half, len(threats)))
+    random.shuffle(selected)
+    return selected
 
-def main():
-    """Главная функция для запуска отправки."""
-    print("--- Запуск скрипта отправки сообщений из датасета ---")
-    
-    # 1. Загружаем сообщения
-    safe_messages, threat_messages = load_messages_from_dataset(DATASET_PATH)
-    if safe_messages is None:
-        return
+# --- Размеры писем ---
 
-    # 2. Выбираем случайные сообщения
-    if len(safe_messages) < NUM_SAFE:
-        print(f"Предупреждение: В датасете меньше {NUM_SAFE} безопасных сообщений. Использую все {len(safe_messages)}.")
-        selected_safe = safe_messages
+_UNITS = {"b": 1, "k": 1024, "m": 1024 * 1024}
+
+def parse_size_mix(spec: str) -> List[Tuple[int, float]]:
+    """'1k:70,100k:25,2m:5' -> [(1024, 70.0), (102400, 25.0), (2097152, 5.0)]."""
+    mix = []
+    for item in spec.split(","):
+        size, _, weight = item.strip().partition(":")
+        size = size.strip().lower()
+        unit = _UNITS.get(size[-1], None)
+        number = float(size[:-1]) if unit else float(size)
+        mix.append((int(number * (unit or 1)), float(weight or 1)))
+    return mix
+
+def build_message(subject: str, body: str, target_size: int = 0) -> bytes:
+    """
+    Собирает письмо; если задан target_size, добивает его до нужного размера
+    вложением со случайными байтами, не меняя текст для классификатора.
+    """
+    text = MIMEText(body, 'plain', 'utf-8')
+    if target_size <= 0:
+        msg = text
     else:
-        selected_safe = random.sample(safe_messages, NUM_SAFE)
-        
-    if len(threat_messages) < NUM_THREATS:
-        print(f"Предупреждение: В датасете меньше {NUM_THREATS} сообщений с угрозами. Использую все {len(threat_messages)}.")
-        selected_threats = threat_messages
+        msg = MIMEMultipart('mixed')
+        msg.attach(text)
+    msg['Subject'] = subject
+    msg['From'] = SENDER_EMAIL
+    msg['To'] = RECIPIENT_EMAIL
+    raw = msg.as_bytes()
+    if target_size > len(raw):
+        # base64 раздувает вложение на треть
+        padding = MIMEApplication(os.urandom((target_size - len(raw)) * 3 // 4), Name="padding.bin")
+        padding['Content-Disposition'] = 'attachment; filename="padding.bin"'
+        msg.attach(padding)
+        raw = msg.as_bytes()
+    return raw
+
+# --- Асинхронный SMTP-клиент ---
+
+class SMTPError(Exception):
+    pass
+
+class AsyncSMTPConnection:
+    """Минимальный SMTP-клиент на asyncio: EHLO, MAIL, RCPT, DATA, RSET, QUIT."""
+
+    def __init__(self, host: str, port: int, timeout: float):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+        self.sent = 0
+
+    async def _reply(self) -> Tuple[int, str]:
+        lines = []
+        while True:
+            line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+            if not line:
+                raise SMTPError("соединение закрыто сервером")
+            lines.append(line.decode('utf-8', errors='replace').rstrip())
+            if line[3:4] != b'-':
+                return int(line[:3]), "\n".join(lines)
+
+    async def _command(self, line: str, expect: tuple = (250,)) -> int:
+        self.writer.write(line.encode('utf-8') + b"\r\n")
+        code, text = await self._reply()
+        if code not in expect:
+            raise SMTPError(text)
+        return code
+
+    async def open(self):
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), self.timeout
+        )
+        code, text = await self._reply()
+        if code != 220:
+            raise SMTPError(text)
+        await self._command("EHLO loadtest")
+
+    async def send(self, sender: str, recipients: List[str], data: bytes) -> int:
+        """Возвращает код ответа на DATA (250, 450, 451, 550...)."""
+        if self.sent:
+            await self._command("RSET")
+        self.sent += 1
+        await self._command(f"MAIL FROM:<{sender}>")
+        for recipient in recipients:
+            await self._command(f"RCPT TO:<{recipient}>", expect=(250, 251))
+        await self._command("DATA", expect=(354,))
+
+        lines = data.replace(b"\r\n", b"\n").split(b"\n")
+        payload = b"\r\n".join(b"." + line if line.startswith(b".") else line for line in lines)
+        self.writer.write(payload + b"\r\n.\r\n")
+        code, _ = await self._reply()
+        return code
+
+    async def close(self):
+        if self.writer is None:
+            return
+        try:
+            self.writer.write(b"QUIT\r\n")
+            await asyncio.wait_for(self.writer.drain(), self.timeout)
+        except Exception:
+            pass
+        self.writer.close()
+        self.writer = None
+
+# --- Нагрузка ---
+
+def percentile(values: List[float], percent: float) -> float:
+    """Перцентиль по методу ближайшего ранга."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(percent / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+class LoadRunner:
+    def __init__(self, args, messages: List[Tuple[Optional[int], bytes]]):
+        self.args = args
+        self.messages = messages
+        self.codes: Counter = Counter()
+        self.latencies: List[float] = []
+        self.confusion: Counter = Counter()
+        self.errors: Counter = Counter()
+
+    async def _worker(self, jobs: asyncio.Queue):
+        args = self.args
+        connection: Optional[AsyncSMTPConnection] = None
+        while True:
+            job = await jobs.get()
+            if job is None:
+                break
+            index, scheduled = job
+            label, data = self.messages[index]
+            # В открытой модели задержка отсчитывается от запланированного момента:
+            # ожидание свободного соединения тоже входит в задержку
+            started = scheduled if scheduled is not None else time.perf_counter()
+            try:
+                if connection is None or connection.sent >= args.reuse:
+                    if connection is not None:
+                        await connection.close()
+                    connection = AsyncSMTPConnection(args.host, args.port, args.timeout)
+                    await connection.open()
+                code = await connection.send(SENDER_EMAIL, [RECIPIENT_EMAIL], data)
+                self.codes[str(code)] += 1
+                self.latencies.append(time.perf_counter() - started)
+                if label is not None:
+                    self.confusion[f"label{label}_{code}"] += 1
+            except (OSError, asyncio.TimeoutError, SMTPError, ValueError) as e:
+                self.codes["error"] += 1
+                self.errors[type(e).__name__] += 1
+                if connection is not None:
+                    await connection.close()
+                connection = None
+        if connection is not None:
+            await connection.close()
+
+    async def run(self) -> dict:
+        args = self.args
+        jobs: asyncio.Queue = asyncio.Queue()
+        workers = [asyncio.create_task(self._worker(jobs)) for _ in range(args.concurrency)]
+
+        started = time.perf_counter()
+        for index in range(len(self.messages)):
+            if args.rate > 0:
+                # Открытая модель: письма уходят по расписанию, не дожидаясь ответов
+                scheduled = started + index / args.rate
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                jobs.put_nowait((index, scheduled))
+            else:
+                jobs.put_nowait((index, None))
+        for _ in workers:
+            jobs.put_nowait(None)
+        await asyncio.gather(*workers)
+        duration = time.perf_counter() - started
+        return self.report(duration)
+
+    def report(self, duration: float) -> dict:
+        args = self.args
+        ms = [value * 1000 for value in self.latencies]
+        completed = len(self.latencies)
+        report = {
+            "config": {
+                "host": args.host,
+                "port": args.port,
+                "messages": len(self.messages),
+                "concurrency": args.concurrency,
+                "rate": args.rate or None,
+                "reuse": args.reuse,
+                "size_mix": args.size_mix,
+            },
+            "duration_s": round(duration, 3),
+            "completed": completed,
+            "throughput_msg_s": round(completed / duration, 2) if duration else 0.0,
+            "latency_ms": {
+                "p50": round(percentile(ms, 50), 2),
+                "p95": round(percentile(ms, 95), 2),
+                "p99": round(percentile(ms, 99), 2),
+                "max": round(max(ms), 2) if ms else 0.0,
+                "mean": round(sum(ms) / len(ms), 2) if ms else 0.0,
+            },
+            "codes": dict(sorted(self.codes.items())),
+        }
+        if self.confusion:
+            report["by_label"] = dict(sorted(self.confusion.items()))
+        if self.errors:
+            report["errors"] = dict(self.errors)
+        return report
+
+def prepare_messages(args) -> List[Tuple[Optional[int], bytes]]:
+    size_mix = parse_size_mix(args.size_mix) if args.size_mix else None
+
+    def target_size() -> int:
+        if not size_mix:
+            return 0
+        sizes, weights = zip(*size_mix)
+        return random.choices(sizes, weights)[0]
+
+    if args.mbox or args.maildir:
+        box = mailbox.mbox(args.mbox) if args.mbox else mailbox.Maildir(args.maildir, create=False)
+        raw = load_raw_messages(box)
+        if not raw:
+            raise SystemExit("В почтовом ящике нет писем")
+        return [(None, random.choice(raw) if args.count > len(raw) else raw[i]) for i in range(args.count or len(raw))]
+
+    samples = load_messages_from_dataset(args.dataset)
+    print(f"Загружено сообщений из датасета: {len(samples)}")
+    if args.count <= len(samples):
+        selected = select_balanced(samples, args.count)
     else:
-        selected_threats = random.sample(threat_messages, NUM_THREATS)
-
-    # 3. Объединяем и перемешиваем
-    all_to_send = selected_safe + selected_threats
-    random.shuffle(all_to_send)
-    
-    total_to_send = len(all_to_send)
-    print(f"\nПодготовлено к отправке {total_to_send} сообщений ({len(selected_safe)} безопасных, {len(selected_threats)} с угрозами).")
-    print("---")
-
-    # 4. Отправляем письма
-    sent_count = 0
-    for i, message in enumerate(all_to_send, 1):
-        print(f"Отправка {i}/{total_to_send}: Тема: '{message['subject']}'")
-        if send_email(message['subject'], message['body'], SENDER_EMAIL, RECIPIENT_EMAIL):
-            sent_count += 1
-        time.sleep(0.5)  # Небольшая задержка, чтобы не перегружать сервер
-    
-    print("---")
-    print(f"Завершено. Отправлено {sent_count} из {total_to_send} сообщений.")
-    print(f"Проверьте результаты в MailHog (http://localhost:8025) и в панели заблокированных писем.")
+        selected = [random.choice(samples) for _ in range(args.count)]
+    return [(label, build_message(subject, body, target_size())) for label, subject, body in selected]
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест SMTP-фильтра")
+    parser.add_argument("--host", default=SMTP_HOST)
+    parser.add_argument("--port", type=int, default=SMTP_PORT)
+    parser.add_argument("--dataset", default=DATASET_PATH, help="CSV с колонками text,label")
+    parser.add_argument("--mbox", help="Отправить письма из mbox вместо датасета")
+    parser.add_argument("--maildir", help="Отправить письма из maildir вместо датасета")
+    parser.add_argument("-n", "--count", type=int, default=30, help="Сколько писем отправить")
+    parser.add_argument("-c", "--concurrency", type=int, default=1, help="Одновременных SMTP-соединений")
+    parser.add_argument("--rate", type=float, default=0,
+                        help="Целевая частота писем/с (открытая модель); 0 — отправлять сразу по готовности")
+    parser.add_argument("--reuse", type=int, default=1, help="Писем на одно соединение до переподключения")
+    parser.add_argument("--size-mix", help="Смесь размеров писем, например 1k:70,100k:25,2m:5")
+    parser.add_argument("--timeout", type=float, default=60, help="Таймаут ответа сервера (секунды)")
+    parser.add_argument("--seed", type=int, help="Зерно генератора для повторяемых прогонов")
+    parser.add_argument("-o", "--output", help="Сохранить отчет JSON в файл")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    args.reuse = max(1, args.reuse)
+    args.concurrency = max(1, args.concurrency)
+
+    print("--- Нагрузочный тест SMTP-фильтра ---")
+    try:
+        messages = prepare_messages(args)
+    except FileNotFoundError as e:
+        print(f"Ошибка: файл не найден: {e.filename}")
+        return
+    total_bytes = sum(len(data) for _, data in messages)
+    print(f"Подготовлено {len(messages)} писем ({total_bytes / 1024:.0f} КБ), "
+          f"соединений: {args.concurrency}, частота: {args.rate or 'максимальная'}")
 
+    report = asyncio.run(LoadRunner(args, messages).run())
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+        print(f"Отчет сохранен: {args.output}")
 
 if __name__ == "__main__":
     main()
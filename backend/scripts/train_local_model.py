@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Обучение локальной модели (хэшированные n-граммы + логистическая регрессия)
+на spam_filter_dataset2.csv и сохранение весов в LOCAL_MODEL_PATH.
+
+Запуск из каталога backend:
+    python scripts/train_local_model.py --epochs 10
+"""
+
+import argparse
+import csv
+import math
+import random
+import sys
+import time
+from array import array
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from core.config import (
+    LOCAL_MODEL_PATH, LOCAL_MODEL_FEATURES, LOCAL_MODEL_LOW, LOCAL_MODEL_HIGH
+)
+from core.local_model import LocalModel, extract_features
+
+def load_dataset(path: str):
+    with open(path, encoding="utf-8") as f:
+        return [(row["text"], int(row["label"])) for row in csv.DictReader(f)]
+
+def split(rows, test_share: float, seed: int):
+    """Стратифицированное разбиение на обучающую и проверочную части."""
+    rng = random.Random(seed)
+    train, test = [], []
+    for label in (0, 1):
+        part = [row for row in rows if row[1] == label]
+        rng.shuffle(part)
+        cut = int(len(part) * test_share)
+        test.extend(part[:cut])
+        train.extend(part[cut:])
+    rng.shuffle(train)
+    return train, test
+
+def train(samples, dim: int, epochs: int, lr: float, l2: float, seed: int) -> LocalModel:
+    """SGD по логистической функции потерь с L2-регуляризацией."""
+    weights = array("f", bytes(4 * dim))
+    bias = 0.0
+    rng = random.Random(seed)
+    order = list(range(len(samples)))
+    for epoch in range(epochs):
+        rng.shuffle(order)
+        rate = lr / (1 + epoch)
+        loss = 0.0
+        for i in order:
+            features, label = samples[i]
+            scale = LocalModel.scale(len(features))
+            z = bias + sum(weights[j] for j in features) * scale
+            z = max(-30.0, min(30.0, z))
+            p = 1.0 / (1.0 + math.exp(-z))
+            loss -= math.log(max(p if label else 1.0 - p, 1e-12))
+            g = p - label
+            bias -= rate * g
+            step = rate * g * scale
+            for j in features:
+                weights[j] -= step + rate * l2 * weights[j]
+        print(f"   эпоха {epoch + 1}: loss={loss / len(samples):.4f}")
+    return LocalModel(weights, bias)
+
+def evaluate(model: LocalModel, rows, low: float, high: float):
+    scores = model.score_batch(text for text, _ in rows)
+    labels = [label for _, label in rows]
+
+    tp = sum(1 for s, y in zip(scores, labels) if s >= 0.5 and y == 1)
+    fp = sum(1 for s, y in zip(scores, labels) if s >= 0.5 and y == 0)
+    fn = sum(1 for s, y in zip(scores, labels) if s < 0.5 and y == 1)
+    correct = sum(1 for s, y in zip(scores, labels) if (s >= 0.5) == bool(y))
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+
+    confident = [(s, y) for s, y in zip(scores, labels) if s <= low or s >= high]
+    confident_correct = sum(1 for s, y in confident if (s >= high) == bool(y))
+    return {
+        "accuracy": correct / len(rows),
+        "precision": precision,
+        "recall": recall,
+        "f1": 2 * precision * recall / (precision + recall) if precision + recall else 0.0,
+        "decided_locally": len(confident) / len(rows),
+        "local_accuracy": confident_correct / len(confident) if confident else 0.0,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Обучение локальной модели классификации")
+    parser.add_argument("--dataset", default="spam_filter_dataset2.csv")
+    parser.add_argument("--output", default=LOCAL_MODEL_PATH)
+    parser.add_argument("--features", type=int, default=LOCAL_MODEL_FEATURES)
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--lr", type=float, default=0.5)
+    parser.add_argument("--l2", type=float, default=1e-6)
+    parser.add_argument("--test-share", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rows = load_dataset(args.dataset)
+    train_rows, test_rows = split(rows, args.test_share, args.seed)
+    print(f"📚 Писем: {len(rows)} (обучение {len(train_rows)}, проверка {len(test_rows)})")
+
+    samples = [(extract_features(text, args.features), label) for text, label in train_rows]
+    started = time.perf_counter()
+    model = train(samples, args.features, args.epochs, args.lr, args.l2, args.seed)
+    print(f"⏱️ Обучение: {time.perf_counter() - started:.1f} с")
+
+    metrics = evaluate(model, test_rows, LOCAL_MODEL_LOW, LOCAL_MODEL_HIGH)
+    print(f"\n📊 Проверка на отложенной выборке:")
+    print(f"   accuracy={metrics['accuracy']:.3f} precision={metrics['precision']:.3f} "
+          f"recall={metrics['recall']:.3f} f1={metrics['f1']:.3f}")
+    print(f"   Решено без LLM (оценка вне ({LOCAL_MODEL_LOW}, {LOCAL_MODEL_HIGH})): "
+          f"{metrics['decided_locally']:.1%}, точность {metrics['local_accuracy']:.3f}")
+
+    started = time.perf_counter()
+    for text, _ in test_rows:
+        model.score(text)
+    per_message = (time.perf_counter() - started) / len(test_rows) * 1000
+    print(f"   Оценка одного письма: {per_message:.3f} мс")
+
+    model.meta = {
+        "trained_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "dataset": Path(args.dataset).name,
+        "samples": len(train_rows),
+        "metrics": {k: round(v, 4) for k, v in metrics.items()},
+    }
+    model.save(args.output)
+    size_kb = Path(args.output).stat().st_size / 1024
+    print(f"\n💾 Модель сохранена: {args.output} ({size_kb:.0f} КБ)")
+
+if __name__ == "__main__":
+    main()
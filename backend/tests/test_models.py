@@ -1,39 +1,135 @@
+import argparse
 import csv
+import hashlib
+import json
+import threading
 import time
-from typing import List, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 from core.ollama.client import _make_ollama_request, test_ollama_connection
+from core.ollama.cache import PROMPT_VERSION
 from core.config import OLLAMA_MODEL, OLLAMA_FALLBACK_MODEL, OLLAMA_BACKUP_MODEL
 
-def load_test_dataset(filename: str = 'spam_filter_dataset2.csv', limit: int = 50) -> List[Tuple[str, int]]:
-    """Загружает тестовый датасет."""
+# Ответы моделей сохраняются построчно: повторный запуск спрашивает только новые тексты
+CACHE_PATH = Path(__file__).resolve().parent / ".model_eval_cache.jsonl"
+
+def load_test_dataset(filename: str = 'spam_filter_dataset2.csv', limit: Optional[int] = 50) -> List[Tuple[str, int]]:
+    """Загружает тестовый датасет (limit=None — весь)."""
     dataset = []
     with open(filename, 'r', encoding='utf-8') as f:
         reader = csv.DictReader(f)
         for i, row in enumerate(reader):
-            if i >= limit:
+            if limit is not None and i >= limit:
                 break
             dataset.append((row['text'], int(row['label'])))
     return dataset
 
-def test_model(model_name: str, dataset: List[Tuple[str, int]]) -> dict:
-    """Тестирует модель на датасете."""
+class ResultCache:
+    """
+    Кэш ответов на диске по ключу (модель, хэш промта, текст). Вместе с
+    задержкой хранится число одновременных запросов, при котором она измерена.
+    """
+
+    def __init__(self, path: Optional[Path] = CACHE_PATH):
+        self.path = path
+        self._items: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        if path is not None and path.exists():
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        item = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # Недописанная строка после прерванного запуска
+                    self._items[item['key']] = item
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\0{PROMPT_VERSION}\0{text}".encode('utf-8')).hexdigest()
+
+    def get(self, model: str, text: str) -> Optional[dict]:
+        return self._items.get(self.make_key(model, text))
+
+    def put(self, model: str, text: str, prediction: int, latency: float, workers: int):
+        item = {'key': self.make_key(model, text), 'model': model, 'prediction': prediction,
+                'latency': latency, 'workers': workers}
+        with self._lock:
+            self._items[item['key']] = item
+            if self.path is not None:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(item) + "\n")
+
+def percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+def _timed_request(text: str, model_name: str) -> Tuple[Optional[int], float]:
+    started = time.perf_counter()
+    prediction = _make_ollama_request(text, model_name)
+    return prediction, time.perf_counter() - started
+
+def test_model(model_name: str, dataset: List[Tuple[str, int]], workers: int = 4,
+               cache: Optional[ResultCache] = None, sequential: int = 10) -> dict:
+    """
+    Тестирует модель на датасете, отправляя до workers запросов одновременно.
+    Задержка под нагрузкой включает ожидание в очереди Ollama, поэтому
+    отдельно замеряются sequential запросов по одному.
+    """
     print(f"\n🧪 Тестирование модели: {model_name}")
     print("=" * 50)
     
+    cache = cache or ResultCache(None)
+    predictions: List[Optional[int]] = [None] * len(dataset)
+    latencies: List[float] = []
+    pending = []
+    for index, (text, _) in enumerate(dataset):
+        cached = cache.get(model_name, text)
+        if cached is not None:
+            predictions[index] = cached['prediction']
+            # Задержки, замеренные при другом числе одновременных запросов, несравнимы
+            if cached.get('workers') == workers:
+                latencies.append(cached['latency'])
+        else:
+            pending.append(index)
+    print(f"   Из кэша: {len(dataset) - len(pending)}, запросов к модели: {len(pending)}")
+    
+    start_time = time.time()
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_timed_request, dataset[i][0], model_name): i for i in pending}
+        for done, future in enumerate(as_completed(futures), 1):
+            index = futures[future]
+            prediction, latency = future.result()
+            predictions[index] = prediction
+            if prediction is not None:
+                # Ошибки не кэшируем: при повторном запуске запрос повторится
+                latencies.append(latency)
+                cache.put(model_name, dataset[index][0], prediction, latency, workers)
+            
+            # Показываем прогресс каждые 10 записей
+            if done % 10 == 0:
+                print(f"Обработано: {done}/{len(pending)}")
+    
+    end_time = time.time()
+
+    # Задержка самой модели: запросы по одному, без очереди и без кэша
+    sequential_ms = []
+    for text, _ in dataset[:sequential]:
+        prediction, latency = _timed_request(text, model_name)
+        if prediction is not None:
+            sequential_ms.append(latency * 1000)
+    
     correct = 0
-    total = 0
     errors = 0
     true_positives = 0  # Правильно определенные угрозы
     false_positives = 0  # Ложные срабатывания
     true_negatives = 0   # Правильно определенные безопасные
     false_negatives = 0  # Пропущенные угрозы
     
-    start_time = time.time()
-    
-    for text, true_label in dataset:
-        total += 1
-        prediction = _make_ollama_request(text, model_name)
-        
+    for prediction, (_, true_label) in zip(predictions, dataset):
         if prediction is None:
             errors += 1
             prediction = 0  # Считаем ошибки как безопасные
@@ -50,18 +146,14 @@ def test_model(model_name: str, dataset: List[Tuple[str, int]]) -> dict:
                 false_positives += 1
             elif prediction == 0 and true_label == 1:
                 false_negatives += 1
-        
-        # Показываем прогресс каждые 10 записей
-        if total % 10 == 0:
-            print(f"Обработано: {total}/{len(dataset)} | Точность: {correct/total:.1%}")
-    
-    end_time = time.time()
     
     # Вычисляем метрики
+    total = len(dataset)
     accuracy = correct / total if total > 0 else 0
     precision = true_positives / (true_positives + false_positives) if (true_positives + false_positives) > 0 else 0
     recall = true_positives / (true_positives + false_negatives) if (true_positives + false_negatives) > 0 else 0
     f1_score = 2 * (precision * recall) / (precision + recall) if (precision + recall) > 0 else 0
+    ms = [value * 1000 for value in latencies]
     
     result = {
         'model': model_name,
@@ -73,6 +165,14 @@ def test_model(model_name: str, dataset: List[Tuple[str, int]]) -> dict:
         'correct': correct,
         'errors': errors,
         'time': end_time - start_time,
+        'requests': len(pending),
+        'latency_p50': percentile(ms, 50),
+        'latency_p95': percentile(ms, 95),
+        'latency_p99': percentile(ms, 99),
+        'workers': workers,
+        'sequential_p50': percentile(sequential_ms, 50),
+        'sequential_p95': percentile(sequential_ms, 95),
+        'sequential_samples': len(sequential_ms),
         'true_positives': true_positives,
         'false_positives': false_positives,
         'true_negatives': true_negatives,
@@ -88,7 +188,11 @@ def print_results(results: dict):
     print(f"   Полнота (Recall): {results['recall']:.1%}")
     print(f"   Точность (Precision): {results['precision']:.1%}")
     print(f"   F1-Score: {results['f1_score']:.3f}")
-    print(f"   Время: {results['time']:.1f} сек")
+    print(f"   Время: {results['time']:.1f} сек (запросов к модели: {results['requests']})")
+    print(f"   Задержка p50/p95/p99 при {results['workers']} одновременных: {results['latency_p50']:.0f} / "
+          f"{results['latency_p95']:.0f} / {results['latency_p99']:.0f} мс")
+    print(f"   Задержка по одному запросу p50/p95: {results['sequential_p50']:.0f} / "
+          f"{results['sequential_p95']:.0f} мс ({results['sequential_samples']} запросов)")
     print(f"   Правильных: {results['correct']}/{results['total']}")
     print(f"   Ошибок: {results['errors']}")
     print()
@@ -99,15 +203,25 @@ def print_results(results: dict):
 
 def main():
     """Основная функция тестирования."""
+    parser = argparse.ArgumentParser(description="Оценка моделей Ollama на датасете")
+    parser.add_argument("--dataset", default="spam_filter_dataset2.csv")
+    parser.add_argument("--limit", type=int, default=50, help="Сколько записей взять (0 — весь датасет)")
+    parser.add_argument("--workers", type=int, default=4, help="Одновременных запросов к Ollama")
+    parser.add_argument("--sequential", type=int, default=10,
+                        help="Сколько запросов отправить по одному для замера задержки модели")
+    parser.add_argument("--models", nargs="*", help="Модели (по умолчанию три из core/config.py)")
+    parser.add_argument("--no-cache", action="store_true", help="Не читать и не сохранять кэш ответов")
+    args = parser.parse_args()
+    
     print("🚀 Запуск тестирования моделей Ollama")
     
     if not test_ollama_connection():
         print("❌ Ollama недоступна. Проверьте подключение.")
         return
     
-    # Загружаем тестовый датасет (первые 50 записей для быстрого тестирования)
+    # Загружаем тестовый датасет (по умолчанию первые 50 записей для быстрого тестирования)
     print("📂 Загрузка тестового датасета...")
-    dataset = load_test_dataset(limit=50)
+    dataset = load_test_dataset(args.dataset, limit=args.limit or None)
     print(f"   Загружено: {len(dataset)} записей")
     
     safe_count = sum(1 for _, label in dataset if label == 0)
@@ -115,12 +229,13 @@ def main():
     print(f"   Безопасных: {safe_count}, Угроз: {threat_count}")
     
     # Список моделей для тестирования
-    models = [OLLAMA_MODEL, OLLAMA_FALLBACK_MODEL, OLLAMA_BACKUP_MODEL]
+    models = args.models or [OLLAMA_MODEL, OLLAMA_FALLBACK_MODEL, OLLAMA_BACKUP_MODEL]
+    cache = ResultCache(None if args.no_cache else CACHE_PATH)
     all_results = []
     
     for model in models:
         try:
-            result = test_model(model, dataset)
+            result = test_model(model, dataset, workers=args.workers, cache=cache, sequential=args.sequential)
             print_results(result)
             all_results.append(result)
         except Exception as e:
@@ -128,13 +243,16 @@ def main():
     
     # Сравнение моделей
     print("\n🏆 СРАВНЕНИЕ МОДЕЛЕЙ:")
-    print("=" * 60)
-    print(f"{'Модель':<30} {'Точность':<12} {'F1-Score':<12} {'Время':<10}")
-    print("-" * 60)
+    print("=" * 92)
+    print(f"{'Модель':<30} {'Точность':<12} {'F1-Score':<12} {'p50, мс':<10} {'p95, мс':<10} "
+          f"{'по одному':<12} {'Время':<10}")
+    print("-" * 92)
     
     for result in all_results:
         model_short = result['model'].split(':')[0]
-        print(f"{model_short:<30} {result['accuracy']:<11.1%} {result['f1_score']:<11.3f} {result['time']:<9.1f}s")
+        print(f"{model_short:<30} {result['accuracy']:<11.1%} {result['f1_score']:<11.3f} "
+              f"{result['latency_p50']:<9.0f} {result['latency_p95']:<9.0f} "
+              f"{result['sequential_p50']:<11.0f} {result['time']:<9.1f}s")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,301 @@
+"""
+Локальная заглушка Ollama для воспроизводимых тестов без моделей и GPU.
+
+Реализует /api/version, /api/tags и /api/generate (обычный и потоковый ответ).
+Вердикт берется из меток датасета, задержка — из заданного распределения,
+ошибки и зависания добавляются с заданной вероятностью.
+
+Запуск из каталога backend (вместо `ollama serve`):
+    python -m utils.mock_ollama --latency lognormal:0.3,0.5 --error-rate 0.01
+"""
+
+import argparse
+import csv
+import json
+import math
+import random
+import re
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+from core.config import OLLAMA_MODEL, OLLAMA_FALLBACK_MODEL, OLLAMA_BACKUP_MODEL
+from core.ollama.cache import normalize_text
+
+MOCK_VERSION = "0.0.0-mock"
+
+# Одиночный промт: Text: "..." перед строкой с ответом
+_TEXT_RE = re.compile(r'Text: "(.*)"\s*\n\s*\nAnswer', re.DOTALL)
+# Пакетный промт: строки вида 3. "..."
+_BATCH_LINE_RE = re.compile(r'^(\d+)\. "(.*)"$', re.MULTILINE)
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """
+    Распределение задержки в секундах:
+    fixed:0.2, uniform:0.1,0.5, normal:0.3,0.1, lognormal:<медиана>,<sigma>, exp:<среднее>.
+    """
+    kind, _, raw = spec.partition(":")
+    params = [float(value) for value in raw.split(",") if value.strip()]
+    kind = kind.strip().lower()
+    if kind == "fixed":
+        return lambda rng: params[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(params[0], params[1])
+    if kind == "normal":
+        return lambda rng: max(0.0, rng.gauss(params[0], params[1]))
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(math.log(params[0]), params[1])
+    if kind == "exp":
+        return lambda rng: rng.expovariate(1 / params[0])
+    raise ValueError(f"Неизвестное распределение задержки: {spec}")
+
+class VerdictOracle:
+    """
+    Детерминированный вердикт по меткам датасета. Текст ищется целиком, затем
+    по суффиксам из слов: так находится и письмо "тема + тело", где тело — текст датасета.
+    """
+
+    MAX_SUFFIXES = 300
+
+    def __init__(self, dataset: Optional[str] = None, unknown_verdict: int = 0, accuracy: float = 1.0):
+        self.labels: Dict[str, int] = {}
+        self.unknown_verdict = unknown_verdict
+        self.accuracy = accuracy
+        if dataset:
+            with open(dataset, encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    self.labels[normalize_text(row["text"])] = int(row["label"])
+
+    def verdict(self, text: str) -> int:
+        normalized = normalize_text(text)
+        label = self.labels.get(normalized)
+        if label is None:
+            words = normalized.split(" ")
+            for i in range(1, min(len(words), self.MAX_SUFFIXES)):
+                label = self.labels.get(" ".join(words[i:]))
+                if label is not None:
+                    break
+        if label is None:
+            label = self.unknown_verdict
+        # Имитация ошибок модели: одно и то же письмо всегда получает один и тот же ответ
+        if self.accuracy < 1.0 and zlib.crc32(normalized.encode("utf-8")) % 10000 >= self.accuracy * 10000:
+            label = 1 - label
+        return label
+
+class MockOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host: str = "localhost", port: int = 11434, dataset: Optional[str] = None,
+                 latency: str = "fixed:0.05", model_latency: Optional[Dict[str, str]] = None,
+                 token_ms: float = 5.0, load_ms: float = 0.0, error_rate: float = 0.0,
+                 timeout_rate: float = 0.0, hang_seconds: float = 300.0,
+                 models: Optional[List[str]] = None, unknown_verdict: int = 0,
+                 accuracy: float = 1.0, seed: Optional[int] = None):
+        super().__init__((host, port), _MockOllamaHandler)
+        self.oracle = VerdictOracle(dataset, unknown_verdict, accuracy)
+        self.latency = parse_latency(latency)
+        self.model_latency = {model: parse_latency(spec) for model, spec in (model_latency or {}).items()}
+        self.token_delay = token_ms / 1000
+        self.load_delay = load_ms / 1000
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.hang_seconds = hang_seconds
+        self.models = models or [OLLAMA_MODEL, OLLAMA_FALLBACK_MODEL, OLLAMA_BACKUP_MODEL]
+        self.stopping = threading.Event()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._loaded = set()
+        self._thread: Optional[threading.Thread] = None
+        self.counters = {"requests": 0, "streamed": 0, "batch": 0, "errors": 0, "timeouts": 0}
+
+    def sample(self, model: str) -> tuple:
+        """Случайные величины одного запроса: (задержка, ошибка?, зависание?, холодный старт?)."""
+        with self._lock:
+            latency = self.model_latency.get(model, self.latency)(self._rng)
+            roll = self._rng.random()
+            cold = model not in self._loaded
+            self._loaded.add(model)
+        return latency, roll < self.error_rate, self.error_rate <= roll < self.error_rate + self.timeout_rate, cold
+
+    def count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+    def start(self):
+        """Запускает сервер в фоновом потоке (для тестов и бенчмарков в одном процессе)."""
+        self._thread = threading.Thread(target=self.serve_forever, name="mock-ollama", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.stopping.set()
+        self.shutdown()
+        self.server_close()
+
+class _MockOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive: клиент держит пул соединений
+    server: MockOllamaServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: dict):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/api/version":
+            self._send_json(200, {"version": MOCK_VERSION})
+        elif self.path == "/api/tags":
+            self._send_json(200, {"models": [{"name": model, "model": model} for model in self.server.models]})
+        elif self.path == "/mock/stats":
+            with self.server._lock:
+                self._send_json(200, dict(self.server.counters))
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path != "/api/generate":
+            self._send_json(404, {"error": "not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except (ValueError, json.JSONDecodeError):
+            self._send_json(400, {"error": "invalid JSON"})
+            return
+
+        server = self.server
+        model = payload.get("model", "")
+        if model not in server.models:
+            self._send_json(404, {"error": f"model '{model}' not found, try pulling it first"})
+            return
+        server.count("requests")
+
+        latency, error, hang, cold = server.sample(model)
+        if cold and server.load_delay:
+            time.sleep(server.load_delay)
+        if hang:
+            server.count("timeouts")
+            server.stopping.wait(server.hang_seconds)
+            self.close_connection = True
+            return
+        if error:
+            server.count("errors")
+            self._send_json(500, {"error": "mock: injected error"})
+            return
+
+        if not payload.get("prompt"):
+            # Как и Ollama: пустой промт только загружает модель и отвечает одним объектом
+            body = self._chunk(model, "", True)
+            body["done_reason"] = "load"
+            self._send_json(200, dict(body, load_duration=int(server.load_delay * 1e9) if cold else 0))
+            return
+
+        response = self._answer(payload["prompt"])
+        tokens = re.findall(r"\S+\s*|\s+", response) or [""]
+        stats = {
+            "total_duration": int((latency + server.token_delay * len(tokens)) * 1e9),
+            "load_duration": int(server.load_delay * 1e9) if cold else 0,
+            "prompt_eval_count": len(payload.get("system", "").split()) + len(payload.get("prompt", "").split()),
+            "eval_count": len(tokens),
+        }
+        if payload.get("stream", True):
+            server.count("streamed")
+            self._stream(model, tokens, latency, stats)
+        else:
+            time.sleep(latency + server.token_delay * len(tokens))
+            self._send_json(200, dict(self._chunk(model, response, True), **stats))
+
+    def _answer(self, prompt: str) -> str:
+        """Ответ модели: вердикт одного текста или строки "номер: вердикт" для пакета."""
+        oracle = self.server.oracle
+        single = _TEXT_RE.search(prompt)
+        if single:
+            return str(oracle.verdict(single.group(1)))
+        items = _BATCH_LINE_RE.findall(prompt)
+        if items:
+            self.server.count("batch")
+            return "\n".join(f"{number}: {oracle.verdict(text)}" for number, text in items)
+        return ""  # Неизвестный формат промта
+
+    @staticmethod
+    def _chunk(model: str, response: str, done: bool) -> dict:
+        chunk = {
+            "model": model,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "response": response,
+            "done": done,
+        }
+        if done:
+            chunk["done_reason"] = "stop"
+        return chunk
+
+    def _stream(self, model: str, tokens: List[str], latency: float, stats: dict):
+        """NDJSON через chunked transfer encoding; первый токен приходит через latency."""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def write(body: dict):
+            data = json.dumps(body).encode("utf-8") + b"\n"
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        try:
+            time.sleep(latency)
+            for i, token in enumerate(tokens):
+                if i:
+                    time.sleep(self.server.token_delay)
+                write(self._chunk(model, token, False))
+            write(dict(self._chunk(model, "", True), **stats))
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # Клиент прервал поток после первого вердикта
+            self.close_connection = True
+
+def main():
+    parser = argparse.ArgumentParser(description="Заглушка Ollama для тестов без моделей")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--dataset", default="spam_filter_dataset2.csv", help="CSV с метками для вердиктов")
+    parser.add_argument("--latency", default="fixed:0.05",
+                        help="Задержка первого токена: fixed:0.2, uniform:0.1,0.5, normal:0.3,0.1, "
+                             "lognormal:<медиана>,<sigma>, exp:<среднее> (секунды)")
+    parser.add_argument("--model-latency", action="append", default=[], metavar="MODEL=SPEC",
+                        help="Отдельное распределение для модели, можно повторять")
+    parser.add_argument("--token-ms", type=float, default=5.0, help="Задержка между токенами (мс)")
+    parser.add_argument("--load-ms", type=float, default=0.0, help="Холодный старт модели при первом запросе (мс)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля ответов HTTP 500")
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="Доля запросов без ответа")
+    parser.add_argument("--hang-seconds", type=float, default=300.0, help="Сколько висит запрос без ответа")
+    parser.add_argument("--models", nargs="*", help="Доступные модели (по умолчанию из core/config.py)")
+    parser.add_argument("--unknown-verdict", type=int, choices=(0, 1), default=0,
+                        help="Вердикт для текстов, которых нет в датасете")
+    parser.add_argument("--accuracy", type=float, default=1.0, help="Доля верных ответов (ошибки детерминированы)")
+    parser.add_argument("--seed", type=int, help="Зерно генератора задержек и ошибок")
+    args = parser.parse_args()
+
+    model_latency = dict(item.split("=", 1) for item in args.model_latency)
+    server = MockOllamaServer(
+        args.host, args.port, args.dataset, args.latency, model_latency, args.token_ms, args.load_ms,
+        args.error_rate, args.timeout_rate, args.hang_seconds, args.models, args.unknown_verdict,
+        args.accuracy, args.seed,
+    )
+    print(f"🧪 Заглушка Ollama: http://{args.host}:{args.port} ({len(server.oracle.labels)} текстов с метками)")
+    print(f"   Модели: {', '.join(server.models)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n🛑 Заглушка Ollama остановлена")
+        server.stop()
+
+if __name__ == "__main__":
+    main()
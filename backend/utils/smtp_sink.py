@@ -0,0 +1,276 @@
+"""
+Встроенный SMTP-приемник на aiosmtpd вместо MailHog.
+
+Принимает пересланные фильтром письма, считает их и при необходимости
+хранит последние в памяти. Небольшой HTTP API повторяет нужную часть
+MailHog (/api/v1/messages), поэтому тесты и статус работают без внешних программ.
+
+Запуск из каталога backend:
+    python -m utils.smtp_sink
+    python app.py start --sink
+"""
+
+import argparse
+import json
+import threading
+import time
+from collections import deque
+from email.header import decode_header, make_header
+from email.parser import BytesHeaderParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+from urllib.parse import parse_qs, urlparse
+from aiosmtpd.controller import Controller
+from core.config import (
+    MAILHOG_HOST, MAILHOG_SMTP_PORT, MAILHOG_WEB_PORT, SMTP_SINK_STORE, SMTP_SINK_MAX_STORED
+)
+
+_header_parser = BytesHeaderParser()
+
+def _subject(data: bytes) -> str:
+    headers = _header_parser.parsebytes(data)
+    try:
+        return str(make_header(decode_header(headers.get("Subject", ""))))
+    except Exception:
+        return str(headers.get("Subject", ""))
+
+class SinkHandler:
+    """Обработчик aiosmtpd: считает письма и складывает их в ограниченный буфер."""
+
+    def __init__(self, store: bool = SMTP_SINK_STORE, max_stored: int = SMTP_SINK_MAX_STORED):
+        self.store = store
+        self.messages: "deque[dict]" = deque(maxlen=max_stored)
+        self._cond = threading.Condition()
+        self._next_id = 1
+        self.received = 0
+        self.bytes = 0
+        self.recipients = 0
+        self.first_at: Optional[float] = None
+        self.last_at: Optional[float] = None
+
+    async def handle_DATA(self, server, session, envelope):
+        now = time.time()
+        with self._cond:
+            self.received += 1
+            self.bytes += len(envelope.content)
+            self.recipients += len(envelope.rcpt_tos)
+            self.first_at = self.first_at or now
+            self.last_at = now
+            if self.store:
+                self.messages.append({
+                    "id": self._next_id,
+                    "from": envelope.mail_from,
+                    "to": list(envelope.rcpt_tos),
+                    "data": envelope.content,
+                    "size": len(envelope.content),
+                    "received_at": now,
+                })
+            self._next_id += 1
+            self._cond.notify_all()
+        return "250 Message accepted for delivery"
+
+    def wait_for(self, count: int, timeout: float = 10) -> bool:
+        """Ждет, пока всего будет принято не меньше count писем."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.received >= count, timeout)
+
+    def query(self, limit: int = 50, start: int = 0, sender: Optional[str] = None,
+              recipient: Optional[str] = None, subject: Optional[str] = None) -> List[dict]:
+        """Сохраненные письма, новые первыми, с фильтрами по отправителю, получателю и теме."""
+        with self._cond:
+            items = list(reversed(self.messages))
+        result = []
+        for item in items:
+            if sender and sender.lower() not in item["from"].lower():
+                continue
+            if recipient and not any(recipient.lower() in to.lower() for to in item["to"]):
+                continue
+            if subject and subject.lower() not in _subject(item["data"]).lower():
+                continue
+            result.append(item)
+        return result[start:start + limit]
+
+    def get(self, message_id: int) -> Optional[dict]:
+        with self._cond:
+            return next((item for item in self.messages if item["id"] == message_id), None)
+
+    def clear(self):
+        with self._cond:
+            self.messages.clear()
+
+    def reset(self):
+        """Очищает письма и счетчики (между прогонами бенчмарка)."""
+        with self._cond:
+            self.messages.clear()
+            self.received = self.bytes = self.recipients = 0
+            self.first_at = self.last_at = None
+
+    def stats(self) -> dict:
+        with self._cond:
+            span = (self.last_at - self.first_at) if self.first_at and self.last_at else 0.0
+            return {
+                "received": self.received,
+                "bytes": self.bytes,
+                "recipients": self.recipients,
+                "stored": len(self.messages),
+                "throughput_msg_s": round((self.received - 1) / span, 2) if span > 0 else 0.0,
+            }
+
+def _summary(item: dict, with_body: bool = False) -> dict:
+    summary = {
+        "ID": item["id"],
+        "From": item["from"],
+        "To": item["to"],
+        "Subject": _subject(item["data"]),
+        "Size": item["size"],
+        "Created": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(item["received_at"])),
+    }
+    if with_body:
+        summary["Raw"] = item["data"].decode("utf-8", errors="replace")
+    return summary
+
+class _SinkAPIHandler(BaseHTTPRequestHandler):
+    handler: SinkHandler = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path in ("/api/v1/messages", "/api/v2/messages"):
+            items = self.handler.query(
+                limit=int(params.get("limit", 50)),
+                start=int(params.get("start", 0)),
+                sender=params.get("from"),
+                recipient=params.get("to"),
+                subject=params.get("subject"),
+            )
+            self._send_json(200, {
+                "total": self.handler.stats()["received"],
+                "count": len(items),
+                "items": [_summary(item) for item in items],
+            })
+        elif url.path.startswith("/api/v1/messages/"):
+            try:
+                item = self.handler.get(int(url.path.rsplit("/", 1)[1]))
+            except ValueError:
+                item = None
+            if item is None:
+                self._send_json(404, {"error": "message not found"})
+            else:
+                self._send_json(200, _summary(item, with_body=True))
+        elif url.path == "/api/stats":
+            self._send_json(200, self.handler.stats())
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_DELETE(self):
+        if urlparse(self.path).path in ("/api/v1/messages", "/api/v2/messages"):
+            self.handler.clear()
+            self._send_json(200, {"deleted": True})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+class SMTPSink:
+    """
+    Замена MailHogManager с тем же интерфейсом (start, stop, status,
+    is_running, clear_messages), но работающая внутри процесса.
+    """
+
+    def __init__(self, host: str = MAILHOG_HOST, smtp_port: int = MAILHOG_SMTP_PORT,
+                 web_port: Optional[int] = MAILHOG_WEB_PORT, store: bool = SMTP_SINK_STORE,
+                 max_stored: int = SMTP_SINK_MAX_STORED):
+        self.host = host
+        self.smtp_port = smtp_port
+        self.web_port = web_port
+        self.handler = SinkHandler(store, max_stored)
+        self._controller: Optional[Controller] = None
+        self._web: Optional[ThreadingHTTPServer] = None
+
+    def is_running(self) -> bool:
+        return self._controller is not None
+
+    def start(self) -> bool:
+        if self.is_running():
+            return True
+        try:
+            self._controller = Controller(self.handler, hostname=self.host, port=self.smtp_port,
+                                          data_size_limit=0)
+            self._controller.start()
+            if self.web_port:
+                api = type("SinkAPIHandler", (_SinkAPIHandler,), {"handler": self.handler})
+                self._web = ThreadingHTTPServer((self.host, self.web_port), api)
+                self._web.daemon_threads = True
+                threading.Thread(target=self._web.serve_forever, name="smtp-sink-api", daemon=True).start()
+        except OSError as e:
+            print(f"❌ Не удалось запустить SMTP-приемник: {e}")
+            self.stop()
+            return False
+        print(f"✅ SMTP-приемник запущен: {self.host}:{self.smtp_port}")
+        if self._web is not None:
+            print(f"   API:  http://{self.host}:{self.web_port}/api/v1/messages")
+        return True
+
+    def stop(self) -> bool:
+        if self._controller is not None:
+            self._controller.stop()
+            self._controller = None
+        if self._web is not None:
+            self._web.shutdown()
+            self._web.server_close()
+            self._web = None
+        return True
+
+    def status(self):
+        if self.is_running():
+            stats = self.handler.stats()
+            print(f"✅ SMTP-приемник работает: {self.host}:{self.smtp_port}")
+            print(f"   Принято писем: {stats['received']} ({stats['bytes'] / 1024:.0f} КБ)")
+        else:
+            print("❌ SMTP-приемник не запущен")
+
+    def clear_messages(self) -> bool:
+        self.handler.clear()
+        return True
+
+    def wait_for(self, count: int, timeout: float = 10) -> bool:
+        return self.handler.wait_for(count, timeout)
+
+    def stats(self) -> dict:
+        return self.handler.stats()
+
+def main():
+    parser = argparse.ArgumentParser(description="SMTP-приемник вместо MailHog")
+    parser.add_argument("--host", default=MAILHOG_HOST)
+    parser.add_argument("--port", type=int, default=MAILHOG_SMTP_PORT)
+    parser.add_argument("--web-port", type=int, default=MAILHOG_WEB_PORT, help="Порт HTTP API (0 — без API)")
+    parser.add_argument("--no-store", action="store_true", help="Только считать письма, не хранить")
+    parser.add_argument("--max-stored", type=int, default=SMTP_SINK_MAX_STORED)
+    args = parser.parse_args()
+
+    sink = SMTPSink(args.host, args.port, args.web_port or None, not args.no_store, args.max_stored)
+    if not sink.start():
+        return
+    try:
+        last = 0
+        while True:
+            time.sleep(5)
+            stats = sink.stats()
+            if stats["received"] != last:
+                print(f"📬 Принято: {stats['received']}, {stats['throughput_msg_s']} писем/с")
+                last = stats["received"]
+    except KeyboardInterrupt:
+        print("\n🛑 SMTP-приемник остановлен")
+        sink.stop()
+
+if __name__ == "__main__":
+    main()